@@ -1 +1,5 @@
-from dixit.server import start
+def start():
+    """Runs the server, importing it only when needed (see dixit.server)."""
+    from dixit.server import start
+
+    start()
@@ -0,0 +1,68 @@
+"""Scripts and styles that are rendered from templates only once."""
+
+import gzip
+import hashlib
+import os
+
+import tornado.template
+import tornado.web
+
+from dixit.utils import accepts_gzip
+
+CONTENT_TYPES = {".js": "text/javascript", ".css": "text/css"}
+
+
+class Asset:
+    """A rendered file, with a content-hashed url and a gzipped copy."""
+
+    def __init__(self, name, body):
+        """Initializes the asset with the given name (e.g., main.js) and body."""
+        root, ext = os.path.splitext(name)
+        fingerprint = hashlib.sha256(body).hexdigest()[:16]
+        self.name = name
+        self.url = "%s.%s%s" % (root, fingerprint, ext)  # relative, like the name
+        self.content_type = CONTENT_TYPES[ext]
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = fingerprint
+
+
+def render_assets(template_path, namespaces):
+    """Returns a dict of name -> Asset, rendering each named template once."""
+    loader = tornado.template.Loader(template_path)
+    return dict(
+        (name, Asset(name, loader.load(name).generate(**namespace)))
+        for name, namespace in namespaces.items()
+    )
+
+
+class AssetHandler(tornado.web.RequestHandler):
+    """Handler for an asset, by its fingerprinted url or by its name.
+
+    A fingerprinted url never changes its content, so browsers may cache it
+    forever. By its name, the asset has to be revalidated by its ETag.
+    """
+
+    CACHE_FOREVER = "public, max-age=31536000, immutable"
+
+    def get(self, path):
+        asset = self.application.assets_by_url.get(path)
+        if asset is None:
+            raise tornado.web.HTTPError(404)
+        if path == asset.url:
+            self.set_header("Cache-Control", self.CACHE_FOREVER)
+        else:
+            self.set_header("Cache-Control", "no-cache")
+        self.set_header("Content-Type", asset.content_type)
+        self.set_header("Vary", "Accept-Encoding")
+        if accepts_gzip(self.request.headers.get("Accept-Encoding", "")):
+            self.set_header("Content-Encoding", "gzip")
+            self.set_header("Etag", '"%s.gz"' % asset.etag)
+            body = asset.gzipped
+        else:
+            self.set_header("Etag", '"%s"' % asset.etag)
+            body = asset.body
+        if self.check_etag_header():
+            self.set_status(304)
+        else:
+            self.write(body)
@@ -0,0 +1 @@
+"""Benchmarks for the Dixit server, each runnable with python -m."""
@@ -0,0 +1,177 @@
+"""Benchmark of the latency that server-side bots add for the players.
+
+Usage: python -m dixit.benchmarks.bots [--bots N] [--seconds N] [--output FILE]
+
+This requires NumPy (pip install dixit[sim]). Starts a server in this process,
+with tables of four bots each, which play game after game, and times a player
+requesting their board again and again, first while the bots wait for their
+games to start, and then while they play. Reports the latency percentiles of
+the player's requests in both cases, and how many actions the bots took per
+second, at most per tick, and for how long their ticks held the IOLoop.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+
+from dixit.benchmarks.core import COLOURS, get_revision, make_card_sets
+from dixit.bots import Bots
+from dixit.core import Game, States
+from dixit.server import Commands, load_settings, make_application
+from dixit.similarity import SimilarityIndex, hash_features
+from dixit.utils import INFINITY, hash_obj
+
+BOTS_PER_TABLE = 4
+
+
+def _format(percentiles):
+    return ", ".join(
+        "%s %.2f ms" % (key, value * 1000) for key, value in percentiles.items()
+    )
+
+
+def _percentiles(seconds):
+    seconds = sorted(seconds)
+    return dict(
+        ("p%d" % p, seconds[min(len(seconds) - 1, len(seconds) * p // 100)])
+        for p in (50, 90, 99)
+    )
+
+
+async def _time_requests(client, url, headers, seconds):
+    """Returns the latency of each request to the url, made for the seconds."""
+    latencies = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        await client.fetch(url, headers=headers)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run(bots, seconds, min_delay=None, max_delay=None):
+    """Returns a report of a player's latency with and without playing bots.
+
+    The bots think for as long as configured, unless the delays are given.
+    """
+    settings = load_settings()
+    bots_config = dict(settings["bots"])
+    if min_delay is not None:
+        bots_config.update(min_delay=min_delay, max_delay=max_delay)
+    application = make_application(
+        settings,
+        bots=bots_config,
+        rate_limits=dict(settings["rate_limits"], enable=False),
+    )
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets(sockets)
+    base_url = "http://127.0.0.1:%d" % sockets[0].getsockname()[1]
+
+    card_sets = make_card_sets(84)
+    features = np.stack(
+        [hash_features(hash_obj(card.cid)[:16]) for card in card_sets[0]]
+    )
+    application.bots.index = SimilarityIndex(features, card_sets)
+    host = application.users.add_user("host", "host")
+
+    def add_table():
+        game = Game(host, card_sets, "", "Bots", 6, INFINITY, 100, application.limits)
+        gid = application.add_game(game)
+        for _ in range(BOTS_PER_TABLE):
+            application.bots.add_bot(gid, game)
+        return gid, game
+
+    tables = [add_table() for _ in range(bots // BOTS_PER_TABLE)]
+    player = application.users.add_user("player", "player")
+    game = Game(player, card_sets, "", "Human", 6, INFINITY, 100, application.limits)
+    game.add_player(player, COLOURS[0])
+    url = base_url + "/game/%d/%d" % (application.add_game(game), Commands.GET_BOARD)
+    headers = {"Cookie": "dixit_user=player"}
+    client = tornado.httpclient.AsyncHTTPClient()
+
+    # Times the ticks of the bots, and replaces the tables that finish
+    ticks = []
+    actions = [0]
+    tick = Bots.tick
+
+    def timed_tick(self):
+        start = time.perf_counter()
+        before = self.actions
+        tick(self)
+        ticks.append(time.perf_counter() - start)
+        actions[0] = max(actions[0], self.actions - before)
+        for i, (gid, game) in enumerate(tables):
+            if game.state == States.END:
+                application.remove_game(gid)
+                tables[i] = add_table()
+                tables[i][1].start_game()
+
+    Bots.tick = timed_tick
+    callback = tornado.ioloop.PeriodicCallback(
+        lambda: application.bots.tick(), application.bots.interval * 1000
+    )
+    callback.start()
+    try:
+        idle = await _time_requests(client, url, headers, seconds)
+        for _, game in tables:
+            game.start_game()
+        del ticks[:]
+        start_actions = application.bots.actions
+        start = time.perf_counter()
+        playing = await _time_requests(client, url, headers, seconds)
+        elapsed = time.perf_counter() - start
+    finally:
+        callback.stop()
+        Bots.tick = tick
+    server.stop()
+    return {
+        "revision": get_revision(),
+        "bots": len(tables) * BOTS_PER_TABLE,
+        "seconds": seconds,
+        "idle": _percentiles(idle),
+        "playing": _percentiles(playing),
+        "actionsPerSecond": (application.bots.actions - start_actions) / elapsed,
+        "maxActionsPerTick": actions[0],
+        "tick": dict(_percentiles(ticks), max=max(ticks)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--bots", type=int, default=1000, help="at the tables")
+    parser.add_argument("--seconds", type=float, default=10, help="of requests")
+    parser.add_argument("--min-delay", type=float, help="that the bots think")
+    parser.add_argument("--max-delay", type=float, help="that the bots think")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: run(args.bots, args.seconds, args.min_delay, args.max_delay)
+    )
+    print("player, with %d idle bots: %s" % (report["bots"], _format(report["idle"])))
+    print(
+        "player, with %d playing bots: %s"
+        % (report["bots"], _format(report["playing"]))
+    )
+    print(
+        "bots: %.0f actions/s, at most %d per tick, ticks of %s"
+        % (
+            report["actionsPerSecond"],
+            report["maxActionsPerTick"],
+            _format(report["tick"]),
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""Microbenchmarks for the core game engine.
+
+Usage: python -m dixit.benchmarks.core [--output FILE] [--compare FILE] ...
+
+Times full game lifecycles, each state transition, the helpers on the hot
+path, and board construction, at every number of players and several deck
+sizes. Results are written as JSON, and can be compared against those of a
+previous run to catch performance regressions between versions.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+from dixit import config
+from dixit.core import Game, Limits, States, StringClue
+from dixit.deck import CardSet
+from dixit.display import BunnyPalette
+from dixit.replay import dump, replay
+from dixit.users import Users
+from dixit.utils import INFINITY, get_sorted_positions
+import dixit.views as views
+
+PLAYERS = (3, 4, 5, 6)
+DECK_SIZES = (84, 336, 1344)  # one, four, and sixteen boxes of Dixit cards
+
+COLOURS = [
+    BunnyPalette.RED,
+    BunnyPalette.ORANGE,
+    BunnyPalette.YELLOW,
+    BunnyPalette.GREEN,
+    BunnyPalette.BLUE,
+    BunnyPalette.PURPLE,
+]
+
+CONFIG_FILENAME = os.path.join(os.path.dirname(__file__), "..", "config.json")
+
+
+def make_context():
+    """Returns a stand-in for the Application, with what the views need."""
+    limits = Limits(config.parse(CONFIG_FILENAME)["limits"])
+    return types.SimpleNamespace(
+        limits=limits, users=Users(limits), board_cache=views.BoardCache()
+    )
+
+
+def make_card_sets(deck_size):
+    """Returns a list with one card set of the given size."""
+    return [CardSet("Bench", ["%d.jpg" % i for i in range(deck_size)])]
+
+
+def make_users(context, players):
+    """Returns the given number of new users."""
+    return [context.users.add_user("uid%d" % i, "puid%d" % i) for i in range(players)]
+
+
+def make_game(context, card_sets, users, seed=0):
+    """Returns a game in the BEGIN state, which the users have joined."""
+    game = Game(
+        users[0],
+        card_sets,
+        "",
+        "Bench",
+        len(users),
+        INFINITY,
+        100,
+        context.limits,
+        seed,
+    )
+    for user, colour in zip(users, COLOURS):
+        game.add_player(user, colour)
+    return game
+
+
+def create_clue(game):
+    """Makes the clue maker create a clue with the first card in their hand."""
+    user = game.clue_maker()
+    game.create_clue(user, StringClue("a benchmark clue"), game.players[user].hand[0])
+
+
+def play_cards(game):
+    """Makes every player play the first card in their hand."""
+    for user, player in game.players.items():
+        if not game.round.has_played(user):
+            game.play_card(user, player.hand[0])
+
+
+def cast_votes(game, rng):
+    """Makes every player vote for a random card other than their own."""
+    cards = game.round.get_cards()
+    for user in game.players:
+        if not game.round.has_voted(user):
+            own = game.round.get_played_card(user)
+            game.cast_vote(user, rng.choice([card for card in cards if card != own]))
+
+
+def play_game(game, rng):
+    """Plays a game in the BEGIN state until it ends, and returns the rounds."""
+    game.start_game()
+    while game.state != States.END:
+        create_clue(game)
+        play_cards(game)
+        cast_votes(game, rng)
+    return game.round.number
+
+
+def advance(game, state):
+    """Plays a game in the BEGIN state up to the given state in its first round."""
+    actions = {
+        States.BEGIN: game.start_game,
+        States.CLUE: lambda: create_clue(game),
+        States.PLAY: lambda: play_cards(game),
+    }
+    while game.state != state:
+        actions[game.state]()
+    return game
+
+
+class Benchmark:
+    """A function timed for some number of players and deck size.
+
+    Each call of setup(context, game), with a game that the players have
+    joined, prepares the argument to one timed call of run. If run is
+    repeatable, i.e., it does not change what it runs on, then the argument
+    is prepared once for all calls, which keeps the (untimed) setup short.
+    """
+
+    def __init__(self, name, run, setup=None, repeatable=False):
+        self.name = name
+        self.run = run
+        self.setup = setup if setup is not None else (lambda context, game: game)
+        self.repeatable = repeatable
+
+
+def _at(state):
+    return lambda context, game: advance(game, state)
+
+
+def _with_context(state):
+    return lambda context, game: (context, advance(game, state))
+
+
+def _has_cards(game):
+    for card in game.round.get_cards():
+        game.round.has_card(card)
+
+
+def _get_cards(args):
+    game, cids = args
+    for cid in cids:
+        game.get_card(cid)
+
+
+def _deal_cids(context, game):
+    return game, [game.deck.deal().cid for _ in range(game.deck.size())]
+
+
+def _deal_all(deck):
+    while deck.deal() is not None:
+        pass
+
+
+def _prepare_scoring(context, game):
+    cards = advance(game, States.VOTE).round.get_cards()
+    for i, user in enumerate(game.players):  # without triggering the scoring
+        if not game.round.has_voted(user):
+            game.round.cast_vote(user, cards[i % len(cards)])
+    return game
+
+
+def _public_board(args):
+    context, game = args
+    views.public_board(context, game)
+
+
+def _private_boards(args):
+    _, game = args
+    for user in game.players:
+        views.private_board(user, game)
+
+
+def _cached_boards(args):
+    context, game = args
+    for user in game.players:
+        views.board(context, user, game)
+
+
+def _recorded_game(context, game):
+    play_game(game, random.Random(0))
+    return dump(game)
+
+
+def _warm_cache(context, game):
+    args = _with_context(States.VOTE)(context, game)
+    _cached_boards(args)
+    return args
+
+
+BENCHMARKS = [
+    Benchmark("lifecycle", lambda game: play_game(game, random.Random(0))),
+    Benchmark("start_game", lambda game: game.start_game()),
+    Benchmark("create_clue", create_clue, _at(States.CLUE)),
+    Benchmark("play_cards", play_cards, _at(States.PLAY)),
+    Benchmark(
+        "cast_votes", lambda game: cast_votes(game, random.Random(0)), _at(States.VOTE)
+    ),
+    Benchmark(
+        "do_scoring", lambda game: game._do_scoring(), _prepare_scoring, repeatable=True
+    ),
+    Benchmark("round.has_card", _has_cards, _at(States.VOTE), repeatable=True),
+    Benchmark(
+        "get_sorted_positions",
+        lambda scores: get_sorted_positions(list(scores), key=scores.get),
+        lambda context, game: dict(
+            (user.puid, i % 3) for i, user in enumerate(game.players)
+        ),
+        repeatable=True,
+    ),
+    Benchmark("deck.deal", _deal_all, lambda context, game: game.deck),
+    Benchmark("deck.get_card", _get_cards, _deal_cids, repeatable=True),
+    Benchmark(
+        "public_board", _public_board, _with_context(States.VOTE), repeatable=True
+    ),
+    Benchmark(
+        "private_boards", _private_boards, _with_context(States.VOTE), repeatable=True
+    ),
+    Benchmark("cached_boards", _cached_boards, _warm_cache, repeatable=True),
+    Benchmark("replay", replay, _recorded_game, repeatable=True),
+]
+
+
+def measure(benchmark, players, deck_size, repeat, min_time):
+    """Returns the timings of one benchmark, in seconds per call.
+
+    Like timeit, the number of calls per sample is doubled until a sample takes
+    at least min_time, and the best and median of repeat samples are reported.
+    """
+    context = make_context()
+    card_sets = make_card_sets(deck_size)
+    users = make_users(context, players)
+
+    def sample(number):
+        if benchmark.repeatable:
+            args = [benchmark.setup(context, make_game(context, card_sets, users))]
+            args *= number
+        else:
+            args = [
+                benchmark.setup(context, make_game(context, card_sets, users))
+                for _ in range(number)
+            ]
+        run = benchmark.run
+        start = time.perf_counter()
+        for arg in args:
+            run(arg)
+        return time.perf_counter() - start
+
+    number = 1
+    while sample(number) < min_time:
+        number *= 2
+    samples = [sample(number) / number for _ in range(repeat)]
+    return {
+        "name": benchmark.name,
+        "players": players,
+        "deckSize": deck_size,
+        "number": number,
+        "best": min(samples),
+        "median": statistics.median(samples),
+    }
+
+
+def get_revision():
+    """Returns the git revision of this checkout, or None."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(names, players, deck_sizes, repeat, min_time):
+    """Returns the results of the named benchmarks for every parameter."""
+    results = []
+    for benchmark in BENCHMARKS:
+        if names and benchmark.name not in names:
+            continue
+        for num_players in players:
+            for deck_size in deck_sizes:
+                result = measure(benchmark, num_players, deck_size, repeat, min_time)
+                print(
+                    "%-22s players=%d deck=%-5d %10.2f us"
+                    % (benchmark.name, num_players, deck_size, result["median"] * 1e6)
+                )
+                results.append(result)
+    return {
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """Prints the change in each median, and returns the number of regressions."""
+    key = lambda result: (result["name"], result["players"], result["deckSize"])
+    old = dict((key(result), result) for result in baseline["results"])
+    regressions = 0
+    print("compared to %s:" % (baseline.get("revision") or "baseline"))
+    for result in report["results"]:
+        if key(result) not in old:
+            continue
+        ratio = result["median"] / old[key(result)]["median"]
+        regressed = ratio > 1 + threshold
+        regressions += regressed
+        print(
+            "%-22s players=%d deck=%-5d %6.2fx%s"
+            % (key(result) + (ratio, "  REGRESSION" if regressed else ""))
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON file of a previous run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="slowdown that is a regression"
+    )
+    parser.add_argument("--only", nargs="+", help="names of benchmarks to run")
+    parser.add_argument("--players", type=int, nargs="+", default=PLAYERS)
+    parser.add_argument("--deck-sizes", type=int, nargs="+", default=DECK_SIZES)
+    parser.add_argument("--repeat", type=int, default=5, help="samples per result")
+    parser.add_argument(
+        "--min-time", type=float, default=0.005, help="seconds per sample"
+    )
+    args = parser.parse_args(argv)
+
+    report = run_all(
+        args.only, args.players, args.deck_sizes, args.repeat, args.min_time
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Benchmark of the API's response encodings, on realistic payloads.
+
+Usage: python -m dixit.benchmarks.encoding [--players N] [--games N] [--output FILE]
+
+Encodes each payload that the API serves (a player's board in every state of
+a round, a lobby full of games, the user list, and a chat log) with tornado's
+default JSON, and with each of the serializers (see dixit.serializers), plain
+and gzipped as the server would. Reports the median microseconds to encode,
+and the bytes, of each payload in each encoding. MessagePack is only measured
+if it is installed.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+
+import tornado.escape
+
+from dixit import config
+from dixit.benchmarks.core import (
+    CONFIG_FILENAME,
+    advance,
+    cast_votes,
+    get_revision,
+    make_context,
+    make_game,
+)
+from dixit.chat import ChatLog
+from dixit.core import States
+from dixit.deck import CardSet
+from dixit.lobby import Lobby
+from dixit.serializers import SERIALIZERS
+from dixit.utils import hash_obj
+import dixit.views as views
+
+STATES = (
+    ("begin", States.BEGIN),
+    ("clue", States.CLUE),
+    ("play", States.PLAY),
+    ("vote", States.VOTE),
+)
+
+
+def _tornado_json(obj):
+    return tornado.escape.json_encode(obj).encode("utf-8")
+
+
+def get_encoders(gzip_level):
+    """Returns a list of (name, encode), where encode returns the bytes."""
+    encoders = [("tornado", _tornado_json)]
+    for serializer in SERIALIZERS:
+        encoders.append((serializer.name, serializer.dumps))
+        encoders.append(
+            (
+                serializer.name + "+gzip",
+                lambda obj, dumps=serializer.dumps: gzip.compress(
+                    dumps(obj), gzip_level, mtime=0
+                ),
+            )
+        )
+    return encoders
+
+
+def make_payloads(players, games, users, messages):
+    """Returns a list of (name, obj) of the API's responses, as on a server.
+
+    The users have hashed puids and the cards have content-hashed urls, as
+    their sizes dominate those of the boards.
+    """
+    context = make_context()
+    context.lobby = Lobby()
+    card_sets = [
+        CardSet("Bench", ["cards/%s.jpg" % hash_obj(i)[:16] for i in range(84)])
+    ]
+    members = [
+        context.users.add_user(hash_obj(i), hash_obj(i, add_random=True))
+        for i in range(max(players, users))
+    ]
+    for i, user in enumerate(members):
+        user.name = "Player %d" % i
+    payloads = []
+    game = make_game(context, card_sets, members[:players])
+    for name, state in STATES:
+        advance(game, state)
+        payloads.append(("board." + name, views.board(context, members[0], game)))
+    cast_votes(game, random.Random(0))
+    payloads.append(("board.scored", views.board(context, members[0], game)))
+    for gid in range(games):
+        context.lobby.update(gid, make_game(context, card_sets, members[:players]))
+    payloads.append(("game_list", views.game_list(context, members[0])))
+    payloads.append(("user_list", views.user_list(context)))
+    chat_log = ChatLog()
+    for i in range(messages):
+        chat_log.add(members[i % users].name, "a chat message of sorts, #%d" % i)
+    payloads.append(("chat", views.chat_since(chat_log, 0)))
+    return payloads
+
+
+def measure(encode, obj, repeat, min_time):
+    """Returns the median seconds to encode the object, and its encoding."""
+
+    def sample(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            encode(obj)
+        return time.perf_counter() - start
+
+    number = 1
+    while sample(number) < min_time:
+        number *= 2
+    samples = [sample(number) / number for _ in range(repeat)]
+    return statistics.median(samples), encode(obj)
+
+
+def run(players, games, users, messages, repeat, min_time):
+    """Returns a report of the time and bytes of each payload and encoding."""
+    gzip_level = config.parse(CONFIG_FILENAME)["api_encoding"]["gzip_level"]
+    results = []
+    for payload, obj in make_payloads(players, games, users, messages):
+        for encoding, encode in get_encoders(gzip_level):
+            seconds, body = measure(encode, obj, repeat, min_time)
+            results.append(
+                {
+                    "payload": payload,
+                    "encoding": encoding,
+                    "seconds": seconds,
+                    "bytes": len(body),
+                }
+            )
+    return {
+        "revision": get_revision(),
+        "players": players,
+        "games": games,
+        "users": users,
+        "messages": messages,
+        "gzipLevel": gzip_level,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--players", type=int, default=6, help="per game")
+    parser.add_argument("--games", type=int, default=100, help="in the lobby")
+    parser.add_argument("--users", type=int, default=500, help="in the user list")
+    parser.add_argument("--messages", type=int, default=100, help="in the chat")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per result")
+    parser.add_argument(
+        "--min-time", type=float, default=0.005, help="seconds per sample"
+    )
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = run(
+        args.players,
+        args.games,
+        args.users,
+        args.messages,
+        args.repeat,
+        args.min_time,
+    )
+    for result in report["results"]:
+        print(
+            "%-14s %-13s %10.1f us %8d bytes"
+            % (
+                result["payload"],
+                result["encoding"],
+                result["seconds"] * 1e6,
+                result["bytes"],
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark of pushing a game's board to many spectators.
+
+Usage: python -m dixit.benchmarks.fanout [--spectators N] [--updates N] [--output FILE]
+
+Starts a server in this process, connects the spectators to the push channel
+of one game, and then changes the game repeatedly, each time waiting for the
+change to reach every spectator. Reports the median seconds for an update to
+reach all of them, of which the server spent pushing it (the rest is spent by
+the spectators, in this same process), and the boards that the server encoded
+per update, which should be about one however many spectators there are.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.websocket
+
+from dixit.benchmarks.core import COLOURS, get_revision, make_card_sets
+from dixit.core import Game
+from dixit.pubsub import Topics
+from dixit.server import PushHandler, load_settings, make_application
+from dixit.utils import INFINITY
+
+PLAYERS = 4
+
+
+async def run(spectators, updates):
+    """Returns a report of pushing updates of one game to the spectators."""
+    settings = load_settings()
+    application = make_application(
+        settings, rate_limits=dict(settings["rate_limits"], enable=False)
+    )
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets(sockets)
+    url = "ws://127.0.0.1:%d/push" % sockets[0].getsockname()[1]
+
+    host = application.users.add_user("host", "host")
+    game = Game(
+        host, make_card_sets(84), "", "Watched", 6, INFINITY, 100, application.limits
+    )
+    topic = Topics.game(application.add_game(game))
+    for i in range(PLAYERS):
+        player = application.users.add_user("player%d" % i, "player%d" % i)
+        game.add_player(player, COLOURS[i])
+    for i in range(spectators):
+        application.users.add_user("uid%d" % i, "puid%d" % i)
+    connections = []
+    for i in range(spectators):
+        request = tornado.httpclient.HTTPRequest(
+            url, headers={"Cookie": "dixit_user=uid%d" % i}
+        )
+        connection = await tornado.websocket.websocket_connect(request)
+        connection.write_message(json.dumps({"subscribe": topic}))
+        connections.append(connection)
+    for connection in connections:
+        await connection.read_message()  # the full board
+
+    # Times the pushes of the server, out of the time to reach the spectators
+    pushing = [0.0]
+    push_pending = PushHandler._push_pending
+
+    def timed_push_pending(handler):
+        start = time.perf_counter()
+        push_pending(handler)
+        pushing[0] += time.perf_counter() - start
+
+    PushHandler._push_pending = timed_push_pending
+    colours = COLOURS[PLAYERS : PLAYERS + 2]
+    seconds = []
+    server_seconds = []
+    encoded = application.spectator_boards.encoded
+    message_bytes = 0
+    try:
+        for i in range(updates):
+            start = time.perf_counter()
+            pushing[0] = 0.0
+            game.add_player(host, colours[i % 2])  # changes the host's colour
+            for connection in connections:
+                message = await connection.read_message()
+            seconds.append(time.perf_counter() - start)
+            server_seconds.append(pushing[0])
+            message_bytes += len(message)
+    finally:
+        PushHandler._push_pending = push_pending
+
+    for connection in connections:
+        connection.close()
+    server.stop()
+    return {
+        "revision": get_revision(),
+        "spectators": spectators,
+        "updates": updates,
+        "secondsPerUpdate": statistics.median(seconds),
+        "serverSecondsPerUpdate": statistics.median(server_seconds),
+        "encodedPerUpdate": (application.spectator_boards.encoded - encoded) / updates,
+        "bytesPerMessage": message_bytes / updates,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--spectators", type=int, default=500, help="of the game")
+    parser.add_argument("--updates", type=int, default=50, help="to the game")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: run(args.spectators, args.updates)
+    )
+    print(
+        "%d spectators: %.2f ms (%.2f ms pushing) and %.1f encodings per update, "
+        "%.0f bytes each"
+        % (
+            args.spectators,
+            report["secondsPerUpdate"] * 1000,
+            report["serverSecondsPerUpdate"] * 1000,
+            report["encodedPerUpdate"],
+            report["bytesPerMessage"],
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
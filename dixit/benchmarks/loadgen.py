@@ -0,0 +1,480 @@
+"""Load generator that plays full games with bots over HTTP.
+
+Usage: python -m dixit.benchmarks.loadgen [--tables N] [--duration SECONDS] ...
+
+Starts a local server (unless given --url), and then seats bots at a number
+of concurrent tables. Each bot polls exactly like main.js does without the
+push channel, and every table plays one game after another, through every
+command, until the duration elapses. Reports latency percentiles per endpoint
+and command, requests per second, errors by code, and the server's RSS.
+"""
+
+import argparse
+from collections import Counter, defaultdict
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
+from dixit.codes import Codes
+from dixit.core import States
+from dixit.display import BunnyPalette
+from dixit.server import Commands
+from dixit.views import apply_merge_patch
+
+# Same as in main.js
+GAMELIST_INTERVAL = 10
+USERLIST_INTERVAL = 20
+CHATROOM_INTERVAL = 3
+GAMEBOARD_INTERVAL = 4
+
+# The fingerprinted scripts and styles in the main page, e.g., main.<hash>.js
+ASSET_URL = re.compile(r'"((main)\.[0-9a-f]+(\.js|\.css))"')
+
+COLOURS = [
+    BunnyPalette.RED,
+    BunnyPalette.ORANGE,
+    BunnyPalette.YELLOW,
+    BunnyPalette.GREEN,
+    BunnyPalette.BLUE,
+    BunnyPalette.PURPLE,
+    BunnyPalette.PINK,
+]
+
+COMMAND_NAMES = dict(
+    (value, name) for name, value in vars(Commands).items() if name.isupper()
+)
+CODE_NAMES = dict(
+    (value, name) for name, value in vars(Codes).items() if name.isupper()
+)
+
+
+def percentile(sorted_values, q):
+    """Returns the q-th percentile of the sorted values (nearest rank)."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(q / 100.0 * len(sorted_values)))
+    return sorted_values[index]
+
+
+def get_rss(pid):
+    """Returns the total RSS in bytes of a process and its children, or None.
+
+    This reads /proc, and so only works on Linux.
+    """
+    try:
+        with open("/proc/%d/status" % pid) as status:
+            rss = next(
+                int(line.split()[1]) * 1024
+                for line in status
+                if line.startswith("VmRSS:")
+            )
+        with open("/proc/%d/task/%d/children" % (pid, pid)) as children:
+            for child in children.read().split():
+                rss += get_rss(int(child)) or 0
+        return rss
+    except (OSError, StopIteration):
+        return None
+
+
+class Stats:
+    """Latencies and errors of all requests, by endpoint or command."""
+
+    def __init__(self):
+        """Initializes with no requests."""
+        self.latencies = defaultdict(list)  # name -> [seconds]
+        self.body_bytes = Counter()  # name -> bytes of all response bodies
+        self.errors = Counter()  # Codes name, or HTTP status -> count
+        self.games_finished = 0
+        self.rss = []  # samples of the server's RSS in bytes
+
+    def record(self, name, seconds, response):
+        """Records the latency of a request, and its error (if any)."""
+        self.latencies[name].append(seconds)
+        self.body_bytes[name] += len(response.body or b"")
+        if response.code == 400:
+            try:
+                code = json.loads(response.body)["code"]
+            except (ValueError, KeyError, TypeError):
+                code = None
+            self.errors[CODE_NAMES.get(code, "HTTP 400")] += 1
+        elif response.code >= 400:
+            self.errors["HTTP %d" % response.code] += 1
+
+    def report(self, duration):
+        """Returns a JSON-serializable summary of all requests."""
+        endpoints = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            endpoints[name] = {
+                "count": len(latencies),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "meanBytes": self.body_bytes[name] / len(latencies),
+            }
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "duration": duration,
+            "requests": requests,
+            "rps": requests / duration,
+            "gamesFinished": self.games_finished,
+            "endpoints": endpoints,
+            "errors": dict(self.errors),
+            "rssFinal": self.rss[-1] if self.rss else None,
+            "rssPeak": max(self.rss) if self.rss else None,
+        }
+
+
+class Bot:
+    """One simulated user with their own cookie, polling like main.js."""
+
+    def __init__(self, loadgen, name):
+        """Initializes the bot, which has yet to load the page."""
+        self.loadgen = loadgen
+        self.name = name
+        self.cookie = None
+        self.etags = {}  # url -> ETag, as jQuery's ifModified remembers
+        self.gid = None  # of the active game
+        self.games_version = 0
+        self.lobby_chat_seq = 0
+        self.game_chat_seq = 0
+        self.board = None
+        self.played = None  # cid of the card played this round
+
+    async def fetch(self, name, url, body=None, if_modified=False):
+        """Returns the response to a request, recording its latency."""
+        headers = {}
+        if self.cookie is not None:
+            headers["Cookie"] = self.cookie
+        if if_modified and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+        request = tornado.httpclient.HTTPRequest(
+            self.loadgen.url + url,
+            method="GET" if body is None else "POST",
+            headers=headers,
+            body=body,
+            request_timeout=self.loadgen.request_timeout,
+        )
+        start = time.perf_counter()
+        response = await self.loadgen.client.fetch(request, raise_error=False)
+        self.loadgen.stats.record(name, time.perf_counter() - start, response)
+        if "Set-Cookie" in response.headers:
+            self.cookie = response.headers["Set-Cookie"].split(";")[0]
+        if if_modified and "Etag" in response.headers:
+            self.etags[url] = response.headers["Etag"]
+        return response
+
+    async def get_json(self, name, url, if_modified=True):
+        """Returns the JSON in a response, or None if unmodified or failed."""
+        response = await self.fetch(name, url, if_modified=if_modified)
+        if response.code != 200 or not response.body:
+            return None
+        return json.loads(response.body)
+
+    async def command(self, cmd, params=""):
+        """Sends a command for the active game, and returns the response."""
+        url = "/game/%d/%d%s" % (self.gid, cmd, "?" + params if params else "")
+        return await self.fetch(COMMAND_NAMES[cmd], url)
+
+    async def load(self):
+        """Loads the page like a browser, and then sets a name."""
+        response = await self.fetch("/", "/")
+        for url, root, ext in ASSET_URL.findall(response.body.decode("utf-8")):
+            await self.fetch("/%s%s" % (root, ext), "/" + url)
+        await self.fetch("/setusername", "/setusername", "username=" + self.name)
+
+    def start_polling(self):
+        """Starts polling the game list, user list, and chat rooms."""
+        for poller in (self.poll_games, self.poll_users, self.poll_chat):
+            tornado.ioloop.IOLoop.current().spawn_callback(poller)
+
+    async def _every(self, interval, callback):
+        await tornado.gen.sleep(random.random() * interval)  # spread out
+        while self.loadgen.running:
+            await callback()
+            await tornado.gen.sleep(interval)
+
+    async def poll_games(self):
+        async def callback():
+            url = "/getgames?since=%d" % self.games_version
+            data = await self.get_json("/getgames", url)
+            if data is not None:
+                self.games_version = data["version"]
+
+        await self._every(GAMELIST_INTERVAL, callback)
+
+    async def poll_users(self):
+        async def callback():
+            await self.get_json("/getusers", "/getusers")
+
+        await self._every(USERLIST_INTERVAL, callback)
+
+    async def poll_chat(self):
+        async def callback():
+            data = await self.get_json("/chat", "/chat?since=%d" % self.lobby_chat_seq)
+            if data is not None:
+                self.lobby_chat_seq = data["seq"]
+            if self.gid is not None:
+                url = "/chat?room=%d&since=%d" % (self.gid, self.game_chat_seq)
+                data = await self.get_json("/chat?room", url)
+                if data is not None:
+                    self.game_chat_seq = data["seq"]
+
+        await self._every(CHATROOM_INTERVAL, callback)
+
+    async def next_board(self):
+        """Long-polls the board of the active game until it changes."""
+        while self.loadgen.running:
+            params = ""
+            if self.board is not None:
+                params = "?base=%s&since=%d" % (
+                    self.board["rev"],
+                    self.board["version"],
+                )
+            url = "/game/%d/%d%s" % (self.gid, Commands.GET_BOARD, params)
+            # Long-polls wait for a change, so they are timed separately.
+            name = "GET_BOARD" if self.board is None else "GET_BOARD?since"
+            response = await self.fetch(name, url, if_modified=True)
+            if response.code == 200:
+                data = json.loads(response.body)
+                if "patchOf" not in data:
+                    self.board = data
+                else:
+                    del data["patchOf"]
+                    apply_merge_patch(self.board, data)
+                return self.board
+            elif response.code != 304:
+                await tornado.gen.sleep(GAMEBOARD_INTERVAL)
+        return None
+
+    def switch_game(self, gid):
+        """Makes the game with the given gid the active game."""
+        self.gid = gid
+        self.board = None
+        self.game_chat_seq = 0
+
+    async def play(self):
+        """Takes this bot's actions in the active game, until it ends."""
+        while self.loadgen.running:
+            board = await self.next_board()
+            if board is None or board["state"] == States.END:
+                return
+            if not board["requiresAction"].get(board["user"]):
+                continue
+            await self.loadgen.think()
+            hand = [card["cid"] for card in board["player"].get("hand", [])]
+            if board["state"] == States.CLUE:
+                self.played = hand[0]
+                await self.command(
+                    Commands.CREATE_CLUE, "clue=%s&cid=%s" % ("a" * 8, self.played)
+                )
+                await self.fetch(
+                    "/chat POST", "/chat?room=%d" % self.gid, "msg=my+turn"
+                )
+            elif board["state"] == States.PLAY:
+                self.played = hand[0]
+                await self.command(Commands.PLAY_CARD, "cid=" + self.played)
+            elif board["state"] == States.VOTE:
+                cids = [card["cid"] for card in board["round"].get("cards", [])]
+                cids = [cid for cid in cids if cid != self.played]
+                await self.command(Commands.CAST_VOTE, "cid=" + random.choice(cids))
+
+
+class LoadGenerator:
+    """Runs tables of bots against a server, and collects their statistics."""
+
+    def __init__(self, url, tables, players, duration, think, max_score):
+        """Initializes the load for a server at the given base url."""
+        self.url = url.rstrip("/")
+        self.tables = tables
+        self.players = players
+        self.duration = duration
+        self.think_time = think
+        self.max_score = max_score
+        self.request_timeout = 120  # longer than any long-poll
+        self.running = False
+        self.stats = Stats()
+        self.client = tornado.httpclient.AsyncHTTPClient()
+
+    async def think(self):
+        """Waits for as long as a (very fast) human might take to act."""
+        if self.think_time > 0:
+            await tornado.gen.sleep(random.uniform(0.5, 1.5) * self.think_time)
+
+    async def run_table(self, index):
+        """Plays one game after another at a table until the duration elapses."""
+        bots = [Bot(self, "bot%d.%d" % (index, i)) for i in range(self.players + 1)]
+        for bot in bots:
+            await bot.load()
+            bot.start_polling()
+        host, guest, players = bots[0], bots[-1], bots[:-1]
+        while self.running:
+            body = "card_sets=0&name=Table%d&max_players=%d&max_score=%d" % (
+                index,
+                self.players + 1,
+                self.max_score,
+            )
+            body += "&max_clue_length=100&password="
+            response = await host.fetch("/create", "/create", body)
+            if response.code != 200:
+                return
+            gid = int(response.body)
+            for bot, colour in zip(bots, COLOURS):
+                bot.switch_game(gid)
+                await bot.command(Commands.JOIN_GAME, "colour=" + colour)
+            board = await guest.next_board()
+            if board is None:
+                return
+            await host.command(Commands.KICK_PLAYER, "puid=" + board["user"])
+            guest.switch_game(None)
+            await host.command(Commands.START_GAME)
+            await tornado.gen.multi([bot.play() for bot in players])
+            if self.running:
+                self.stats.games_finished += 1
+
+    async def run(self, server_pid=None):
+        """Runs all tables for the duration, and returns the report."""
+        self.running = True
+        start = time.perf_counter()
+        for i in range(self.tables):
+            tornado.ioloop.IOLoop.current().spawn_callback(self.run_table, i)
+        while time.perf_counter() - start < self.duration:
+            await tornado.gen.sleep(1)
+            if server_pid is not None:
+                rss = get_rss(server_pid)
+                if rss is not None:
+                    self.stats.rss.append(rss)
+        self.running = False
+        return self.stats.report(time.perf_counter() - start)
+
+
+def get_free_port():
+    """Returns a port that is free to listen on at the moment."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(tmpdir, cards, workers):
+    """Starts a local server with a deck of blank cards, and returns (url, Popen)."""
+    card_dir = os.path.join(tmpdir, "cards")
+    os.mkdir(card_dir)
+    for i in range(cards):
+        open(os.path.join(card_dir, "%d.jpg" % i), "w").close()
+    port = get_free_port()
+    config_filename = os.path.join(tmpdir, "config.json")
+    with open(config_filename, "w") as config_file:
+        json.dump(
+            {
+                "port": port,
+                "card_sets": {"Dixit": [card_dir, True]},  # replaces the default
+                "card_cache": os.path.join(tmpdir, "cache"),
+                "push_enable": False,
+                "rate_limits": {"enable": False},  # every bot has the same IP
+                "shards": {"workers": workers},
+            },
+            config_file,
+        )
+    process = subprocess.Popen(
+        [sys.executable, "-c", "import dixit; dixit.start()", config_filename],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,  # the access log
+        start_new_session=True,
+    )
+    url = "http://127.0.0.1:%d" % port
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return url, process
+
+
+def print_report(report):
+    """Prints the report as a table."""
+    print(
+        "%-16s %8s %9s %9s %9s %9s"
+        % ("endpoint", "count", "p50 ms", "p95 ms", "p99 ms", "bytes")
+    )
+    for name, entry in report["endpoints"].items():
+        print(
+            "%-16s %8d %9.2f %9.2f %9.2f %9.0f"
+            % (
+                name,
+                entry["count"],
+                entry["p50"] * 1000,
+                entry["p95"] * 1000,
+                entry["p99"] * 1000,
+                entry["meanBytes"],
+            )
+        )
+    print("requests/s: %.1f" % report["rps"])
+    print("games finished: %d" % report["gamesFinished"])
+    print("errors: %s" % (report["errors"] or "none"))
+    if report["rssPeak"] is not None:
+        print(
+            "server RSS: %.1f MB (peak %.1f MB)"
+            % (report["rssFinal"] / 2.0**20, report["rssPeak"] / 2.0**20)
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--tables", type=int, default=10, help="concurrent games")
+    parser.add_argument("--players", type=int, default=4, help="players per game")
+    parser.add_argument("--duration", type=float, default=60, help="in seconds")
+    parser.add_argument("--think", type=float, default=1, help="seconds per action")
+    parser.add_argument("--max-score", type=int, default=10, help="per game")
+    parser.add_argument("--cards", type=int, default=100, help="in the deck")
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--url", help="of a running server, instead of starting one")
+    parser.add_argument("--output", help="JSON file to write the report to")
+    args = parser.parse_args(argv)
+    if not 3 <= args.players <= 5:
+        parser.error("--players must be from 3 to 5, leaving a seat for the guest")
+
+    tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=100000)
+    loadgen = None
+    process = None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        url = args.url
+        if url is None:
+            url, process = start_server(tmpdir, args.cards, args.workers)
+        try:
+            loadgen = LoadGenerator(
+                url,
+                args.tables,
+                args.players,
+                args.duration,
+                args.think,
+                args.max_score,
+            )
+            report = tornado.ioloop.IOLoop.current().run_sync(
+                lambda: loadgen.run(None if process is None else process.pid)
+            )
+        finally:
+            if process is not None:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait()
+
+    report.update(vars(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
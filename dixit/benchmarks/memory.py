@@ -0,0 +1,101 @@
+"""Memory benchmark of the users and games that the server holds.
+
+Usage: python -m dixit.benchmarks.memory [--users N] [--games N] [--output FILE]
+
+Reports the bytes allocated per user (including their entries in Users), and
+per game (including its deck, players, and current round), as traced by
+tracemalloc. Games are measured in the middle of their first vote, with every
+player at the table, and share their card sets and users, as on the server.
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from dixit.benchmarks.core import (
+    advance,
+    get_revision,
+    make_card_sets,
+    make_context,
+    make_game,
+    make_users,
+)
+from dixit.core import States
+from dixit.utils import hash_obj
+
+
+def _traced(create):
+    """Returns what create() returns, and the bytes that it left allocated."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = create()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def bytes_per_user(count):
+    """Returns the average bytes allocated for each of many users."""
+    context = make_context()
+    # The ids are allocated up front, as they arrive with each request anyway.
+    ids = [
+        (hash_obj(i, add_random=True), hash_obj(i, add_random=True))
+        for i in range(count)
+    ]
+
+    def create():
+        return [context.users.add_user(uid, puid) for uid, puid in ids]
+
+    _, size = _traced(create)
+    return size / count
+
+
+def bytes_per_game(count, players, deck_size):
+    """Returns the average bytes allocated for each of many games."""
+    context = make_context()
+    card_sets = make_card_sets(deck_size)
+    users = make_users(context, players)
+
+    def create():
+        return [
+            advance(make_game(context, card_sets, users, seed), States.VOTE)
+            for seed in range(count)
+        ]
+
+    _, size = _traced(create)
+    return size / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=100000, help="to measure")
+    parser.add_argument("--games", type=int, default=10000, help="to measure")
+    parser.add_argument("--players", type=int, default=6, help="per game")
+    parser.add_argument("--deck-size", type=int, default=84, help="per game")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = {
+        "revision": get_revision(),
+        "bytesPerUser": bytes_per_user(args.users),
+        "bytesPerGame": bytes_per_game(args.games, args.players, args.deck_size),
+        "players": args.players,
+        "deckSize": args.deck_size,
+    }
+    print("bytes per user: %.0f" % report["bytesPerUser"])
+    print(
+        "bytes per game: %.0f (%d players, %d cards)"
+        % (report["bytesPerGame"], args.players, args.deck_size)
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Restore benchmark of the journal, from its last snapshot and the entries since.
+
+Usage: python -m dixit.benchmarks.restore [--games N] [--journaled N] [--output FILE]
+
+Fills a journal's directory as a server would: every game is created, joined
+by four players, started, and given its first clue, and a snapshot is taken
+once all but the journaled games exist, such that those are replayed entry by
+entry. By default, as many games are journaled as fit in the entries that the
+journal keeps before it snapshots by itself (see snapshot_entries), which is
+the slowest restart with the configured journal. Reports the median seconds
+that restore() takes over the repeats, and the size of what it reads.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import tornado.ioloop
+
+from dixit.benchmarks.core import COLOURS, get_revision
+from dixit.benchmarks.startup import write_config
+from dixit.core import StringClue
+from dixit.journal import Journal
+from dixit.server import load_settings, make_application
+from dixit.utils import INFINITY, hash_obj
+
+PLAYERS = 4  # per game
+ENTRIES_PER_GAME = 3 + 2 * PLAYERS  # its users and joins, create, start, and clue
+
+
+def _make_settings(tmpdir, cards):
+    settings = load_settings(write_config(tmpdir, cards))
+    return dict(
+        settings,
+        journal=dict(settings["journal"], directory=os.path.join(tmpdir, "journal")),
+        reaper=dict(settings["reaper"], max_users=-1, max_games=-1),
+    )
+
+
+def _add_game(application):
+    """Journals a new game, up to its first clue, as the handlers would."""
+    journal = application.journal
+    users = []
+    for _ in range(PLAYERS):
+        uid = hash_obj(len(application.users), add_random=True)
+        puid = hash_obj(uid, add_random=True)
+        users.append(application.users.add_user(uid, puid))
+        journal.record("user", uid, puid)
+    gid, _ = application.create_game(
+        users[0], [0], "", None, PLAYERS, INFINITY, 100, zip(users, COLOURS)
+    )
+    game = application.get_game(gid)
+    game.start_game()
+    journal.record("start", gid)
+    clue_maker = game.clue_maker()
+    card = game.players[clue_maker].hand[0]
+    game.create_clue(clue_maker, StringClue("a clue"), card)
+    journal.record("clue", gid, clue_maker.uid, "a clue", card.cid)
+
+
+async def fill(application, games, journaled):
+    """Journals the games, snapshotting all but the journaled ones of them.
+
+    The journal does not snapshot by itself meanwhile, such that the journaled
+    games are all replayed.
+    """
+    journal = application.journal
+    snapshot_entries, journal.snapshot_entries = journal.snapshot_entries, 0
+    for _ in range(games - journaled):
+        _add_game(application)
+    await journal.snapshot()
+    for _ in range(journaled):
+        _add_game(application)
+    await journal.flush()
+    journal.snapshot_entries = snapshot_entries
+
+
+def time_restore(settings):
+    """Returns the seconds that a new application takes to restore, and its games."""
+    application = make_application(settings)
+    start = time.perf_counter()
+    application.journal.restore()
+    seconds = time.perf_counter() - start
+    application.journal.file.close()
+    return seconds, len(application.games)
+
+
+def run(games, journaled=None, repeat=5, cards=84):
+    """Returns a report of the median seconds of restoring the games.
+
+    By default, the journaled games are as many as the journal holds before it
+    snapshots by itself.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        settings = _make_settings(tmpdir, cards)
+        if journaled is None:
+            snapshot_entries = settings["journal"]["snapshot_entries"]
+            journaled = (snapshot_entries - 1) // ENTRIES_PER_GAME
+        journaled = min(journaled, games)
+        application = make_application(settings)
+        application.journal.restore()
+        tornado.ioloop.IOLoop.current().run_sync(
+            lambda: fill(application, games, journaled)
+        )
+        application.journal.file.close()
+        directory = settings["journal"]["directory"]
+        sizes = dict(
+            (name, os.path.getsize(os.path.join(directory, name)))
+            for name in (Journal.SNAPSHOT_FILENAME, Journal.JOURNAL_FILENAME)
+        )
+        with open(os.path.join(directory, Journal.JOURNAL_FILENAME)) as journal_file:
+            entries = sum(1 for _ in journal_file)
+
+        samples = [time_restore(settings) for _ in range(repeat)]
+    return {
+        "revision": get_revision(),
+        "games": games,
+        "users": games * PLAYERS,
+        "restoredGames": samples[-1][1],
+        "journaledGames": journaled,
+        "journalEntries": entries,
+        "snapshotBytes": sizes[Journal.SNAPSHOT_FILENAME],
+        "journalBytes": sizes[Journal.JOURNAL_FILENAME],
+        "repeat": repeat,
+        "seconds": statistics.median(seconds for seconds, _ in samples),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, default=10000, help="to restore")
+    parser.add_argument("--journaled", type=int, help="games, after the snapshot")
+    parser.add_argument("--repeat", type=int, default=5, help="restores to time")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = run(args.games, args.journaled, args.repeat)
+    print(
+        "%d games and %d users, %d from %d journal entries: %.3f s"
+        % (
+            report["restoredGames"],
+            report["users"],
+            report["journaledGames"],
+            report["journalEntries"],
+            report["seconds"],
+        )
+    )
+    print(
+        "snapshot %.1f MB, journal %.1f MB"
+        % (report["snapshotBytes"] / 1e6, report["journalBytes"] / 1e6)
+    )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
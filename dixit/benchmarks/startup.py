@@ -0,0 +1,111 @@
+"""Startup benchmark of the server, from a fresh interpreter to its first page.
+
+Usage: python -m dixit.benchmarks.startup [--repeat N] [--cards N] [--output FILE]
+
+Each sample runs a new Python process that imports dixit.server, parses the
+config, makes the application, and then serves the main page (which loads the
+card sets) to its first request. Reports the median seconds of each phase,
+and of the whole process, including the interpreter's own startup. The card
+folder's manifest is built by the first sample, like after a deploy, and so
+the later samples measure a restart.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from dixit.benchmarks.core import get_revision
+
+PHASES = ("import", "config", "application", "firstRequest")
+
+# Run in each sample's process, and prints the seconds of each phase as JSON.
+SAMPLE = """
+import json, sys, time
+start = time.perf_counter()
+import dixit.server
+import tornado.httpclient, tornado.httpserver, tornado.ioloop, tornado.netutil
+imported = time.perf_counter()
+settings = dixit.server.load_settings(sys.argv[1])
+parsed = time.perf_counter()
+application = dixit.server.make_application(settings)
+made = time.perf_counter()
+sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+tornado.httpserver.HTTPServer(application).add_sockets(sockets)
+url = "http://127.0.0.1:%d/" % sockets[0].getsockname()[1]
+client = tornado.httpclient.AsyncHTTPClient()
+tornado.ioloop.IOLoop.current().run_sync(lambda: client.fetch(url))
+served = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "config": parsed - imported,
+    "application": made - parsed,
+    "firstRequest": served - made,
+}))
+"""
+
+
+def write_config(tmpdir, cards):
+    """Writes a config with a folder of blank cards, and returns its filename."""
+    card_dir = os.path.join(tmpdir, "cards")
+    os.mkdir(card_dir)
+    for i in range(cards):
+        with open(os.path.join(card_dir, "%d.jpg" % i), "w") as card_file:
+            card_file.write(str(i))  # distinct content hashes
+    config_filename = os.path.join(tmpdir, "config.json")
+    with open(config_filename, "w") as config_file:
+        json.dump(
+            {
+                "card_sets": {"Dixit": [card_dir, True]},
+                "card_cache": os.path.join(tmpdir, "cache"),
+            },
+            config_file,
+        )
+    return config_filename
+
+
+def sample(config_filename):
+    """Returns the seconds of each phase, and in total, of one new process."""
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-c", SAMPLE, config_filename], text=True
+    )
+    result = json.loads(output)
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def run(repeat, cards):
+    """Returns a report of the median seconds of each phase over the samples."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_filename = write_config(tmpdir, cards)
+        samples = [sample(config_filename) for _ in range(repeat)]
+    report = {"revision": get_revision(), "cards": cards, "samples": repeat}
+    for key in PHASES + ("process",):
+        values = [s[key] for s in samples[1:] or samples]  # after the first
+        report[key] = statistics.median(values)
+    report["coldFirstRequest"] = samples[0]["firstRequest"]
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=10, help="processes to run")
+    parser.add_argument("--cards", type=int, default=100, help="in the card folder")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat, args.cards)
+    for key in PHASES + ("process", "coldFirstRequest"):
+        print("%-18s %8.1f ms" % (key, report[key] * 1000))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
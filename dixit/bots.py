@@ -0,0 +1,234 @@
+"""Server-side bots, which the host of a game may seat to fill its table.
+
+Bots play through the same Game methods as everyone else, and are journaled
+alike. They are never run as a game changes, but scheduled: a game with a bot
+that needs to act is due after a random delay, as if the bot were thinking, and
+every tick of the IOLoop acts on the games that are due, up to max_actions of
+them. Each action is a few lookups in the card similarity index (see
+dixit.similarity), so that even thousands of bots only take a small, bounded
+slice of each tick away from the players.
+
+This requires NumPy (pip install dixit[sim]), without which bots are disabled.
+"""
+
+import logging
+import random
+import time
+
+import tornado.ioloop
+
+from dixit.codes import APIError, Codes
+from dixit.core import States, StringClue
+from dixit.display import BunnyPalette
+from dixit.utils import hash_obj
+
+try:
+    import numpy as np
+
+    from dixit.similarity import SimilarityIndex, build_index
+except ImportError:  # pragma: no cover
+    SimilarityIndex = None
+
+logger = logging.getLogger(__name__)
+
+BOT_PREFIX = "bot-"  # of the uid of every bot, which survives restarts
+BUNNY_COLOURS = tuple(
+    value for name, value in vars(BunnyPalette).items() if name.isupper()
+)
+
+
+def is_bot(user):
+    """Returns true iff the User is a bot."""
+    return user.uid.startswith(BOT_PREFIX)
+
+
+class Policy:
+    """Decides what a bot does, by the similarities of its cards and the clue.
+
+    A clue is made for the most distinctive card of a hand, i.e., the least
+    similar to the others, in the words of its strongest colours. The card that
+    is played, and the card that is voted for, are the most similar to the clue,
+    with ties broken at random.
+    """
+
+    def __init__(self, index, rng):
+        """Initializes the policy with a SimilarityIndex and a random.Random."""
+        self.index = index
+        self.rng = rng
+
+    def _best(self, scores):
+        random = self.rng.random
+        scores = [score + random() * 1e-6 for score in scores.tolist()]
+        return scores.index(max(scores))
+
+    def choose_clue(self, hand, min_length=0, max_length=None):
+        """Returns the clue to make for a card of the hand, and the Card.
+
+        The clue is from min_length to max_length long, as the game allows.
+        """
+        similarity = self.index.similarity(hand, hand)
+        np.fill_diagonal(similarity, -np.inf)
+        card = hand[self._best(-similarity.max(axis=1))]
+        clue = self.index.make_clue(
+            card, self.rng, min_length=min_length, max_length=max_length
+        )
+        return clue, card
+
+    def choose_card(self, cards, clue):
+        """Returns the Card that is the most similar to the clue."""
+        return cards[self._best(self.index.match(clue, cards))]
+
+
+class Bots:
+    """Schedules the actions of every bot in the application's games."""
+
+    def __init__(self, application, bots_config):
+        """Initializes the bots of the application, none of which are due."""
+        self.application = application
+        self.enable = bool(bots_config["enable"]) and SimilarityIndex is not None
+        self.min_delay = float(bots_config["min_delay"])
+        self.max_delay = float(bots_config["max_delay"])
+        self.interval = float(bots_config["interval"])
+        self.max_actions = int(bots_config["max_actions"])
+
+        self.rng = random.Random()
+        self.index = None  # SimilarityIndex, see get_index()
+        self.due = {}  # gid -> time.monotonic() at which a bot acts in it
+        self.actions = 0  # counter since startup
+
+    def get_index(self):
+        """Returns the SimilarityIndex of the cards, building it on first use."""
+        if self.index is None:
+            application = self.application
+            features = build_index(application.card_sets_config, application.card_cache)
+            self.index = SimilarityIndex(features, application.card_sets)
+        return self.index
+
+    def start(self):
+        """Loads the index and starts acting periodically on the current IOLoop."""
+        if self.enable:
+            self.get_index()
+            for gid, game in self.application.games.items():  # e.g., restored
+                self.on_game_changed(gid, game)
+            tornado.ioloop.PeriodicCallback(self.tick, self.interval * 1000).start()
+
+    def add_bot(self, gid, game):
+        """Seats a new bot in the game, in a free colour, and returns it.
+
+        The game is checked before the bot is made, such that no user is left
+        behind for a bot that cannot be seated.
+        """
+        if not self.enable:
+            raise APIError(Codes.BOTS_DISABLED)
+        if game.state != States.BEGIN:
+            raise APIError(Codes.BEGIN_BAD_STATE)
+        if len(game.players) >= game.max_players:
+            raise APIError(Codes.JOIN_FULL_ROOM)
+        taken = set(game.colours.values())
+        colours = [colour for colour in BUNNY_COLOURS if colour not in taken]
+        if not colours:
+            raise APIError(Codes.JOIN_FULL_ROOM)
+
+        application = self.application
+        uid = BOT_PREFIX + hash_obj(id(game), add_random=True)
+        puid = hash_obj(uid, add_random=True)
+        user = application.users.add_user(uid, puid)
+        name = application.users.set_name(user, "bot.%s" % puid[:4])
+        try:
+            game.add_player(user, colours[0])
+        except APIError:
+            application.users.remove_user(user)
+            raise
+        application.journal.record("user", uid, puid)
+        application.journal.record("name", uid, name)
+        application.journal.record("join", gid, uid, colours[0])
+        if application.shard is not None:
+            tornado.ioloop.IOLoop.current().add_future(
+                application.shard.add_user(user), self._added_to_store
+            )
+        return user
+
+    def _added_to_store(self, future):
+        try:
+            future.result()
+        except Exception as e:
+            logger.warning("Cannot write a bot to the store: %s", e)
+
+    def waiting(self, game):
+        """Returns the bots of the game that need to act, in the order of seats."""
+        if game.state == States.CLUE:
+            clue_maker = game.clue_maker()
+            return [clue_maker] if is_bot(clue_maker) else []
+        if game.state == States.PLAY:
+            has_acted = game.round.has_played
+        elif game.state == States.VOTE:
+            has_acted = game.round.has_voted
+        else:
+            return []
+        clue_maker = game.clue_maker()
+        return [
+            user
+            for user in game.players
+            if is_bot(user) and user != clue_maker and not has_acted(user)
+        ]
+
+    def on_game_changed(self, gid, game):
+        """Schedules the game, if a bot needs to act in it and it is not due."""
+        if self.enable and gid not in self.due and self.waiting(game):
+            delay = self.rng.uniform(self.min_delay, self.max_delay)
+            self.due[gid] = time.monotonic() + delay
+
+    def tick(self):
+        """Acts for one bot in each game that is due, up to max_actions of them.
+
+        Since each action changes its game, any other bot that needs to act in
+        it is scheduled anew.
+        """
+        now = time.monotonic()
+        acted = 0
+        for gid, when in list(self.due.items()):
+            if acted >= self.max_actions:
+                break
+            if when > now:
+                continue
+            del self.due[gid]
+            game = self.application.get_game(gid)
+            if game is not None and self.act(gid, game):
+                acted += 1
+        self.actions += acted
+
+    def act(self, gid, game):
+        """Acts for the first bot that needs to, returning true iff there was one.
+
+        A bot that fails to act is scheduled again, such that the game goes on.
+        """
+        bots = self.waiting(game)
+        if not bots:
+            return False
+        user = bots[0]
+        policy = Policy(self.get_index(), self.rng)
+        journal = self.application.journal
+        try:
+            if game.state == States.CLUE:
+                clue, card = policy.choose_clue(
+                    game.players[user].hand,
+                    game.limits.min_clue_length,
+                    game.max_clue_length,
+                )
+                clue = StringClue(clue)
+                game.create_clue(user, clue, card)
+                journal.record("clue", gid, user.uid, str(clue), card.cid)
+            elif game.state == States.PLAY:
+                card = policy.choose_card(game.players[user].hand, game.round.clue)
+                game.play_card(user, card)
+                journal.record("play", gid, user.uid, card.cid)
+            else:
+                own = game.round.get_played_card(user)
+                cards = [card for card in game.round.get_cards() if card != own]
+                card = policy.choose_card(cards, game.round.clue)
+                game.cast_vote(user, card)
+                journal.record("vote", gid, user.uid, card.cid)
+        except APIError as e:
+            logger.warning("Bot %s cannot act in game %d: %s", user.puid, gid, e)
+            self.on_game_changed(gid, game)  # tries again later, not to stall it
+        return True
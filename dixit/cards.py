@@ -0,0 +1,273 @@
+"""Pipeline from folders of card images to content-addressed urls.
+
+Usage: python -m dixit.cards [--force] [config.json]
+
+Each folder of card images has a manifest in the card cache, listing every
+image with its size, modification time, and content hash. At startup, the
+manifest is trusted as long as the folder has not been modified since, which
+skips the directory scan, and otherwise only new or changed images are hashed.
+
+Every image is published at cards/<hash>.<ext>, such that browsers may cache
+it forever. If Pillow is installed (pip install dixit[images]), a thumbnail at
+the display size of a card is also written to the card cache, and shown in
+hands and votes instead of the original, which remains for the magnifier.
+Running this module builds every manifest and thumbnail ahead of time.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+
+import tornado.web
+
+from dixit import config, display
+from dixit.assets import AssetHandler
+from dixit.deck import CardSet
+from dixit.utils import url_join
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+SUFFIXES = (".jpg", ".png")
+URL_PREFIX = "cards"
+THUMBNAIL_SIZE = (display.Sizes.CARD_WIDTH, display.Sizes.CARD_HEIGHT)
+THUMBNAIL_QUALITY = 85
+
+
+def has_suffix(name, suffixes):
+    """Returns true iff name ends with at least one of the given suffixes."""
+    return True in (name.endswith(suffix) for suffix in suffixes)
+
+
+def hash_file(path, chunk_size=2**16):
+    """Returns the first 16 hex digits of the SHA-256 of the file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def thumbnail_name(content_hash):
+    """Returns the file name of the thumbnail of the image with the given hash."""
+    return "%s.%dx%d.jpg" % ((content_hash,) + THUMBNAIL_SIZE)
+
+
+def make_thumbnail(path, thumbnail_path):
+    """Writes the image at path, resized to the display size, as a JPEG."""
+    with Image.open(path) as image:
+        # The page stretches each card to exactly this size, so the same here
+        image = image.convert("RGB").resize(THUMBNAIL_SIZE, Image.LANCZOS)
+        tmp_path = thumbnail_path + ".tmp"
+        image.save(tmp_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    os.replace(tmp_path, thumbnail_path)
+
+
+class Manifest:
+    """The images of a folder, with their content hashes and thumbnails."""
+
+    def __init__(self, folder, path, cache_path):
+        """Initializes an empty manifest for the folder at the given path."""
+        self.folder = folder
+        self.path = path
+        self.cache_path = cache_path
+        self.mtime = None  # of the folder, when it was last scanned
+        self.thumbnails = False
+        self.images = []  # sorted by name, such that card ids are stable
+
+    @property
+    def filename(self):
+        """Returns the path of the manifest in the card cache."""
+        # The folder may be nested, or even absolute, so it is named by its hash
+        folder_hash = hashlib.sha256(self.folder.encode("utf-8")).hexdigest()[:8]
+        name = "%s.%s.json" % (os.path.basename(self.folder.rstrip("/")), folder_hash)
+        return os.path.join(self.cache_path, name)
+
+    def load(self):
+        """Loads the manifest from the card cache, returning true iff it exists."""
+        try:
+            with open(self.filename, "r") as manifest_file:
+                data = json.load(manifest_file)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != MANIFEST_VERSION:
+            return False
+        self.mtime = data["mtime"]
+        self.thumbnails = data["thumbnails"]
+        self.images = data["images"]
+        return True
+
+    def save(self):
+        """Writes the manifest to the card cache, atomically."""
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as manifest_file:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "mtime": self.mtime,
+                    "thumbnails": self.thumbnails,
+                    "images": self.images,
+                },
+                manifest_file,
+                indent=1,
+            )
+        os.replace(tmp_filename, self.filename)
+
+    def is_current(self):
+        """Returns true iff nothing has changed since the last scan."""
+        return self.mtime == os.stat(self.path).st_mtime_ns and (
+            self.thumbnails or Image is None
+        )
+
+    def scan(self, force=False, thumbnails=True):
+        """Lists the folder, hashing the images that are new or have changed.
+
+        Also writes any missing thumbnails, if asked to and Pillow is installed.
+        """
+        previous = dict((image["name"], image) for image in self.images)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.images = []
+        for name in sorted(os.listdir(self.path)):
+            if not has_suffix(name, SUFFIXES):
+                continue
+            stat = os.stat(os.path.join(self.path, name))
+            image = previous.get(name)
+            if (
+                force
+                or image is None
+                or image["size"] != stat.st_size
+                or image["mtime"] != stat.st_mtime_ns
+            ):
+                image = {
+                    "name": name,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime_ns,
+                    "hash": hash_file(os.path.join(self.path, name)),
+                }
+            self.images.append(image)
+
+        self.thumbnails = thumbnails and Image is not None
+        if self.thumbnails:
+            for image in self.images:
+                thumbnail_path = os.path.join(
+                    self.cache_path, thumbnail_name(image["hash"])
+                )
+                if force or not os.path.exists(thumbnail_path):
+                    make_thumbnail(
+                        os.path.join(self.path, image["name"]), thumbnail_path
+                    )
+
+    def files(self):
+        """Returns a dict of content-addressed file name -> path on disk."""
+        files = {}
+        for image in self.images:
+            ext = os.path.splitext(image["name"])[1]
+            files[image["hash"] + ext] = os.path.join(self.path, image["name"])
+            if self.thumbnails:
+                name = thumbnail_name(image["hash"])
+                files[name] = os.path.join(self.cache_path, name)
+        return files
+
+    def urls(self):
+        """Returns the urls of the cards in hands, and of the full images."""
+        full_urls = [
+            url_join(URL_PREFIX, image["hash"] + os.path.splitext(image["name"])[1])
+            for image in self.images
+        ]
+        if not self.thumbnails:
+            return full_urls, full_urls
+        urls = [
+            url_join(URL_PREFIX, thumbnail_name(image["hash"])) for image in self.images
+        ]
+        return urls, full_urls
+
+
+def get_folder_path(folder):
+    """Returns the path on disk of a folder of cards, under static/cards/."""
+    return os.path.join(os.path.dirname(__file__), display.WebPaths.CARDS, folder)
+
+
+def get_cache_path(card_cache):
+    """Returns the path of the card cache, relative to the package if relative."""
+    return os.path.join(os.path.dirname(__file__), card_cache)
+
+
+def build_manifest(folder, cache_path, force=False):
+    """Returns the Manifest of a folder of cards, scanning it only if needed.
+
+    If the card cache is not writable, the folder is scanned every time.
+    """
+    manifest = Manifest(folder, get_folder_path(folder), cache_path)
+    if manifest.load() and not force and manifest.is_current():
+        return manifest
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        manifest.scan(force)
+        manifest.save()
+    except OSError as e:
+        logger.warning("Cannot write the card cache %s: %s", cache_path, e)
+        manifest.scan(force, thumbnails=False)
+    return manifest
+
+
+def load_card_sets(card_sets_config, cache_path, files=None):
+    """Returns a CardSet for each configured folder of cards.
+
+    The content-addressed files of the cards are added to the given dict.
+    """
+    card_sets = []
+    for name, (folder, enabled) in card_sets_config.items():
+        manifest = build_manifest(folder, cache_path)
+        urls, full_urls = manifest.urls()
+        card_sets.append(CardSet(name, urls, enabled, full_urls))
+        if files is not None:
+            files.update(manifest.files())
+    return card_sets
+
+
+class CardHandler(tornado.web.StaticFileHandler):
+    """Handler for content-addressed card images, which may be cached forever.
+
+    Only the files in the application's card_files are served, from anywhere
+    on disk.
+    """
+
+    def initialize(self):
+        super(CardHandler, self).initialize(os.path.abspath(os.sep))
+
+    def parse_url_path(self, url_path):
+        path = self.application.card_files.get(url_path)
+        if path is None:
+            raise tornado.web.HTTPError(404)
+        return os.path.abspath(path)
+
+    def set_extra_headers(self, path):
+        self.set_header("Cache-Control", AssetHandler.CACHE_FOREVER)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("config", nargs="?", help="overriding config.json")
+    parser.add_argument("--force", action="store_true", help="rehash everything")
+    args = parser.parse_args(argv)
+
+    default_config_filename = os.path.join(os.path.dirname(__file__), "config.json")
+    settings = config.parse(default_config_filename, args.config)
+    cache_path = get_cache_path(settings["card_cache"])
+    for name, (folder, _) in settings["card_sets"].items():
+        manifest = build_manifest(folder, cache_path, force=args.force)
+        print(
+            "%s: %d cards%s"
+            % (name, len(manifest.images), " with thumbnails" * manifest.thumbnails)
+        )
+
+
+if __name__ == "__main__":
+    main()
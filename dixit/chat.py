@@ -2,38 +2,38 @@
 
 import time
 
-from dixit.utils import hash_obj
-
 
 class ChatLog:
     """Data for a chat log."""
 
     MAX_HISTORY = 1024  # default number of messages to store
+    GAME_MAX_HISTORY = 128  # number of messages to store for one game's room
 
     def __init__(self, max_history=MAX_HISTORY):
         """Initialzes an empty chat log with a given size."""
-        self.log = [None] * max_history  # circular array
+        self.log = [None] * max_history  # circular array, indexed by seq
         self.size = max_history
-        self.tail = 0
+        self.seq = 0  # sequence id of the most recent message, counting from 1
 
-    def add(self, name, msg):
-        """Appends a new msg for a user with the given name."""
-        cur_time = time.time()
-        self.log[self.tail] = {
+    def add(self, name, msg, t=None):
+        """Appends and returns a new msg for a user with the given name."""
+        self.seq += 1
+        message = self.log[self.seq % self.size] = {
             "user": name,
-            "mid": hash_obj(cur_time, add_random=True),
+            "mid": self.seq,
             "msg": msg,
-            "t": cur_time,
+            "t": time.time() if t is None else t,
         }
-        self.tail = (self.tail + 1) % self.size
-
-    def dump_since(self, last_time):
-        """Returns all messages posted since the given timestamp."""
-        head = (self.tail - 1) % self.size
-        dump = []
-        while self.log[head] and self.log[head]["t"] > last_time:
-            dump.append(self.log[head])
-            head = (head - 1) % self.size
-            if head == self.tail:  # avoid infinite loop
-                break
-        return list(reversed(dump))  # increasing time order
+        return message
+
+    def dump_since(self, seq):
+        """Returns all messages (still stored) with a sequence id after seq.
+
+        A seq from the future, e.g., from before the server restarted, is
+        treated as if nothing had been seen, as is a negative one.
+        """
+        if seq > self.seq:
+            seq = 0
+        seq = max(seq, 0)
+        first = max(seq, self.seq - self.size) + 1
+        return [self.log[i % self.size] for i in range(first, self.seq + 1)]
@@ -42,3 +42,6 @@ class Codes:
     NOT_HAVE_CARD = 22
     NOT_AN_INTEGER = 23
     ILLEGAL_RANGE = 24
+    RATE_LIMITED = 25
+    UNKNOWN_USER = 26
+    BOTS_DISABLED = 27
@@ -1,12 +1,12 @@
 """Core logic and validation to handle one particular game."""
 
-from collections import defaultdict
 import random
 import time
 
 from dixit.codes import APIError, Codes
 from dixit.deck import Deck
 from dixit.display import BunnyPalette
+from dixit.events import EventLog, Events
 from dixit.utils import INFINITY
 
 
@@ -31,6 +31,8 @@ class Limits:
         self.min_user_name = self._get_int(limit_config, "min_user_name")
         self.max_user_name = self._get_int(limit_config, "max_user_name")
 
+        self.max_batch = self._get_int(limit_config, "max_batch")
+
     def _get_int(self, limit_config, key):
         val = limit_config.get(key)
         if val is None:
@@ -56,6 +58,8 @@ class States:
 class StringClue:
     """Simple clue container. Returns the encoded text with str()."""
 
+    __slots__ = ("clue",)
+
     def __init__(self, clue):
         """Initializes the clue with a given string."""
         self.clue = clue
@@ -70,16 +74,20 @@ class StringClue:
 class Player:
     """Manages a user with respect to a particular game (hand/score)."""
 
+    __slots__ = ("user", "hand", "hand_version", "score")
+
     def __init__(self, user):
         """Initializes the player for the given user with no hand or score."""
         self.user = user
         self.hand = []
+        self.hand_version = 0  # bumped whenever the hand changes
         self.score = 0
 
     def deal(self, card):
         """Appends a card (if not None) to the hand."""
         if card is not None:
             self.hand.append(card)
+            self.hand_version += 1
 
     def has_card(self, card):
         """Returns true iff the user has the given card in their hand."""
@@ -88,70 +96,125 @@ class Player:
     def remove_card(self, card):
         """Removes the card from the user's hand or raises ValueError."""
         self.hand.remove(card)
+        self.hand_version += 1
 
 
 class Round:
-    """Handles all player state across one turn (state.VOTE -> state.VOTE)."""
-
-    def __init__(self, players, clue, clue_maker):
-        """Initializes the round for the given players, clue, and clue maker."""
+    """Handles all player state across one turn (state.VOTE -> state.VOTE).
+
+    The state of each player is kept in lists indexed by their seat, which is
+    their position in the game's dict of players when the round began.
+    """
+
+    __slots__ = (
+        "players",
+        "seats",
+        "clue",
+        "clue_maker",
+        "number",
+        "cards",
+        "votes",
+        "scores",
+        "played",
+        "voted",
+        "card_order",
+    )
+
+    def __init__(self, players, seats, clue, clue_maker, number=0, rng=random):
+        """Initializes the round for the given players, seats, clue, and clue maker.
+
+        The seats are a dict of User -> seat, which must not be mutated later.
+        """
         self.players = players
+        self.seats = seats
         self.clue = clue
         self.clue_maker = clue_maker
-        self.user_to_card = dict()  # User -> Card
-        self.user_to_vote = dict()  # User -> Card
-        self.card_to_voted_users = defaultdict(list)  # Card -> list(User)
-        self.scores = defaultdict(int)  # User -> int
+        self.number = number  # counts up from 1 for each round of a game
+        self.cards = [None] * len(seats)  # seat -> Card played
+        self.votes = [None] * len(seats)  # seat -> Card voted for
+        self.scores = [0] * len(seats)  # seat -> score for this round
+        self.played = 0  # number of cards played
+        self.voted = 0  # number of votes cast
 
         # Determine the random card order ahead of time
-        self.card_index_to_user = list(players.keys())
-        random.shuffle(self.card_index_to_user)
+        self.card_order = list(range(len(seats)))
+        rng.shuffle(self.card_order)
 
     @classmethod
     def make_zeroeth(cls):
         """Creates a round object suitable for the very beginning."""
-        # Use a non-empty list of players so that has_everyone_* returns False.
-        return cls({None: None}, None, None)  # no clues/cards/votes
+        # Use a non-empty list of seats so that has_everyone_* returns False.
+        return cls({}, {None: 0}, None, None)  # no clues/cards/votes
 
     def play_card(self, user, card):
         """Removes the card from the user's hand, and remembers the action."""
         self.players[user].remove_card(card)
-        self.user_to_card[user] = card
+        self.cards[self.seats[user]] = card
+        self.played += 1
 
     def cast_vote(self, user, card):
         """Makes the given user vote for the given card."""
-        self.user_to_vote[user] = card
-        if card != self.user_to_card[user]:  # ignore self-votes
-            self.card_to_voted_users[card].append(user)
+        self.votes[self.seats[user]] = card
+        self.voted += 1
 
     def has_card(self, card):
-        """Returns true iff the card has been played."""
-        return card in iter(self.user_to_card.values())
+        """Returns true iff the card has been played this round."""
+        return card in self.cards
 
     def has_played(self, user):
-        """Returns true iff the user has already played a card this round."""
-        return user in self.user_to_card
+        """Returns true iff the user has played a card this round."""
+        seat = self.seats.get(user)
+        return seat is not None and self.cards[seat] is not None
 
     def has_voted(self, user):
-        """Returns true iff the user has already voted for a card this round."""
-        return user in self.user_to_vote
+        """Returns true iff the user has voted this round."""
+        seat = self.seats.get(user)
+        return seat is not None and self.votes[seat] is not None
 
     def has_everyone_played(self):
-        """Returns true iff every player has_played(...)."""
-        return len(self.user_to_card) == len(self.players)
+        """Returns true iff every player has played a card."""
+        return self.played == len(self.cards)
 
     def has_everyone_voted(self):
-        """Returns true iff every player has_voted(...)."""
-        return len(self.user_to_vote) == len(self.players)
+        """Returns true iff every player has voted."""
+        return self.voted == len(self.votes)
 
     def get_cards(self):
         """Gets the played cards in a fixed random order."""
-        return [self.user_to_card[user] for user in self.card_index_to_user]
+        return [self.cards[seat] for seat in self.card_order]
+
+    def get_played_card(self, user):
+        """Returns the card that the user played, or None."""
+        return self.cards[self.seats[user]]
+
+    def get_played(self):
+        """Returns a list of (User, Card) for each card that was played."""
+        return [
+            (u, card) for u, card in zip(self.seats, self.cards) if card is not None
+        ]
+
+    def get_votes(self):
+        """Returns a list of (User, Card) for each vote that was cast."""
+        return [
+            (u, card) for u, card in zip(self.seats, self.votes) if card is not None
+        ]
+
+    def get_scores(self):
+        """Returns a list of (User, score) for this round, for each player."""
+        return list(zip(self.seats, self.scores))
+
+    def get_voters(self):
+        """Returns the users who voted for the card of each seat, except itself."""
+        voters = [[] for _ in self.cards]
+        for user, vote, card in zip(self.seats, self.votes, self.cards):
+            if vote is not None and vote != card:  # ignore self-votes
+                voters[self.cards.index(vote)].append(user)
+        return voters
 
     def score(self, user, score):
         """Increments the user's score for this round."""
         self.players[user].score += score
-        self.scores[user] += score
+        self.scores[self.seats[user]] += score
 
 
 class Game:
@@ -172,10 +235,19 @@ class Game:
         max_score,
         max_clue_length,
         limits,
+        seed=None,
     ):
-        """Initializes the game with the parameters from CreateHandler."""
+        """Initializes the game with the parameters from CreateHandler.
+
+        All of its randomness is derived from the given seed (or a random one),
+        so that the game can be replayed from its commands, which are recorded
+        in self.events (see dixit.replay).
+        """
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.events = EventLog(host)
+
         self.host = host
-        self.deck = Deck(card_sets)
+        self.deck = Deck(card_sets, shuffle=False)
         self.password = password
         self.name = name
         self.max_players = max_players
@@ -183,31 +255,57 @@ class Game:
         self.max_clue_length = max_clue_length
 
         self.players = {}
+        self.seats = {}  # User -> seat, replaced whenever the players change
         self.order = []
         self.colours = dict()
         self.perma_banned = set()
         self.hidden = False
 
+        self.version = 0  # bumped by every mutation, see changed()
+        self.listeners = []  # callables notified with this game after changed()
+
         self.limits = limits
 
         self.init_game()
         self.ping()
 
+    def __getstate__(self):
+        """Returns the state to pickle, which leaves out all listeners."""
+        state = dict(self.__dict__)
+        state["listeners"] = []
+        return state
+
     def init_game(self):
         """Initializes the game into a BEGIN state."""
         self.state = States.BEGIN
         self.round = Round.make_zeroeth()
         self.turn = 0
-        self.deck.reset()
+        self.deck.reset(rng=self.random())
+
+    def random(self):
+        """Returns an RNG determined by the seed and the version of the game.
+
+        This avoids keeping (and snapshotting) the state of an RNG per game.
+        """
+        return random.Random("%d.%d" % (self.seed, self.version))
 
     def hide(self):
         """Hides the game."""
         self.hidden = True
+        self.events.record(Events.HIDE)
+        self.changed()
 
     def ping(self):
         """Updates the game to appear currently active."""
         self.last_active = time.time()
 
+    def changed(self):
+        """Bumps the version, pings, and notifies all listeners of a mutation."""
+        self.version += 1
+        self.ping()
+        for listener in self.listeners:
+            listener(self)
+
     def clue_maker(self):
         """Returns the User who made, or is making, the current clue."""
         return self.order[self.turn]
@@ -231,7 +329,10 @@ class Game:
         if not user in self.players:  # idempotent
             self.players[user] = Player(user)
             self.order.append(user)
+            self._seat_players()
         self.colours[user] = colour  # alow colour changing
+        self.events.record(Events.JOIN, user, int(colour, 16))
+        self.changed()
 
     def kick_player(self, user, is_permanent=False):
         """Kicks a user from the game, or throws APIError."""
@@ -242,6 +343,7 @@ class Game:
         if self.state in (States.PLAY, States.VOTE):
             raise APIError(Codes.KICK_BAD_STATE)
         self.players.pop(user)
+        self._seat_players()
         turn = self.order.index(user)
         self.order.remove(user)
         # Readjust turn in case game is currently running
@@ -250,6 +352,19 @@ class Game:
         self.turn %= len(self.players)
         if is_permanent:
             self.perma_banned.add(user)
+        self.events.record(Events.KICK, user, int(is_permanent))
+        self.changed()
+
+    def _seat_players(self):
+        # A new dict, such that the seats of any past round remain as they were.
+        self.seats = dict((user, seat) for seat, user in enumerate(self.players))
+
+    def _deal(self, user):
+        """Deals the next card (if any) to the user's hand."""
+        card = self.deck.deal()
+        self.players[user].deal(card)
+        if card is not None:
+            self.events.record(Events.DEAL, user, card.index)
 
     def start_game(self):
         """Transitions from BEGIN to CLUE, or throws APIError."""
@@ -257,16 +372,15 @@ class Game:
             raise APIError(Codes.BEGIN_BAD_STATE)
         if len(self.players) < self.limits.min_players:
             raise APIError(Codes.NOT_ENOUGH_PLAYERS)
-        random.shuffle(self.order)
+        if self.deck.left() < len(self.players) * self.CARDS_PER_PERSON:
+            raise APIError(Codes.DECK_TOO_SMALL)
+        self.random().shuffle(self.order)
+        self.events.record(Events.START)
         for user in self.players:
             for _ in range(self.CARDS_PER_PERSON):
-                card = self.deck.deal()
-                if card is None:
-                    self.init_game()  # rewind the dealing
-                    raise APIError(Codes.DECK_TOO_SMALL)
-                self.players[user].deal(card)
+                self._deal(user)
         self.state = States.CLUE
-        self.ping()
+        self.changed()
 
     def create_clue(self, user, clue, card):
         """Transitions from CLUE to PLAY, or throws APIError."""
@@ -280,11 +394,19 @@ class Game:
             raise APIError(Codes.CLUE_TOO_LONG)
         if not self.players[user].has_card(card):
             raise APIError(Codes.NOT_HAVE_CARD)
-        self.round = Round(self.players, clue, self.clue_maker())
+        self.round = Round(
+            self.players,
+            self.seats,
+            clue,
+            self.clue_maker(),
+            self.round.number + 1,
+            self.random(),
+        )
         self.round.play_card(user, card)
-        self.players[user].deal(self.deck.deal())
+        self.events.record_clue(user, clue, card)
+        self._deal(user)
         self.state = States.PLAY
-        self.ping()
+        self.changed()
 
     def play_card(self, user, card):
         """Makes the given user play a card, or throws APIError."""
@@ -299,14 +421,15 @@ class Game:
         if not self.players[user].has_card(card):
             raise APIError(Codes.NOT_HAVE_CARD)
         self.round.play_card(user, card)
-        self.players[user].deal(self.deck.deal())
+        self.events.record(Events.PLAY, user, card.index)
+        self._deal(user)
         if self.round.has_everyone_played():
             # Transition from PLAY to VOTE.
             self.round.cast_vote(
-                self.clue_maker(), self.round.user_to_card[self.clue_maker()]
+                self.clue_maker(), self.round.get_played_card(self.clue_maker())
             )
             self.state = States.VOTE
-        self.ping()
+        self.changed()
 
     def cast_vote(self, user, card):
         """Make the given user vote for a card, or throws APIError."""
@@ -321,9 +444,12 @@ class Game:
         if self.round.has_voted(user):
             raise APIError(Codes.VOTE_ALREADY)
         self.round.cast_vote(user, card)
+        self.events.record(Events.VOTE, user, card.index)
         if self.round.has_everyone_voted():
             # Transition from VOTE to CLUE or END.
             self._do_scoring()
+            for u, score in self.round.get_scores():
+                self.events.record(Events.SCORE, u, score)
             self.turn = (self.turn + 1) % len(self.players)
             self.state = States.CLUE
             if self.deck.is_empty():
@@ -331,12 +457,13 @@ class Game:
             for p in self.players.values():
                 if p.score >= self.max_score:
                     self.state = States.END
-        self.ping()
+        self.changed()
 
     def _do_scoring(self):
         """Increments the scores of all players for this Round."""
+        voters = self.round.get_voters()
         for user in self.players:
-            v = self.round.card_to_voted_users[self.round.user_to_card[user]]
+            v = voters[self.round.seats[user]]
             if user == self.clue_maker():
                 if len(v) == 0 or len(v) == len(self.players) - 1:
                     for u in self.players:
@@ -1,32 +1,111 @@
 """Data for all card related objects."""
 
+from array import array
 import random
 from dixit.utils import hash_obj
 
 
 class Card:
-    """Data for a single card."""
+    """Data for a single card, which is shared by every game via the catalogue."""
 
-    def __init__(self, cid, url):
-        """Initializes a card with a given id and image url."""
+    __slots__ = ("cid", "url", "full_url", "index", "set_name")
+
+    def __init__(self, cid, url, full_url, index, set_name):
+        """Initializes a card with a given id, image urls, and catalogue index.
+
+        The url is of the image at its display size, and the full_url is of the
+        original image, for magnifying.
+        """
         self.cid = cid
         self.url = url
+        self.full_url = full_url
+        self.index = index
+        self.set_name = set_name
+
+    def __reduce__(self):
+        """Pickles the card by its id, such that it unpickles as the shared card."""
+        return get_card, (self.cid,)
 
     def to_json(self):
-        """Returns the data in a JSON-serializable format."""
-        return {"cid": self.cid, "url": self.url}
+        """Returns the data in a JSON-serializable format.
+
+        The full url is left out if it is the same as the url.
+        """
+        if self.full_url == self.url:
+            return {"cid": self.cid, "url": self.url}
+        return {"cid": self.cid, "url": self.url, "full": self.full_url}
+
+
+class Catalogue:
+    """Every card of every card set, each with a small integer index.
+
+    Cards are only ever appended, one per card id, such that the decks of all
+    games can refer to them by their index, in an array of unsigned shorts.
+    """
+
+    MAX_CARDS = 2**16
+
+    def __init__(self):
+        """Initializes an empty catalogue."""
+        self.cards = []  # index -> Card
+        self.cards_by_cid = {}  # cid -> Card
+
+    def __getitem__(self, index):
+        """Returns the Card with the given index."""
+        return self.cards[index]
+
+    def add(self, set_name, cid, url, full_url=None):
+        """Returns the Card with the given id, adding it if it is new.
+
+        A card that is already in the catalogue is updated to the urls in place,
+        such that the games that hold it see them too.
+        """
+        if full_url is None:
+            full_url = url
+        card = self.cards_by_cid.get(cid)
+        if card is None:
+            if len(self.cards) >= self.MAX_CARDS:
+                raise ValueError(
+                    "The catalogue is limited to %d cards" % self.MAX_CARDS
+                )
+            card = Card(cid, url, full_url, len(self.cards), set_name)
+            self.cards.append(card)
+            self.cards_by_cid[cid] = card
+        else:
+            card.url = url
+            card.full_url = full_url
+        return card
+
+    def get_card(self, cid):
+        """Returns the Card with the given card id, or raises KeyError."""
+        return self.cards_by_cid[cid]
+
+
+CATALOGUE = Catalogue()
+
+
+def get_card(cid):
+    """Returns the Card in the catalogue with the given card id."""
+    return CATALOGUE.get_card(cid)
 
 
 class CardSet:
     """Data for a static set of cards."""
 
-    def __init__(self, name, card_paths, is_default=False):
-        """Initalizes a set of distinct Card objects."""
+    def __init__(self, name, card_paths, is_default=False, full_paths=None):
+        """Initalizes a set of distinct Card objects in the catalogue.
+
+        The full_paths are of the original images, if card_paths are resized.
+        """
         self.name = name
-        prefix = hash_obj(name, add_random=True)[:5]  # must be unique
+        prefix = hash_obj(name)[:5]  # must be unique, and the same across restarts
+        if full_paths is None:
+            full_paths = card_paths
         self.cards = [
-            Card("card%s%d" % (prefix, i), p) for i, p in enumerate(card_paths)
+            CATALOGUE.add(name, "card%s%d" % (prefix, i), p, full_p)
+            for i, (p, full_p) in enumerate(zip(card_paths, full_paths))
         ]
+        self.indices = array("H", (card.index for card in self.cards))
         self.is_default = is_default
 
     def __iter__(self):
@@ -39,21 +118,36 @@ class CardSet:
 
 
 class Deck:
-    """Data for a deck of cards. Belongs to the scope of one game."""
+    """Data for a deck of cards. Belongs to the scope of one game.
 
-    def __init__(self, card_sets, shuffle=True):
-        """Builds a new deck of Card objects from a list of CardSet objects."""
-        self.name = ", ".join(card_set.name for card_set in card_sets)
-        self.cards = [card for card_set in card_sets for card in card_set]
-        self.card_lookup = dict((card.cid, card) for card in self.cards)
-
-        self.reset(shuffle)
+    The deck is a permutation of the catalogue indices of its cards, of which
+    the first few have been dealt.
+    """
 
-    def reset(self, shuffle=True):
-        """Collects and optionally reshuffles all cards."""
+    def __init__(self, card_sets, shuffle=True, rng=random):
+        """Builds a new deck of card indices from a list of CardSet objects."""
+        self.name = ", ".join(card_set.name for card_set in card_sets)
+        self.set_names = tuple(card_set.name for card_set in card_sets)
+        self.cards = array("H")
+        for card_set in card_sets:
+            self.cards.extend(card_set.indices)
+
+        self.reset(shuffle, rng)
+
+    @classmethod
+    def from_cards(cls, cards, set_names):
+        """Returns a deck of the given Cards in order, from the named card sets."""
+        deck = cls([], shuffle=False)
+        deck.name = ", ".join(set_names)
+        deck.set_names = tuple(set_names)
+        deck.cards = array("H", (card.index for card in cards))
+        return deck
+
+    def reset(self, shuffle=True, rng=random):
+        """Collects and optionally reshuffles all cards (with the given RNG)."""
         self.dealt = 0
         if shuffle:
-            random.shuffle(self.cards)
+            rng.shuffle(self.cards)
 
     def is_empty(self):
         """Returns true iff there are no cards left to deal."""
@@ -72,8 +166,11 @@ class Deck:
         if self.is_empty():
             return None
         self.dealt += 1
-        return self.cards[self.dealt - 1]
+        return CATALOGUE.cards[self.cards[self.dealt - 1]]
 
     def get_card(self, cid):
-        """Returns the Card with the corresponding card id."""
-        return self.card_lookup[cid]
+        """Returns the Card of this deck with the given card id, or raises KeyError."""
+        card = CATALOGUE.cards_by_cid[cid]
+        if card.set_name not in self.set_names:
+            raise KeyError(cid)
+        return card
@@ -0,0 +1,77 @@
+"""Compact stream of the events of a game, for replaying it (see dixit.replay)."""
+
+from array import array
+import struct
+
+
+class Events:
+    """Types of events, each recorded as [type, user, a, b] in an EventLog.
+
+    The commands are replayed, whereas the outcomes (DEAL and SCORE) are only
+    recorded to check that a replay turns out the same.
+    """
+
+    JOIN = 0  # a is the colour, as an int
+    KICK = 1  # a is whether the kick is permanent
+    START = 2
+    CLUE = 3  # a is the card, and b the index of the clue
+    PLAY = 4  # a is the card
+    VOTE = 5  # a is the card
+    HIDE = 6
+    DEAL = 7  # a is the card
+    SCORE = 8  # a is the points scored in the round
+
+    CARD_EVENTS = (CLUE, PLAY, VOTE, DEAL)  # whose a is a card
+
+    @classmethod
+    def name(cls, event):
+        """Returns the name of the given type of event, or None if there is none."""
+        for name, value in vars(cls).items():
+            if value == event and name.isupper() and name != "CARD_EVENTS":
+                return name
+        return None
+
+
+class EventLog:
+    """Every event of one game, as a flat array of ints.
+
+    Users are recorded by their index in self.users, in order of appearance,
+    starting with the host, and cards by their catalogue index.
+    """
+
+    __slots__ = ("data", "users", "user_indices", "clues")
+
+    WIDTH = 4  # ints per event
+    EVENT = struct.Struct("@%di" % WIDTH)  # packs like the array, but faster
+
+    def __init__(self, host):
+        """Initializes an empty log for a game with the given host."""
+        self.data = array("i")
+        self.users = [host]
+        self.user_indices = {host: 0}
+        self.clues = []  # str of each clue, in the order given
+
+    def __len__(self):
+        """Returns the number of events."""
+        return len(self.data) // self.WIDTH
+
+    def __iter__(self):
+        """Iterates over each event, as a tuple (type, user index, a, b)."""
+        data = self.data
+        for i in range(0, len(data), self.WIDTH):
+            yield tuple(data[i : i + self.WIDTH])
+
+    def record(self, event, user=None, a=0, b=0):
+        """Appends an event of the given type, for the given User (if any)."""
+        index = 0
+        if user is not None:
+            index = self.user_indices.get(user)
+            if index is None:
+                index = self.user_indices[user] = len(self.users)
+                self.users.append(user)
+        self.data.frombytes(self.EVENT.pack(event, index, a, b))
+
+    def record_clue(self, user, clue, card):
+        """Appends a CLUE event, keeping the text of the clue."""
+        self.record(Events.CLUE, user, card.index, len(self.clues))
+        self.clues.append(str(clue))
@@ -0,0 +1,249 @@
+"""Append-only journal of every change to the server state, with snapshots."""
+
+import gc
+import json
+import logging
+import os
+import pickle
+
+import tornado.ioloop
+import tornado.locks
+
+from dixit.codes import APIError
+from dixit.core import Game, StringClue
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """Records every change to the server state, so that it survives restarts.
+
+    Each entry is a JSON list [seq, op, *args]. Entries are buffered in memory
+    and appended to the journal file in batches, off of the IOLoop thread.
+    Periodic snapshots of the full state allow the journal to be truncated,
+    such that a restart only loads the last snapshot and then replays the
+    entries recorded after it. A snapshot is also taken as soon as
+    snapshot_entries were recorded since the last, which bounds the restart.
+    """
+
+    JOURNAL_FILENAME = "journal.jsonl"
+    SNAPSHOT_FILENAME = "snapshot.pickle"
+
+    def __init__(self, application, journal_config):
+        """Initializes an empty journal, which is disabled without a directory."""
+        self.application = application
+        self.directory = journal_config["directory"]
+        self.enabled = bool(self.directory)
+        self.journal_path = os.path.join(self.directory, self.JOURNAL_FILENAME)
+        self.snapshot_path = os.path.join(self.directory, self.SNAPSHOT_FILENAME)
+        self.flush_interval = float(journal_config["flush_interval"])
+        self.snapshot_interval = float(journal_config["snapshot_interval"])
+        self.snapshot_entries = int(journal_config["snapshot_entries"])
+
+        self.seq = 0  # seq of the most recently recorded entry
+        self.entries = 0  # entries recorded since the last snapshot
+        self.buffer = []  # encoded entries that have yet to be written
+        self.replaying = False  # whether to ignore record() while restoring
+        self.lock = tornado.locks.Lock()  # serializes writes to either file
+        self.file = None  # journal file, opened for appending by restore()
+
+    def record(self, op, *args):
+        """Buffers an entry for the change, to be written by the next flush().
+
+        Schedules a snapshot if the entry is the snapshot_entries-th since the last.
+        """
+        if not self.enabled or self.replaying:
+            return
+        self.seq += 1
+        entry = [self.seq, op]
+        entry.extend(args)
+        self.buffer.append(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.entries += 1
+        if self.entries == self.snapshot_entries:
+            tornado.ioloop.IOLoop.current().add_callback(self.snapshot)
+
+    def start(self):
+        """Starts flushing and snapshotting periodically on the current IOLoop."""
+        if self.enabled:
+            tornado.ioloop.PeriodicCallback(
+                self.flush, self.flush_interval * 1000
+            ).start()
+            tornado.ioloop.PeriodicCallback(
+                self.snapshot, self.snapshot_interval * 1000
+            ).start()
+
+    async def flush(self):
+        """Appends and fsyncs all buffered entries, in an executor thread."""
+        async with self.lock:
+            await self._flush()
+
+    async def _flush(self):
+        if self.buffer:
+            data, self.buffer = "".join(self.buffer), []
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self._write, data
+            )
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    async def snapshot(self):
+        """Writes a snapshot of the full state, and then truncates the journal.
+
+        The state is pickled on the IOLoop thread, such that it is consistent
+        with the seq of the last entry, and then written by an executor thread.
+        """
+        async with self.lock:
+            await self._flush()
+            state = self.application.dump_state()
+            state["seq"] = self.seq
+            self.entries = 0
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self._write_snapshot, data
+            )
+
+    def _write_snapshot(self, data):
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        # Entries up to the snapshot's seq are skipped by restore() regardless,
+        # in case of a crash before the truncation.
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+
+    def restore(self):
+        """Loads the last snapshot and replays the journal, before starting.
+
+        A partially written entry at the end of the journal is discarded.
+        """
+        if not self.enabled:
+            return
+        # Restoring allocates so many long-lived objects that the cyclic
+        # garbage collector would otherwise dominate the time that it takes.
+        gc.disable()
+        try:
+            self._restore()
+        finally:
+            gc.enable()
+        self.file = open(self.journal_path, "a", encoding="utf-8")
+
+    def _restore(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Cards are unpickled, and replayed, by their ids in the catalogue, and
+        # so the card sets are loaded into it first.
+        self.application.card_sets
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as snapshot_file:
+                state = pickle.load(snapshot_file)
+            self.seq = state["seq"]
+            self.application.load_state(state)
+
+        replayed = 0
+        valid = 0  # length of the journal up to the last complete entry
+        if os.path.exists(self.journal_path):
+            self.replaying = True
+            with open(self.journal_path, "rb") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning("Discarding incomplete journal entry")
+                        break
+                    valid += len(line)
+                    if entry[0] > self.seq:
+                        self._replay(entry)
+                        self.seq = entry[0]
+                        replayed += 1
+            self.entries = replayed
+            self.replaying = False
+            if valid < os.path.getsize(self.journal_path):
+                os.truncate(self.journal_path, valid)
+
+        logger.info(
+            "Restored %d games and %d users, replaying %d journal entries",
+            len(self.application.games),
+            len(self.application.users),
+            replayed,
+        )
+
+    def _replay(self, entry):
+        try:
+            getattr(self, "_replay_" + entry[1])(*entry[2:])
+        except (APIError, KeyError) as exc:
+            logger.warning("Failed to replay journal entry %s: %r", entry, exc)
+
+    def _replay_user(self, uid, puid):
+        self.application.users.add_user(uid, puid)
+
+    def _replay_name(self, uid, name):
+        user = self.application.users.get_user(uid)
+        self.application.users.set_name(user, name)
+        self.application.user_renamed(user)
+
+    def _replay_forget_user(self, uid):
+        self.application.remove_user(self.application.users.get_user(uid))
+
+    def _replay_create(
+        self,
+        gid,
+        uid,
+        card_set_indices,
+        password,
+        name,
+        max_players,
+        max_score,
+        max_clue_length,
+        seed,
+    ):
+        application = self.application
+        game = Game(
+            application.users.get_user(uid),
+            [application.card_sets[i] for i in card_set_indices],
+            password,
+            name,
+            max_players,
+            max_score,
+            max_clue_length,
+            application.limits,
+            seed,
+        )
+        application.add_game(game, gid)
+
+    def _replay_hide(self, gid):
+        self.application.games[gid].hide()
+
+    def _replay_forget_game(self, gid):
+        self.application.remove_game(gid)
+
+    def _replay_join(self, gid, uid, colour):
+        user = self.application.users.get_user(uid)
+        self.application.games[gid].add_player(user, colour)
+
+    def _replay_start(self, gid):
+        self.application.games[gid].start_game()
+
+    def _replay_clue(self, gid, uid, clue, cid):
+        game = self.application.games[gid]
+        user = self.application.users.get_user(uid)
+        game.create_clue(user, StringClue(clue), game.get_card(cid))
+
+    def _replay_play(self, gid, uid, cid):
+        game = self.application.games[gid]
+        game.play_card(self.application.users.get_user(uid), game.get_card(cid))
+
+    def _replay_vote(self, gid, uid, cid):
+        game = self.application.games[gid]
+        game.cast_vote(self.application.users.get_user(uid), game.get_card(cid))
+
+    def _replay_kick(self, gid, puid):
+        user = self.application.users.get_user_by_puid(puid)
+        self.application.games[gid].kick_player(user)
+
+    def _replay_chat(self, room, name, msg, t):
+        self.application.get_chat_log(room).add(name, msg, t)
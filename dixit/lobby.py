@@ -0,0 +1,100 @@
+"""Incrementally maintained index of the games listed in the lobby."""
+
+from collections import OrderedDict
+
+from dixit.utils import INFINITY
+
+
+def summarize(game):
+    """Returns the JSON-serializable summary of a game for the lobby.
+
+    This omits its activity and anything that is specific to the viewer.
+    """
+    return {
+        "name": game.name,
+        "host": game.host.name,
+        "players": [u.name for u in game.players],
+        "maxPlayers": game.max_players,
+        "state": game.state,
+        "left": game.deck.left(),
+        "size": game.deck.size(),
+        "topScore": (
+            max(p.score for p in list(game.players.values())) if game.players else 0
+        ),
+        "maxScore": game.max_score if game.max_score != INFINITY else None,
+        "deckName": game.deck.name,
+    }
+
+
+class Lobby:
+    """Summaries of all visible games, updated whenever a game changes.
+
+    Each entry remembers the version at which it was last updated, and the
+    entries are kept in that order, so that finding every change since a
+    given version only costs as much as the number of changes.
+    """
+
+    MAX_REMOVED = 1024  # default number of removed gids to remember
+
+    def __init__(self, max_removed=MAX_REMOVED):
+        """Initializes an empty lobby."""
+        self.version = 0
+        self.entries = OrderedDict()  # gid -> (version, Game, summary)
+        self.removed = OrderedDict()  # gid -> version at which it was removed
+        self.max_removed = max_removed
+        self.floor = 0  # removals at or before this version are forgotten
+
+    def update(self, gid, game):
+        """Re-summarizes the game with the given gid, or removes it if hidden."""
+        if game.hidden:
+            self.remove(gid)
+        else:
+            self.put(gid, game, summarize(game))
+
+    def put(self, gid, game, summary):
+        """Lists the game with the given gid and summary, replacing any entry."""
+        self.version += 1
+        self.entries.pop(gid, None)  # re-inserted at the end
+        self.entries[gid] = (self.version, game, summary)
+
+    def remove(self, gid):
+        """Removes the game with the given gid, if it is listed."""
+        if gid in self.entries:
+            self.version += 1
+            del self.entries[gid]
+            self.removed[gid] = self.version
+            if len(self.removed) > self.max_removed:
+                _, self.floor = self.removed.popitem(last=False)
+
+    def listing(self):
+        """Returns all (gid, Game, summary) entries, most recently active first.
+
+        The entries are already in the order of their last update, which is when
+        their games were last active.
+        """
+        return [
+            (gid, game, summary)
+            for gid, (_, game, summary) in reversed(self.entries.items())
+        ]
+
+    def changes_since(self, version):
+        """Returns the entries updated, and gids removed, since the version.
+
+        The entries are as in listing(). If the removals since that version
+        have been forgotten, this instead returns None for the removed gids,
+        alongside the full listing.
+        """
+        if not self.floor <= version <= self.version:
+            return self.listing(), None
+        updated = []
+        for gid in reversed(self.entries):
+            entry_version, game, summary = self.entries[gid]
+            if entry_version <= version:
+                break
+            updated.append((gid, game, summary))
+        removed = []
+        for gid in reversed(self.removed):
+            if self.removed[gid] <= version:
+                break
+            removed.append(gid)
+        return updated, removed
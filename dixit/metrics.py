@@ -0,0 +1,239 @@
+"""Instrumentation of requests and state, in the Prometheus text format."""
+
+import bisect
+from collections import Counter
+
+from dixit.codes import Codes
+from dixit.core import States
+
+# Upper bounds (in seconds) of the latency buckets, up to the long-poll timeout.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CODE_NAMES = dict(
+    (value, name) for name, value in vars(Codes).items() if name.isupper()
+)
+STATE_NAMES = dict(
+    (value, name) for name, value in vars(States).items() if name.isupper()
+)
+
+
+class Histogram:
+    """Counts of observed values in buckets, along with their sum."""
+
+    def __init__(self, buckets=BUCKETS):
+        """Initializes the histogram with the given upper bounds of each bucket."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is for +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Counts the value in the first bucket whose bound is at least value."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        """Yields the (name, labels, value) of each cumulative bucket and total."""
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield name + "_bucket", labels + (("le", str(bound)),), total
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, total
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, _escape(value)) for key, value in labels)
+
+
+class Metrics:
+    """Latencies of requests and commands, and counts of responses and errors.
+
+    Each request costs a few dictionary lookups and a bisection, so this is
+    always on. Gauges of the application's state are only computed by render().
+    """
+
+    def __init__(self, application):
+        """Initializes the metrics for the application, with nothing observed."""
+        self.application = application
+        self.handler_latencies = {}  # handler name -> Histogram
+        self.command_latencies = {}  # Commands name -> Histogram
+        self.responses = Counter()  # (handler name, HTTP status) -> count
+        self.errors = Counter()  # Codes value -> count
+        self.push_dropped = 0  # push clients disconnected for being too slow
+
+    def observe_request(self, handler, seconds):
+        """Records a finished request of the given RequestHandler."""
+        name = type(handler).__name__
+        histogram = self.handler_latencies.get(name)
+        if histogram is None:
+            histogram = self.handler_latencies[name] = Histogram()
+        histogram.observe(seconds)
+        if handler.command is not None:
+            histogram = self.command_latencies.get(handler.command)
+            if histogram is None:
+                histogram = self.command_latencies[handler.command] = Histogram()
+            histogram.observe(seconds)
+        self.responses[name, handler.get_status()] += 1
+
+    def count_error(self, code):
+        """Records an APIError with the given code."""
+        self.errors[code] += 1
+
+    def count_push_dropped(self):
+        """Records a push client that was disconnected for being too slow."""
+        self.push_dropped += 1
+
+    def _gauges(self):
+        application = self.application
+        games = Counter(game.state for game in application.games.values())
+        chat_logs = [("lobby", application.chat_log)]
+        chat_logs.extend(("game", log) for log in application.game_chat_logs.values())
+        backlog = Counter()
+        for room, chat_log in chat_logs:
+            backlog[room] += min(chat_log.seq, chat_log.size)
+        decks = [game.deck for game in application.games.values()]
+
+        yield "dixit_users", "Users who are known to the server.", [
+            ((), len(application.users.users))
+        ]
+        yield "dixit_games", "Games by state.", [
+            ((("state", name),), games[state]) for state, name in STATE_NAMES.items()
+        ]
+        yield "dixit_chat_messages", "Chat messages that are stored, by room.", [
+            ((("room", room),), backlog[room]) for room in ("lobby", "game")
+        ]
+        yield "dixit_deck_cards", "Cards in the decks of all games.", [
+            ((), sum(deck.size() for deck in decks))
+        ]
+        yield "dixit_deck_cards_left", "Cards left to deal in all games.", [
+            ((), sum(deck.left() for deck in decks))
+        ]
+        yield "dixit_long_polls", "Games with board requests waiting on them.", [
+            ((), len(application.game_conditions))
+        ]
+        yield "dixit_bot_games_due", "Games in which a bot is about to act.", [
+            ((), len(application.bots.due))
+        ]
+        yield "dixit_rate_limit_buckets", "Token buckets of the rate limiter.", [
+            ((), len(application.rate_limiter.buckets))
+        ]
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def add(name, kind, help_text, samples):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for sample_name, labels, value in samples:
+                lines.append("%s%s %s" % (sample_name, _format_labels(labels), value))
+
+        def histograms(name, label, by_label):
+            for key, histogram in sorted(by_label.items()):
+                yield from histogram.samples(name, ((label, key),))
+
+        add(
+            "dixit_request_duration_seconds",
+            "histogram",
+            "Latency of requests, by handler.",
+            histograms(
+                "dixit_request_duration_seconds", "handler", self.handler_latencies
+            ),
+        )
+        add(
+            "dixit_command_duration_seconds",
+            "histogram",
+            "Latency of game commands (GET_BOARD?since for long-polls).",
+            histograms(
+                "dixit_command_duration_seconds", "command", self.command_latencies
+            ),
+        )
+        add(
+            "dixit_responses_total",
+            "counter",
+            "Responses, by handler and HTTP status.",
+            (
+                (
+                    "dixit_responses_total",
+                    (("handler", name), ("status", status)),
+                    count,
+                )
+                for (name, status), count in sorted(self.responses.items())
+            ),
+        )
+        add(
+            "dixit_api_errors_total",
+            "counter",
+            "APIErrors returned, by code.",
+            (
+                (
+                    "dixit_api_errors_total",
+                    (("code", code), ("name", CODE_NAMES.get(code, ""))),
+                    count,
+                )
+                for code, count in sorted(self.errors.items())
+            ),
+        )
+        add(
+            "dixit_rate_limited_total",
+            "counter",
+            "Requests refused by the rate limiter, by kind of client and budget.",
+            (
+                (
+                    "dixit_rate_limited_total",
+                    (("kind", kind), ("budget", budget)),
+                    count,
+                )
+                for (kind, budget), count in sorted(
+                    self.application.rate_limiter.limited.items()
+                )
+            ),
+        )
+        add(
+            "dixit_reaper_freed_total",
+            "counter",
+            "Users and games freed by the reaper.",
+            (
+                ("dixit_reaper_freed_total", (("kind", kind),), count)
+                for kind, count in self.application.reaper.freed.items()
+            ),
+        )
+        add(
+            "dixit_push_dropped_total",
+            "counter",
+            "Push clients disconnected for being too far behind.",
+            [("dixit_push_dropped_total", (), self.push_dropped)],
+        )
+        add(
+            "dixit_spectator_boards_encoded_total",
+            "counter",
+            "Boards encoded for all the spectators of a game at once.",
+            [
+                (
+                    "dixit_spectator_boards_encoded_total",
+                    (),
+                    self.application.spectator_boards.encoded,
+                )
+            ],
+        )
+        add(
+            "dixit_bot_actions_total",
+            "counter",
+            "Clues, cards, and votes of the server-side bots.",
+            [("dixit_bot_actions_total", (), self.application.bots.actions)],
+        )
+        for name, help_text, samples in self._gauges():
+            add(
+                name,
+                "gauge",
+                help_text,
+                ((name, labels, value) for labels, value in samples),
+            )
+        lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,70 @@
+"""Routing of change notifications from server objects to subscribers."""
+
+from collections import defaultdict
+
+
+class Topics:
+    """Names of the topics that a client may subscribe to."""
+
+    GAMES = "games"  # the list of all games
+    USERS = "users"  # the list of all users
+    CHAT = "chat"  # the chat log of the lobby
+    GAME_PREFIX = "game/"  # followed by a gid, for that game's board
+    GAME_CHAT_PREFIX = "chat/"  # followed by a gid, for that game's chat log
+
+    @classmethod
+    def game(cls, gid):
+        """Returns the topic for the board of the game with the given gid."""
+        return "%s%d" % (cls.GAME_PREFIX, gid)
+
+    @classmethod
+    def chat(cls, room):
+        """Returns the topic for the chat log of a game's gid, or None (lobby)."""
+        return cls.CHAT if room is None else "%s%d" % (cls.GAME_CHAT_PREFIX, room)
+
+    @classmethod
+    def get_gid(cls, topic):
+        """Returns the gid of a game topic, or None if not a game topic."""
+        return cls._get_suffix(cls.GAME_PREFIX, topic)
+
+    @classmethod
+    def get_chat_gid(cls, topic):
+        """Returns the gid of a game's chat topic, or None if not one."""
+        return cls._get_suffix(cls.GAME_CHAT_PREFIX, topic)
+
+    @classmethod
+    def _get_suffix(cls, prefix, topic):
+        if not topic.startswith(prefix):
+            return None
+        try:
+            return int(topic[len(prefix) :])
+        except ValueError:
+            return None
+
+
+class PubSub:
+    """Maps each topic to the set of subscribers to notify when it changes.
+
+    A subscriber is any object with a notify(topic) method.
+    """
+
+    def __init__(self):
+        """Initializes with no subscribers."""
+        self.subscribers = defaultdict(set)  # topic -> set(subscriber)
+
+    def subscribe(self, topic, subscriber):
+        """Registers the subscriber to be notified about the topic."""
+        self.subscribers[topic].add(subscriber)
+
+    def unsubscribe(self, topic, subscriber):
+        """Stops notifying the subscriber about the topic (if subscribed)."""
+        subscribers = self.subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[topic]
+
+    def publish(self, topic):
+        """Notifies every subscriber of the topic that it has changed."""
+        for subscriber in list(self.subscribers.get(topic, ())):
+            subscriber.notify(topic)
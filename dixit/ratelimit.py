@@ -0,0 +1,68 @@
+"""Admission control of requests, with token buckets per client."""
+
+from collections import Counter, OrderedDict
+import time
+
+
+class RateLimiter:
+    """Token buckets for each client, by uid and by IP address, per budget.
+
+    Each bucket holds up to a burst of tokens, and refills at a rate of tokens
+    per second. A request takes one token from the bucket of its budget (e.g.,
+    "read", "write", or "chat") for its IP address, and for its uid if it is a
+    known user. A budget without a configured [rate, burst] is unlimited. The
+    buckets are kept in a bounded table, from which the least recently used
+    are evicted, as if they were full.
+    """
+
+    KINDS = ("ip", "uid")
+
+    def __init__(self, rate_limits_config, clock=time.monotonic):
+        """Initializes empty buckets with the given limits."""
+        self.enable = rate_limits_config["enable"]
+        self.max_buckets = int(rate_limits_config["max_buckets"])
+        self.limits = {}  # (kind, budget) -> (rate, burst)
+        for kind in self.KINDS:
+            for budget, (rate, burst) in rate_limits_config[kind].items():
+                self.limits[kind, budget] = (float(rate), float(burst))
+        self.clock = clock
+
+        # (kind, budget, key) -> [tokens, time], least recently used first
+        self.buckets = OrderedDict()
+        self.limited = Counter()  # (kind, budget) -> requests refused
+
+    def _take(self, kind, budget, key, now):
+        """Takes a token, returning 0, or else the seconds until there is one."""
+        limit = self.limits.get((kind, budget))
+        if limit is None:
+            return 0
+        rate, burst = limit
+        bucket_key = (kind, budget, key)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self.buckets[bucket_key] = [burst, now]
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(bucket_key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        self.limited[kind, budget] += 1
+        return (1 - bucket[0]) / rate
+
+    def admit(self, budget, ip, uid=None):
+        """Returns 0 if a request is admitted, or else the seconds to retry after.
+
+        The uid should only be given for known users, such that clients cannot
+        evade their budget (and fill the table) by making up uids.
+        """
+        if not self.enable:
+            return 0
+        now = self.clock()
+        wait = self._take("ip", budget, ip, now)
+        if not wait and uid is not None:
+            wait = self._take("uid", budget, uid, now)
+        return wait
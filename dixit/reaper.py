@@ -0,0 +1,110 @@
+"""Periodic freeing of idle users and abandoned games."""
+
+import itertools
+import logging
+import time
+
+import tornado.ioloop
+
+from dixit.core import States
+from dixit.utils import INFINITY
+
+logger = logging.getLogger(__name__)
+
+
+class Reaper:
+    """Frees idle users and abandoned games, and caps how many are kept.
+
+    Users only expire while they are in no game, and hidden or finished games
+    expire sooner than games that might still be resumed. Beyond the caps, the
+    least recently active users and games are evicted no matter what, and users
+    who are in games are only evicted along with those games.
+    """
+
+    FREED = ("expired_users", "evicted_users", "expired_games", "evicted_games")
+
+    def __init__(self, application, reaper_config):
+        """Initializes the reaper for the application's users and games."""
+        self.application = application
+        self.interval = self._get_int(reaper_config, "interval")
+        self.user_ttl = self._get_int(reaper_config, "user_ttl")
+        self.game_ttl = self._get_int(reaper_config, "game_ttl")
+        self.finished_game_ttl = self._get_int(reaper_config, "finished_game_ttl")
+        self.max_users = self._get_int(reaper_config, "max_users")
+        self.max_games = self._get_int(reaper_config, "max_games")
+
+        self.freed = dict.fromkeys(self.FREED, 0)  # counters since startup
+
+    def _get_int(self, reaper_config, key):
+        val = int(reaper_config[key])
+        return INFINITY if val == -1 else val
+
+    def start(self):
+        """Starts reaping periodically on the current IOLoop."""
+        tornado.ioloop.PeriodicCallback(self.reap, self.interval * 1000).start()
+
+    def reap(self):
+        """Frees every expired game and user, and then enforces the caps."""
+        freed = dict(self.freed)
+        now = time.time()
+        games = self.application.games
+        for gid, game in list(games.items()):
+            finished = game.hidden or game.state == States.END
+            ttl = self.finished_game_ttl if finished else self.game_ttl
+            if now - game.last_active > ttl:
+                self.application.remove_game(gid)
+                self.freed["expired_games"] += 1
+
+        members = self.members()
+        users = self.application.users
+        for user in list(users):
+            if user not in members and now - user.last_active > self.user_ttl:
+                self.application.remove_user(user)
+                self.freed["expired_users"] += 1
+
+        self.enforce_caps()
+        delta = dict((key, self.freed[key] - freed[key]) for key in self.FREED)
+        if any(delta.values()):
+            logger.info("Reaped %s", delta)
+
+    def members(self):
+        """Returns the gids of the games that each user hosts or plays in."""
+        members = {}
+        for gid, game in self.application.games.items():
+            for user in itertools.chain((game.host,), game.players):
+                members.setdefault(user, []).append(gid)
+        return members
+
+    def enforce_caps(self):
+        """Evicts the least recently active users and games beyond the caps.
+
+        Users who are in a game are only evicted if there is no one else, and
+        then their games are evicted first, such that no game keeps a user who
+        is forgotten.
+        """
+        games = self.application.games
+        excess = len(games) - self.max_games
+        if excess > 0:
+            for gid in list(itertools.islice(games, excess)):
+                self.application.remove_game(gid)
+                self.freed["evicted_games"] += 1
+
+        users = self.application.users
+        excess = len(users) - self.max_users
+        if excess > 0:
+            members = self.members()
+            victims = list(
+                itertools.islice((u for u in users if u not in members), excess)
+            )
+            victims += list(
+                itertools.islice(
+                    (u for u in users if u in members), excess - len(victims)
+                )
+            )
+            for user in victims:
+                for gid in members.get(user, ()):
+                    if gid in games:
+                        self.application.remove_game(gid)
+                        self.freed["evicted_games"] += 1
+                self.application.remove_user(user)
+                self.freed["evicted_users"] += 1
@@ -0,0 +1,216 @@
+"""Replays the event stream of a game, to rebuild its state at any event.
+
+Usage: python -m dixit.replay [--index N] [--events] [--repeat N] FILE
+
+where FILE is the JSON dump of a game, e.g., as written from the /admin
+console with `json.dump(dixit.replay.dump(game), open(FILE, "w"))`. Prints
+the state of the game after its first N events (by default, all of them).
+
+A game is replayed by running each of its recorded commands against a new
+Game with the same seed and deck order, which draws the same randomness as
+the original, since that only depends on the seed and the game's version. The
+recorded outcomes (the cards dealt, and the scores) are checked against those
+of the replay, such that a replay with a different version of the rules fails
+loudly instead of diverging silently.
+"""
+
+import argparse
+import functools
+import json
+import os
+import time
+
+from dixit import config
+from dixit.core import Game, Limits, StringClue
+from dixit.deck import CATALOGUE, Deck
+from dixit.events import Events, EventLog
+from dixit.users import User
+
+FORMAT = 1
+CONFIG_FILENAME = os.path.join(os.path.dirname(__file__), "config.json")
+
+
+class ReplayError(Exception):
+    """Raised when a replay does not turn out as recorded."""
+
+
+def dump(game):
+    """Returns the JSON-serializable events of a game, and what replays them.
+
+    Users are identified by their puid, and cards by their id and their
+    position in the deck, to which the events refer.
+    """
+    events = game.events
+    positions = dict((index, pos) for pos, index in enumerate(game.deck.cards))
+    data = list(events.data)
+    for i in range(0, len(data), EventLog.WIDTH):
+        if data[i] in Events.CARD_EVENTS:
+            data[i + 2] = positions[data[i + 2]]
+    set_indices = dict((name, i) for i, name in enumerate(game.deck.set_names))
+    return {
+        "format": FORMAT,
+        "seed": game.seed,
+        "name": game.name,
+        "maxPlayers": game.max_players,
+        "maxScore": game.max_score,
+        "maxClueLength": game.max_clue_length,
+        "minPlayers": game.limits.min_players,
+        "minClueLength": game.limits.min_clue_length,
+        "sets": list(game.deck.set_names),
+        "deck": [
+            [card.cid, set_indices[card.set_name]]
+            for card in map(CATALOGUE.__getitem__, game.deck.cards)
+        ],
+        "users": [[user.puid, user.name] for user in events.users],
+        "clues": list(events.clues),
+        "events": data,
+    }
+
+
+def _get_card(cid, set_name):
+    """Returns the Card with the given id, adding a blank one if it is unknown."""
+    card = CATALOGUE.cards_by_cid.get(cid)
+    return card if card is not None else CATALOGUE.add(set_name, cid, "")
+
+
+@functools.lru_cache(maxsize=None)
+def _default_limit_config():
+    return config.parse(CONFIG_FILENAME)["limits"]
+
+
+def _get_limits(log):
+    limit_config = dict(_default_limit_config())
+    limit_config["min_players"] = log["minPlayers"]
+    limit_config["min_clue_length"] = log["minClueLength"]
+    return Limits(limit_config)
+
+
+def replay(log, index=None, check=True):
+    """Returns a new Game in the state after the first index events of a dump.
+
+    Raises ReplayError if check is true and the replay turns out differently.
+    """
+    if log["format"] != FORMAT:
+        raise ReplayError("Unknown format %r" % log["format"])
+    width = EventLog.WIDTH
+    data = log["events"]
+    end = len(data) if index is None else min(len(data), index * width)
+    users = [User(puid, puid, name) for puid, name in log["users"]]
+    cards = [_get_card(cid, log["sets"][i]) for cid, i in log["deck"]]
+    clues = log["clues"]
+
+    game = Game(
+        users[0],
+        [],
+        "",
+        log["name"],
+        log["maxPlayers"],
+        log["maxScore"],
+        log["maxClueLength"],
+        _get_limits(log),
+        log["seed"],
+    )
+    game.deck = Deck.from_cards(cards, log["sets"])
+
+    for i in range(0, end, width):
+        event, user, a, b = data[i : i + width]
+        if event == Events.PLAY:
+            game.play_card(users[user], cards[a])
+        elif event == Events.VOTE:
+            game.cast_vote(users[user], cards[a])
+        elif event == Events.CLUE:
+            game.create_clue(users[user], StringClue(clues[b]), cards[a])
+        elif event == Events.JOIN:
+            game.add_player(users[user], "%06x" % a)
+        elif event == Events.START:
+            game.start_game()
+        elif event == Events.KICK:
+            game.kick_player(users[user], bool(a))
+        elif event == Events.HIDE:
+            game.hide()
+        # Otherwise, the event is an outcome of the last command.
+
+    if check:
+        replayed = dump(game)["events"]
+        for i in range(0, end, width):
+            if replayed[i : i + width] != data[i : i + width]:
+                raise ReplayError(
+                    "Event %d was %s, but replayed as %s"
+                    % (i // width, data[i : i + width], replayed[i : i + width])
+                )
+    return game
+
+
+def describe(log, index=None):
+    """Returns a list of lines that describe each event, up to the index."""
+    users = log["users"]
+    deck = log["deck"]
+    width = EventLog.WIDTH
+    data = log["events"]
+    end = len(data) if index is None else min(len(data), index * width)
+    lines = []
+    for i in range(0, end, width):
+        event, user, a, b = data[i : i + width]
+        args = []
+        if event in Events.CARD_EVENTS:
+            args.append(deck[a][0])
+        elif event == Events.JOIN:
+            args.append("#%06x" % a)
+        elif event == Events.KICK and a:
+            args.append("permanently")
+        elif event == Events.SCORE:
+            args.append("+%d" % a)
+        if event == Events.CLUE:
+            args.append(json.dumps(log["clues"][b]))
+        lines.append(
+            "%6d %-6s %-12s %s"
+            % (i // width, Events.name(event), users[user][1], " ".join(args))
+        )
+    return lines
+
+
+def summarize(game):
+    """Returns a JSON-serializable summary of the state of a game."""
+    return {
+        "version": game.version,
+        "state": game.state,
+        "round": game.round.number,
+        "clue": None if game.round.clue is None else str(game.round.clue),
+        "dealt": game.deck.dealt,
+        "players": [
+            {
+                "name": user.name,
+                "score": player.score,
+                "hand": [card.cid for card in player.hand],
+            }
+            for user, player in game.players.items()
+        ],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("file", help="JSON dump of a game")
+    parser.add_argument("--index", type=int, help="number of events to replay")
+    parser.add_argument("--events", action="store_true", help="print each event")
+    parser.add_argument("--repeat", type=int, default=1, help="times to replay")
+    args = parser.parse_args(argv)
+
+    with open(args.file) as log_file:
+        log = json.load(log_file)
+    if args.events:
+        print("\n".join(describe(log, args.index)))
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        game = replay(log, args.index)
+    elapsed = (time.perf_counter() - start) / args.repeat
+    print(json.dumps(summarize(game), indent=2))
+    events = len(game.events)
+    print(
+        "replayed %d events in %.3f ms (%.0f events/s)"
+        % (events, elapsed * 1000, events / elapsed)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Encodings of the API's responses, chosen by content negotiation.
+
+JSON is always available. MessagePack is a compact binary encoding that is
+available if msgpack is installed (pip install dixit[msgpack]), and is chosen
+by clients that send "Accept: application/x-msgpack". Either one is gzipped
+for clients that accept it, once a response is large enough to benefit.
+"""
+
+import abc
+import json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+class Serializer(abc.ABC):
+    """Encodes JSON-serializable objects as the bytes of a response."""
+
+    name = None  # short name, e.g., for ETags and benchmarks
+    content_type = None
+
+    @abc.abstractmethod
+    def dumps(self, obj):
+        """Returns the encoding of the object, as bytes."""
+
+
+class JSONSerializer(Serializer):
+    """Compact JSON, without any whitespace between tokens."""
+
+    name = "json"
+    content_type = "application/json; charset=UTF-8"
+
+    def dumps(self, obj):
+        # As tornado.escape.json_encode, for embedding the JSON in HTML
+        text = json.dumps(obj, separators=(",", ":")).replace("</", "<\\/")
+        return text.encode("utf-8")
+
+
+class MsgpackSerializer(Serializer):
+    """MessagePack, which is binary, and so needs no quoting or escaping."""
+
+    name = "msgpack"
+    content_type = "application/x-msgpack"
+
+    def dumps(self, obj):
+        return msgpack.packb(obj)
+
+
+JSON = JSONSerializer()
+
+SERIALIZERS = [JSON]  # in order of preference
+if msgpack is not None:  # pragma: no cover
+    SERIALIZERS.insert(0, MsgpackSerializer())
+
+
+def negotiate(accept):
+    """Returns the Serializer for an Accept header, falling back to JSON.
+
+    The first of the SERIALIZERS with a content type that the client lists
+    is preferred, regardless of quality values, except that JSON is always
+    acceptable.
+    """
+    if accept:
+        media_types = set(
+            media_range.split(";")[0].strip().lower()
+            for media_range in accept.split(",")
+        )
+        for serializer in SERIALIZERS:
+            if serializer.content_type.split(";")[0] in media_types:
+                return serializer
+    return JSON
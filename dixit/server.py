@@ -11,28 +11,49 @@ Refer to LICENSE.txt for terms of modification and redistribution.
 """
 
 import tornado.ioloop
+import tornado.locks
+import tornado.process
 import tornado.web
+import tornado.websocket
 
+from collections import OrderedDict
+import datetime
+import functools
+import gzip
 import logging
 import json
+import math
 import os
 import sys
+import tempfile
 import time
 
+from dixit.assets import AssetHandler, render_assets
+from dixit.bots import Bots
+from dixit.cards import CardHandler, get_cache_path, load_card_sets
 from dixit.chat import ChatLog
 from dixit.codes import APIError, Codes
 from dixit.core import Limits, States, StringClue, Game
-from dixit.deck import CardSet
+from dixit.journal import Journal
+from dixit.lobby import Lobby
+from dixit.metrics import Metrics
+from dixit.pubsub import PubSub, Topics
+from dixit.ratelimit import RateLimiter
+from dixit.reaper import Reaper
+from dixit.shard import Router, Shard
+from dixit.store import SQLiteStore
 from dixit.users import Users
 from dixit.utils import (
     INFINITY,
+    accepts_gzip,
+    activity_interval,
     hash_obj,
-    get_sorted_positions,
-    url_join,
     capture_stdout,
 )
 import dixit.config as config
 import dixit.display as display
+import dixit.serializers as serializers
+import dixit.views as views
 
 logger = logging.getLogger(__name__)
 
@@ -42,18 +63,161 @@ class RequestHandler(tornado.web.RequestHandler):
 
     USER_COOKIE_NAME = "dixit_user"
 
+    command = None  # name of the game command being handled, for the metrics
+
     def prepare(self):
-        """Sets self.user based off hash in existing cookie, or a new cookie."""
+        """Sets self.user based off hash in existing cookie, or a new cookie.
+
+        The request is first admitted by the rate limiter, or else finished.
+        On a worker of a sharded server, a user who is new to the worker is
+        looked up in, or written to, the shared store off of the IOLoop, and
+        so an awaitable is returned instead.
+        """
         uid = self.get_cookie(self.USER_COOKIE_NAME)
-        if not self.application.users.has_user(uid):
-            if uid is None:
-                uid = hash_obj(id(self), add_random=True)
-                self.set_cookie(self.USER_COOKIE_NAME, uid)
-            puid = hash_obj(uid, add_random=True)
-            self.user = self.application.users.add_user(uid, puid)
-        else:
+        known = self.application.users.has_user(uid)
+        if not self.admit(uid, known):
+            return None
+        if known:
             self.user = self.application.users.get_user(uid)
-            self.user.ping()
+            self.application.users.ping(self.user)
+            return None
+        shard = self.application.shard
+        if uid is None:
+            uid = hash_obj(id(self), add_random=True)
+            self.set_cookie(self.USER_COOKIE_NAME, uid)
+        elif shard is not None:
+            return self.adopt_user(uid)  # e.g., from another worker
+        self.add_user(uid)
+        return None if shard is None else shard.add_user(self.user)
+
+    async def adopt_user(self, uid):
+        """Sets self.user to the user with the given uid in the shared store.
+
+        If there is no such user, a new one is added with the uid instead.
+        """
+        users = self.application.users
+        self.user = await self.application.shard.adopt_user(uid)
+        if self.user is None and users.has_user(uid):  # by a concurrent request
+            self.user = users.get_user(uid)
+        if self.user is None:
+            self.add_user(uid)
+            await self.application.shard.add_user(self.user)
+        else:
+            users.ping(self.user)
+            self.application.reaper.enforce_caps()
+
+    def add_user(self, uid):
+        """Sets self.user to a new user with the given uid."""
+        puid = hash_obj(uid, add_random=True)
+        self.user = self.application.users.add_user(uid, puid)
+        self.application.journal.record("user", uid, puid)
+        self.application.users.ping(self.user)
+        self.application.reaper.enforce_caps()
+
+    def get_budget(self):
+        """Returns the rate limiter's budget that the request takes from."""
+        return "read" if self.request.method in ("GET", "HEAD") else "write"
+
+    def admit(self, uid, known):
+        """Returns true iff the client has the budget for this request.
+
+        Otherwise, the request is answered with 429 Too Many Requests. A request
+        that is not from a known user also takes from its IP's new_user budget.
+        """
+        rate_limiter = self.application.rate_limiter
+        ip = self.request.remote_ip
+        wait = rate_limiter.admit(self.get_budget(), ip, uid if known else None)
+        if not wait and not known:
+            wait = rate_limiter.admit("new_user", ip)
+        if not wait:
+            return True
+        self.set_status(429)
+        self.set_header("Retry-After", str(math.ceil(wait)))
+        self.finish({"code": Codes.RATE_LIMITED})
+        return False
+
+    def get_serializer(self):
+        """Returns the Serializer negotiated by the client's Accept header."""
+        return serializers.negotiate(self.request.headers.get("Accept"))
+
+    def accepts_gzip(self):
+        """Returns true iff the client accepts gzipped responses."""
+        return accepts_gzip(self.request.headers.get("Accept-Encoding", ""))
+
+    def get_encoding(self):
+        """Returns the name of the negotiated encoding, e.g., "json.gz"."""
+        name = self.get_serializer().name
+        return name + ".gz" if self.accepts_gzip() else name
+
+    def check_versions(self, *versions):
+        """Sets a strong ETag derived from the given versions of server state.
+
+        The ETag also identifies the response's encoding (see write_data), as
+        each is a different representation. Returns true iff this matches the
+        client's If-None-Match header, in which case the response has been
+        turned into an empty 304 Not Modified.
+        """
+        versions += (self.get_encoding(),)
+        self.set_header("Etag", '"%s"' % ".".join(str(v) for v in versions))
+        self.set_header("Vary", "Accept, Accept-Encoding")
+        if self.check_etag_header():
+            self.set_status(304)
+            return True
+        return False
+
+    def encode_data(self, obj):
+        """Returns the object in the negotiated encoding, and if it is gzipped."""
+        body = self.get_serializer().dumps(obj)
+        api_encoding = self.application.api_encoding
+        if len(body) >= api_encoding["gzip_min_bytes"] and self.accepts_gzip():
+            return gzip.compress(body, api_encoding["gzip_level"], mtime=0), True
+        return body, False
+
+    def write_encoded(self, encoded):
+        """Writes a body, and whether it is gzipped, as returned by encode_data."""
+        body, gzipped = encoded
+        self.set_header("Content-Type", self.get_serializer().content_type)
+        self.set_header("Vary", "Accept, Accept-Encoding")
+        if gzipped:
+            self.set_header("Content-Encoding", "gzip")
+        self.write(body)
+
+    def write_data(self, obj):
+        """Writes the object in the negotiated encoding, gzipped if worthwhile."""
+        self.write_encoded(self.encode_data(obj))
+
+    def on_finish(self):
+        """Records the latency of the request in the metrics."""
+        self.application.metrics.observe_request(self, self.request.request_time())
+
+    def log_exception(self, typ, value, tb):
+        """Logs an APIError as a warning, since it is the client's mistake."""
+        if isinstance(value, APIError):
+            logger.warning(
+                "%s %s: APIError %s", self.request.method, self.request.uri, value
+            )
+        else:
+            super(RequestHandler, self).log_exception(typ, value, tb)
+
+    def write_error(self, status_code, **kwargs):
+        """Responds to an APIError with a 400 and its code, e.g., {"code": 24}."""
+        exc = kwargs["exc_info"][1] if "exc_info" in kwargs else None
+        if isinstance(exc, APIError):
+            self.application.metrics.count_error(exc.code)
+            self.set_status(400)
+            self.finish({"code": exc.code})
+        else:
+            super(RequestHandler, self).write_error(status_code, **kwargs)
+
+    def get_int_argument(self, name, default=None):
+        """Returns the argument with the given name as an int, or the default."""
+        val = self.get_argument(name, None)
+        if val is None:
+            return default
+        try:
+            return int(val)
+        except ValueError as exc:
+            raise APIError(Codes.NOT_AN_INTEGER, exc)
 
 
 class MainHandler(RequestHandler):
@@ -66,29 +230,16 @@ class MainHandler(RequestHandler):
             display=display,
             user=self.user,
             limits=self.application.limits,
+            assets=self.application.assets,
         )
 
 
-class MainJSHandler(tornado.web.RequestHandler):
-    """Handler for rendering main.js with the server's template variables."""
-
-    def get(self):
-        self.set_header("Content-Type", "text/javascript")
-        self.render(
-            "main.js",
-            display=display,
-            states=States,
-            commands=Commands,
-            limits=self.application.limits,
-        )
-
-
-class MainCSSHandler(tornado.web.RequestHandler):
-    """Handler for rendering main.css with the server's template variables."""
+class MetricsHandler(tornado.web.RequestHandler):
+    """Handler for scraping the metrics, without becoming a user."""
 
     def get(self):
-        self.set_header("Content-Type", "text/css")
-        self.render("main.css", display=display, cards_per_person=Game.CARDS_PER_PERSON)
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(self.application.metrics.render())
 
 
 class AdminHandler(RequestHandler):
@@ -116,7 +267,10 @@ class AdminHandler(RequestHandler):
                 stdout = ""
                 stderr = unicode(exc).encode("utf-8")
         self.write(
-            {"stdout": stdout, "stderr": stderr,}
+            {
+                "stdout": stdout,
+                "stderr": stderr,
+            }
         )
 
 
@@ -125,7 +279,11 @@ class SetUsernameHandler(RequestHandler):
 
     def post(self):
         username = self.get_argument("username", default=None)
-        new_name = self.user.set_name(username) if username else self.user.name
+        new_name = self.user.name
+        if username:
+            new_name = self.application.users.set_name(self.user, username)
+            self.application.journal.record("name", self.user.uid, new_name)
+            self.application.user_renamed(self.user)
         self.write(new_name)
 
 
@@ -137,18 +295,9 @@ class CreateHandler(RequestHandler):
             card_set_indices = list(map(int, self.request.arguments["card_sets"]))
         except ValueError as exc:
             raise APIError(Codes.NOT_AN_INTEGER, exc)
-        if min(card_set_indices) < 0 or max(card_set_indices) >= len(
-            self.application.card_sets
-        ):
-            raise APIError(Codes.ILLEGAL_RANGE, card_set_indices)
-        card_sets = [self.application.card_sets[i] for i in card_set_indices]
-
         password = self.get_argument("password", "")  # not yet implemented
         if password:
             password = hash_obj(password)
-        name = self.get_argument("name", "")
-        if not name:
-            name = "Game %d" % (len(self.application.games) + 1)
 
         max_score = self.get_argument("max_score")
         if not max_score:
@@ -160,27 +309,109 @@ class CreateHandler(RequestHandler):
         except ValueError as exc:
             raise APIError(Codes.NOT_AN_INTEGER, exc)
 
-        limits = self.application.limits
-        if (
-            (not limits.min_name <= len(name) <= limits.max_name)
-            or (not limits.min_players <= max_players <= limits.max_players)
-            or (not limits.min_score <= max_score <= limits.max_score)
-            or (not limits.min_clue_length <= max_clue_length <= limits.max_clue_length)
-        ):
+        gid, _ = self.application.create_game(
+            self.user,
+            card_set_indices,
+            password,
+            self.get_argument("name", ""),
+            max_players,
+            max_score,
+            max_clue_length,
+        )
+        self.application.reaper.enforce_caps()
+        self.write(str(gid))
+
+
+class BatchCreateHandler(RequestHandler):
+    """Handler for creating many games at once, and seating players in them.
+
+    Only for the admin. The body is JSON, {"password": ..., "games": [...]},
+    where each game has the arguments of /create, as well as optional "seats",
+    {puid: colour}, and "host", a puid (by default, the admin). Responds with
+    {"games": [...]}, with {"gid": gid, "errors": {puid: code}} for each game
+    that was created, listing the seats that could not be taken, or else with
+    {"code": code}.
+    """
+
+    def post(self):
+        if not self.application.admin_enable:
+            raise tornado.web.HTTPError(404)
+        try:
+            request = json.loads(self.request.body)
+            admin_password = hash_obj(request["password"])
+            specs = request["games"]
+        except (ValueError, TypeError, KeyError) as exc:
+            raise tornado.web.HTTPError(400, str(exc))
+        if admin_password != self.application.admin_password:
+            raise tornado.web.HTTPError(403)
+        if not isinstance(specs, list):
             raise APIError(Codes.ILLEGAL_RANGE)
+        if len(specs) > self.application.limits.max_batch:
+            raise APIError(Codes.ILLEGAL_RANGE, len(specs))
 
-        game = Game(
-            self.user,
-            card_sets,
+        results = []
+        for spec in specs:
+            try:
+                gid, errors = self._create(spec)
+            except APIError as exc:
+                self.application.metrics.count_error(exc.code)
+                results.append({"code": exc.code})
+            else:
+                for code in errors.values():
+                    self.application.metrics.count_error(code)
+                results.append({"gid": gid, "errors": errors})
+        self.application.reaper.enforce_caps()
+        self.write_data({"games": results})
+
+    def _get_user(self, puid):
+        try:
+            return self.application.users.get_user_by_puid(puid)
+        except (KeyError, TypeError):
+            raise APIError(Codes.UNKNOWN_USER, puid)
+
+    def _create(self, spec):
+        """Creates and seats one game, returning its gid and the seats' errors."""
+        if not isinstance(spec, dict):
+            raise APIError(Codes.ILLEGAL_RANGE)
+        host = self.user
+        if spec.get("host") is not None:
+            host = self._get_user(spec["host"])
+        seats = spec.get("seats") or {}
+        if not isinstance(seats, dict):
+            raise APIError(Codes.ILLEGAL_RANGE)
+        users = {}
+        errors = {}
+        for puid in seats:
+            try:
+                users[puid] = self._get_user(puid)
+            except APIError as exc:
+                errors[puid] = exc.code
+
+        password = spec.get("password") or ""
+        if password:
+            password = hash_obj(password)
+        max_score = spec.get("max_score")
+        try:
+            card_set_indices = list(map(int, spec.get("card_sets") or []))
+            max_score = INFINITY if max_score in (None, "") else int(max_score)
+            max_players = int(spec["max_players"])
+            max_clue_length = int(spec["max_clue_length"])
+        except (KeyError, TypeError, ValueError) as exc:
+            raise APIError(Codes.NOT_AN_INTEGER, exc)
+
+        gid, seat_errors = self.application.create_game(
+            host,
+            card_set_indices,
             password,
-            name,
+            str(spec.get("name") or ""),
             max_players,
             max_score,
             max_clue_length,
-            limits,
+            [(user, seats[puid]) for puid, user in users.items()],
         )
-        self.application.games.append(game)
-        self.write(str(len(self.application.games) - 1))
+        for user, code in seat_errors.items():
+            errors[user.puid] = code
+        return gid, errors
 
 
 class HideHandler(RequestHandler):
@@ -192,15 +423,15 @@ class HideHandler(RequestHandler):
         except ValueError as exc:
             raise APIError(Codes.NOT_AN_INTEGER, exc)
 
-        try:
-            game = self.application.games[gid]
-        except IndexError:
+        game = self.application.get_game(gid)
+        if game is None:
             raise APIError(Codes.ILLEGAL_RANGE)
 
         if self.user != game.host:
             raise APIError(Codes.ILLEGAL_RANGE)
 
-        self.application.games[gid].hide()
+        game.hide()
+        self.application.journal.record("hide", gid)
         self.write(json.dumps("ok"))
 
 
@@ -208,57 +439,66 @@ class GetGamesHandler(RequestHandler):
     """Handler for getting the list of all games."""
 
     def get(self):
-        cur_time = time.time()
-        blob = [
-            {
-                "gid": gid,
-                "name": game.name,
-                "relLastActive": cur_time - game.last_active,
-                "host": game.host.name,
-                "players": [user.name for user in game.players],
-                "maxPlayers": game.max_players,
-                "state": game.state,
-                "left": game.deck.left(),
-                "size": game.deck.size(),
-                "topScore": max(p.score for p in list(game.players.values()))
-                if game.players
-                else 0,
-                "maxScore": game.max_score if game.max_score != INFINITY else None,
-                "deckName": game.deck.name,
-                "isHost": self.user == game.host,
-                "isPlayer": self.user in game.players,
-            }
-            for gid, game in enumerate(self.application.games)
-            if not game.hidden
-        ]
-        self.write(json.dumps(sorted(blob, key=lambda x: x["relLastActive"])))
+        """Lists all games, or with ?since=<version> only the changes since."""
+        since = self.get_argument("since", None)
+        if self.check_versions(
+            self.application.lobby.version,
+            activity_interval(time.time()),
+            self.user.puid[:8],  # isHost and isPlayer are specific to the user
+        ):
+            return
+        if since is None:
+            self.write_data(views.game_list(self.application, self.user))
+        else:
+            try:
+                since = int(since)
+            except ValueError as exc:
+                raise APIError(Codes.NOT_AN_INTEGER, exc)
+            self.write_data(views.game_changes(self.application, self.user, since))
 
 
 class GetUsersHandler(RequestHandler):
     """Handler for getting the list of all users."""
 
     def get(self):
-        blob = []
-        cur_time = time.time()
-        for user in self.application.users:
-            blob.append(
-                {"name": user.name, "relLastActive": cur_time - user.last_active,}
-            )
-        self.write(json.dumps(sorted(blob, key=lambda x: x["relLastActive"])))
+        if self.check_versions(
+            self.application.users.version, activity_interval(time.time())
+        ):
+            return
+        self.write_data(views.user_list(self.application))
 
 
 class ChatHandler(RequestHandler):
-    """Handler for posting to and reading from the chat log."""
+    """Handler for posting to and reading from a chat room.
+
+    The room is the gid of a game, or omitted for the lobby.
+    """
+
+    def get_budget(self):
+        return "chat" if self.request.method == "POST" else "read"
+
+    def get_chat_log(self):
+        room = self.get_int_argument("room")
+        chat_log = self.application.get_chat_log(room)
+        if chat_log is None:
+            raise APIError(Codes.ILLEGAL_RANGE, room)
+        return room, chat_log
 
     def get(self):
-        last_time = float(self.get_argument("t"))
-        self.write(
-            {"log": self.application.chat_log.dump_since(last_time), "t": time.time(),}
-        )
+        since = self.get_int_argument("since", 0)
+        _, chat_log = self.get_chat_log()
+        if self.check_versions(chat_log.seq):
+            return
+        self.write_data(views.chat_since(chat_log, since))
 
     def post(self):
         msg = self.get_argument("msg")[: self.application.limits.max_message]
-        self.application.chat_log.add(self.user.name, msg)
+        room, chat_log = self.get_chat_log()
+        message = chat_log.add(self.user.name, msg)
+        self.application.journal.record(
+            "chat", room, message["user"], msg, message["t"]
+        )
+        self.application.pubsub.publish(Topics.chat(room))
 
 
 class Commands:
@@ -271,126 +511,233 @@ class Commands:
     PLAY_CARD = 4
     CAST_VOTE = 5
     KICK_PLAYER = 6
+    ADD_BOT = 7
+
+    @classmethod
+    def name(cls, cmd):
+        """Returns the name of the given command, or None if there is none."""
+        for name, value in vars(cls).items():
+            if value == cmd and name.isupper():
+                return name
+        return None
 
 
 class GameHandler(RequestHandler):
     """Handler for getting the game board and routing actions."""
 
-    def get(self, gid, cmd):
+    def get_budget(self):
+        return "read" if self.path_args[1] == str(Commands.GET_BOARD) else "write"
+
+    async def get(self, gid, cmd):
         """Delegates the request to the corresponding core game operation."""
         gid = int(gid)
-        if not 0 <= gid < len(self.application.games):
+        game = self.application.get_game(gid)
+        if game is None:
             raise APIError(Codes.ILLEGAL_RANGE, gid)
-        game = self.application.games[gid]
 
+        journal = self.application.journal
         cmd = int(cmd)
+        self.command = Commands.name(cmd)
         if cmd == Commands.GET_BOARD:
-            self.write(self._get_board(self.user, game))
+            since = self.get_int_argument("since")
+            if since is not None:
+                self.command = "GET_BOARD?since"  # timed apart, as it waits
+                await self.application.wait_for_change(game, since)
+            if self.check_versions(*views.board_version(game), self.user.puid[:8]):
+                return
+            base = self.get_argument("base", None)  # the client's board revision
+            if views.is_spectator(self.user, game):
+                _, encoded = self.application.spectator_boards.get(
+                    self.application, game, base, self.get_encoding(), self.encode_data
+                )
+                self.write_encoded(encoded)
+            elif base is None:
+                self.write_data(views.board(self.application, self.user, game))
+            else:
+                self.write_data(
+                    views.board_patch(self.application, self.user, game, base)
+                )
         elif cmd == Commands.JOIN_GAME:
             colour = self.get_argument("colour")
             game.add_player(self.user, colour)
+            journal.record("join", gid, self.user.uid, colour)
         elif cmd == Commands.START_GAME:
             game.start_game()
+            journal.record("start", gid)
         elif cmd == Commands.CREATE_CLUE:
             clue = StringClue(self.get_argument("clue"))
             card = game.get_card(self.get_argument("cid"))
             game.create_clue(self.user, clue, card)
+            journal.record("clue", gid, self.user.uid, str(clue), card.cid)
         elif cmd == Commands.PLAY_CARD:
             card = game.get_card(self.get_argument("cid"))
             game.play_card(self.user, card)
+            journal.record("play", gid, self.user.uid, card.cid)
         elif cmd == Commands.CAST_VOTE:
             card = game.get_card(self.get_argument("cid"))
             game.cast_vote(self.user, card)
+            journal.record("vote", gid, self.user.uid, card.cid)
         elif cmd == Commands.KICK_PLAYER:
             puid = self.get_argument("puid")
             game.kick_player(self.application.users.get_user_by_puid(puid))
+            journal.record("kick", gid, puid)
+        elif cmd == Commands.ADD_BOT:
+            if self.user != game.host:
+                raise APIError(Codes.ILLEGAL_RANGE)
+            self.application.bots.add_bot(gid, game)
         else:
             raise APIError(Codes.ILLEGAL_RANGE, cmd)
 
-    def _get_board(self, user, game):
-        """Returns a JSON dictionary summarizing the entire game board."""
-        players = dict((u.puid, u.name) for u in game.players)
-        scores = dict((u.puid, p.score) for u, p in list(game.players.items()))
-        is_player = user in game.players
-
-        requires_action = {}
-        for u in game.players:
-            requires_action[u.puid] = {
-                States.BEGIN: game.host == u
-                and len(players) >= self.application.limits.min_players,
-                States.CLUE: game.clue_maker() == u,
-                States.PLAY: not game.round.has_played(u),
-                States.VOTE: not game.round.has_voted(u),
-                States.END: False,  # game.host == u,
-            }[game.state]
-
-        puids = list(players.keys())
-        ranked = get_sorted_positions(puids, key=lambda puid: scores[puid])
-
-        rnd = {}
-        if game.round.has_everyone_played():
-            rnd["cards"] = [card.to_json() for card in game.round.get_cards()]
-            rnd["cardsHash"] = hash_obj(rnd["cards"])
-        if game.round.has_everyone_voted():
-            rnd["votes"] = dict(
-                (u.puid, card.cid) for u, card in list(game.round.user_to_vote.items())
-            )
-            rnd["owners"] = dict(
-                (u.puid, card.cid) for u, card in list(game.round.user_to_card.items())
-            )
-            rnd["votesHash"] = hash_obj(rnd["votes"])
-        if game.round.clue:
-            rnd["clue"] = str(game.round.clue)
-        if game.round.clue_maker:
-            rnd["clueMaker"] = game.round.clue_maker.puid
-        rnd["scores"] = dict(
-            (u.puid, score) for u, score in list(game.round.scores.items()) if score > 0
-        )
-
-        plr = {}
-        if is_player and game.players[user].hand:
-            plr["hand"] = [card.to_json() for card in game.players[user].hand]
-            plr["handHash"] = hash_obj(plr["hand"])
-
-        blob = {
-            "name": game.name,
-            "user": user.puid,
-            "host": game.host.puid,
-            "players": players,
-            "colours": dict((u.puid, col) for u, col in list(game.colours.items())),
-            "isHost": user == game.host,
-            "isPlayer": user in game.players,
-            "maxPlayers": game.max_players,
-            "maxScore": game.max_score if game.max_score != INFINITY else None,
-            "maxClueLength": game.max_clue_length,
-            "scores": scores,
-            "order": [u.puid for u in game.order],
-            "turn": game.turn,
-            "ranked": dict((uid, rank) for uid, rank in zip(puids, ranked)),
-            "left": game.deck.left(),
-            "size": game.deck.size(),
-            "state": game.state,
-            "requiresAction": requires_action,
-            "round": rnd,
-            "player": plr,
-        }
-
-        return blob
 
+class PushHandler(tornado.websocket.WebSocketHandler):
+    """WebSocket endpoint that pushes updates for each subscribed topic.
 
-def has_suffix(name, suffixes):
-    """Returns true iff name ends with at least one of the given suffixes."""
-    return True in (name.endswith(suffix) for suffix in suffixes)
+    The client sends {"subscribe": topic} or {"unsubscribe": topic} messages.
+    Subscriptions to the games or chat topics also take a "since" value, as in
+    the corresponding polling requests, such that only changes are pushed.
+    The server replies to a subscription with the current state of the topic,
+    and from then on with {"topic": topic, "data": ...} whenever it changes.
+    Game boards are pushed as patches of the previously pushed board, as in
+    views.board_patch, after the first. Spectators of a game share the same
+    encoded messages, see views.SpectatorBoards.
 
+    A client that has push_max_queue messages that are not yet sent, as it
+    reads them too slowly, is disconnected, and so falls back to polling.
+    """
 
-def find_cards(folder, suffixes=(".jpg", ".png")):
-    """Returns all urls for a given folder, matching the given suffixes."""
-    path = os.path.join(os.path.dirname(__file__), display.WebPaths.CARDS, folder)
-    return [
-        url_join(display.WebPaths.CARDS, folder, name)
-        for name in os.listdir(path)
-        if has_suffix(name, suffixes)
-    ]
+    def open(self):
+        """Authenticates the user once, from the cookie set by RequestHandler."""
+        uid = self.get_cookie(RequestHandler.USER_COOKIE_NAME)
+        if not self.application.users.has_user(uid):
+            self.close()
+            return
+        self.user = self.application.users.get_user(uid)
+        self.subscriptions = {}  # topic -> "since" value of the next push
+        self.board_revs = {}  # topic -> revision of the board last pushed
+        self.pending = set()  # topics that changed since they were last pushed
+        self.unsent = 0  # messages written, but not yet sent
+
+    def on_message(self, message):
+        try:
+            request = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(request, dict) or not all(
+            isinstance(request[key], str)
+            for key in ("subscribe", "unsubscribe")
+            if key in request
+        ):
+            return
+        if "unsubscribe" in request:
+            topic = request["unsubscribe"]
+            self.subscriptions.pop(topic, None)
+            self.application.pubsub.unsubscribe(topic, self)
+        if "subscribe" in request:
+            topic = request["subscribe"]
+            gid = Topics.get_gid(topic)
+            if gid is None:
+                gid = Topics.get_chat_gid(topic)
+            if topic in (Topics.GAMES, Topics.USERS, Topics.CHAT) or (
+                self.application.get_game(gid) is not None
+            ):
+                try:
+                    self.subscriptions[topic] = int(request.get("since", 0))
+                except (TypeError, ValueError):
+                    return
+                self.board_revs.pop(topic, None)  # the full board, to begin with
+                self.application.pubsub.subscribe(topic, self)
+                self.notify(topic)
+
+    def on_close(self):
+        for topic in getattr(self, "subscriptions", ()):
+            self.application.pubsub.unsubscribe(topic, self)
+
+    def notify(self, topic):
+        """Schedules the topic to be pushed once the current callback is done.
+
+        This coalesces any number of changes within the same callback.
+        """
+        if not self.pending:
+            tornado.ioloop.IOLoop.current().add_callback(self._push_pending)
+        self.pending.add(topic)
+
+    def _push_pending(self):
+        pending, self.pending = self.pending, set()
+        for topic in pending:
+            if topic in self.subscriptions and self.ws_connection is not None:
+                message = self._get_message(topic)
+                if message is not None:
+                    self.send(message)
+
+    def send(self, message):
+        """Writes a message, or disconnects the client if it is too far behind."""
+        if self.unsent >= self.application.push_max_queue:
+            self.application.metrics.count_push_dropped()
+            self.close(1013, "Too far behind")  # Try Again Later
+            return
+        self.unsent += 1
+        self.write_message(message).add_done_callback(self._on_sent)
+
+    def _on_sent(self, future):
+        self.unsent -= 1
+        if not future.cancelled():
+            future.exception()  # as the client may have disconnected since
+
+    @staticmethod
+    def _encode(topic, data):
+        """Returns the message that pushes the data of the topic, as UTF-8 JSON."""
+        return serializers.JSON.dumps({"topic": topic, "data": data})
+
+    def _get_message(self, topic):
+        """Returns the encoded current state of the topic, or None if nothing new."""
+        if Topics.get_gid(topic) is not None:
+            return self._get_board_message(topic)
+        data = self._get_data(topic)
+        return None if data is None else self._encode(topic, data)
+
+    def _get_board_message(self, topic):
+        game = self.application.get_game(Topics.get_gid(topic))
+        if game is None:
+            return None  # since removed
+        base = self.board_revs.get(topic)
+        if views.is_spectator(self.user, game):
+            data, message = self.application.spectator_boards.get(
+                self.application,
+                game,
+                base,
+                "push",
+                functools.partial(self._encode, topic),
+            )
+        else:
+            if base is None:
+                data = views.board(self.application, self.user, game)
+            else:
+                data = views.board_patch(self.application, self.user, game, base)
+            message = None
+        if data.keys() == {"patchOf"}:
+            return None  # unchanged
+        self.board_revs[topic] = data["rev"]
+        return message or self._encode(topic, data)
+
+    def _get_data(self, topic):
+        """Returns the current state of the topic, or None if nothing new."""
+        if topic == Topics.GAMES:
+            changes = views.game_changes(
+                self.application, self.user, self.subscriptions[topic]
+            )
+            self.subscriptions[topic] = changes["version"]
+            return changes
+        elif topic == Topics.USERS:
+            return views.user_list(self.application)
+        elif topic == Topics.CHAT or Topics.get_chat_gid(topic) is not None:
+            chat_log = self.application.get_chat_log(Topics.get_chat_gid(topic))
+            if chat_log is None:
+                return None  # since removed
+            chat = views.chat_since(chat_log, self.subscriptions[topic])
+            if not chat["log"]:
+                return None
+            self.subscriptions[topic] = chat["seq"]
+            return chat
 
 
 class Application(tornado.web.Application):
@@ -401,56 +748,378 @@ class Application(tornado.web.Application):
         self.limits = Limits(kwargs["limits"])
 
         self.users = Users(self.limits)
-        self.games = []
-        self.chat_log = ChatLog()
-
-        # Specifies where to find all the card images for each set.
-        self.card_sets = [
-            CardSet(name, find_cards(folder), enabled)
-            for name, (folder, enabled) in kwargs["card_sets"].items()
-        ]
+        self.games = OrderedDict()  # gid -> Game, least recently active first
+        self.next_gid = 0
+        self.gid_step = 1  # gids of this process are next_gid modulo gid_step
+        self.chat_log = ChatLog()  # the lobby's room
+        self.game_chat_logs = {}  # gid -> ChatLog, created on first use
+        self.reaper = Reaper(self, kwargs["reaper"])
+        self.bots = Bots(self, kwargs["bots"])
+        self.rate_limiter = RateLimiter(kwargs["rate_limits"])
+        self.api_encoding = kwargs["api_encoding"]
+        self.journal = Journal(self, kwargs["journal"])
+
+        # A worker process only owns the games whose gid is congruent to its
+        # index, and shares its users and lobby with the others via the store.
+        self.shard = None
+        if kwargs.get("worker") is not None:
+            self.shard = Shard(
+                self, kwargs["shards"], kwargs["worker"], kwargs["store"]
+            )
+            self.next_gid = self.shard.worker
+            self.gid_step = self.shard.workers
+
+        # Long-polling board requests park on a condition until the game changes.
+        self.long_poll_timeout = datetime.timedelta(seconds=kwargs["long_poll_timeout"])
+        self.game_conditions = {}  # Game -> tornado.locks.Condition
+        self.board_cache = views.BoardCache()
+
+        # Pushes changes to WebSocket subscribers, with polling as the fallback.
+        self.push_enable = kwargs["push_enable"]
+        self.push_max_queue = kwargs["push_max_queue"]
+        self.spectator_boards = views.SpectatorBoards()
+        self.pubsub = PubSub()
+        self.lobby = Lobby()
+        self.users.listeners.append(lambda users: self.pubsub.publish(Topics.USERS))
+
+        # Specifies where to find all the card images for each set, which are
+        # loaded on first use.
+        self.card_sets_config = kwargs["card_sets"]
+        self.card_cache = get_cache_path(kwargs["card_cache"])
+        self._card_sets = None
+        self._card_files = {}  # content-addressed name -> path, see CardHandler
         self.admin_password = kwargs["admin_password"]
         self.admin_enable = kwargs["admin_enable"]
+        self.metrics = Metrics(self)
+
+        # The scripts and styles are rendered once, on first use.
+        self._assets = None
+        self._assets_by_url = {}
 
         super(Application, self).__init__(*args, **kwargs)
 
+    @property
+    def assets(self):
+        """Returns the rendered scripts and styles, by name, rendering them once.
+
+        Nothing that they use ever changes.
+        """
+        if self._assets is None:
+            self._assets = render_assets(
+                self.settings["template_path"],
+                {
+                    "main.js": dict(
+                        display=display,
+                        states=States,
+                        commands=Commands,
+                        topics=Topics,
+                        limits=self.limits,
+                        push_enable=self.push_enable,
+                        bots_enable=self.bots.enable,
+                    ),
+                    "main.css": dict(
+                        display=display, cards_per_person=Game.CARDS_PER_PERSON
+                    ),
+                },
+            )
+            for asset in self._assets.values():
+                self._assets_by_url[asset.name] = asset
+                self._assets_by_url[asset.url] = asset
+        return self._assets
+
+    @property
+    def assets_by_url(self):
+        """Returns a dict of the assets by their names and fingerprinted urls."""
+        self.assets  # renders them
+        return self._assets_by_url
+
+    @property
+    def card_sets(self):
+        """Returns the CardSet of each configured folder, loading them once."""
+        if self._card_sets is None:
+            self._card_sets = load_card_sets(
+                self.card_sets_config, self.card_cache, self._card_files
+            )
+        return self._card_sets
+
+    @property
+    def card_files(self):
+        """Returns a dict of the content-addressed card images -> their paths."""
+        self.card_sets  # loads them
+        return self._card_files
+
+    def add_game(self, game, gid=None):
+        """Registers a newly created game and returns its gid (if not given)."""
+        if gid is None:
+            gid = self.next_gid
+        self.next_gid = max(self.next_gid, gid + self.gid_step)
+        game.listeners.append(functools.partial(self.on_game_changed, gid))
+        self.games[gid] = game
+        self.update_lobby(gid, game)
+        return gid
+
+    def create_game(
+        self,
+        host,
+        card_set_indices,
+        password,
+        name,
+        max_players,
+        max_score,
+        max_clue_length,
+        seats=(),
+    ):
+        """Creates a game and seats the given (User, colour) pairs in it.
+
+        Returns its gid, and a dict of the users that could not be seated to the
+        code of their APIError. Raises APIError if a parameter is out of range.
+        The game is seated before it is registered, such that its watchers are
+        notified of the whole table at once.
+        """
+        card_sets = self.card_sets
+        if not card_set_indices or not all(
+            0 <= i < len(card_sets) for i in card_set_indices
+        ):
+            raise APIError(Codes.ILLEGAL_RANGE, card_set_indices)
+        if not name:
+            name = "Game %d" % (self.next_gid + 1)
+        limits = self.limits
+        if (
+            (not limits.min_name <= len(name) <= limits.max_name)
+            or (not limits.min_players <= max_players <= limits.max_players)
+            or (not limits.min_score <= max_score <= limits.max_score)
+            or (not limits.min_clue_length <= max_clue_length <= limits.max_clue_length)
+        ):
+            raise APIError(Codes.ILLEGAL_RANGE)
+
+        game = Game(
+            host,
+            [card_sets[i] for i in card_set_indices],
+            password,
+            name,
+            max_players,
+            max_score,
+            max_clue_length,
+            limits,
+        )
+        seated = []
+        errors = {}
+        for user, colour in seats:
+            try:
+                game.add_player(user, colour)
+            except APIError as exc:
+                errors[user] = exc.code
+            else:
+                seated.append((user, colour))
+
+        gid = self.add_game(game)
+        self.journal.record(
+            "create",
+            gid,
+            host.uid,
+            card_set_indices,
+            password,
+            name,
+            max_players,
+            max_score,
+            max_clue_length,
+            game.seed,
+        )
+        for user, colour in seated:
+            self.journal.record("join", gid, user.uid, colour)
+        return gid, errors
+
+    def get_game(self, gid):
+        """Returns the game with the given gid, or None if there is none."""
+        return self.games.get(gid)
+
+    def get_chat_log(self, room):
+        """Returns the chat log of the game with the given gid, or of the lobby.
+
+        Returns None if there is no such game.
+        """
+        if room is None:
+            return self.chat_log
+        chat_log = self.game_chat_logs.get(room)
+        if chat_log is None and room in self.games:
+            chat_log = self.game_chat_logs[room] = ChatLog(ChatLog.GAME_MAX_HISTORY)
+        return chat_log
+
+    def remove_game(self, gid):
+        """Forgets the game with the given gid, e.g., once it is abandoned."""
+        game = self.games.pop(gid)
+        self.game_chat_logs.pop(gid, None)
+        self.journal.record("forget_game", gid)
+        self._wake_waiters(game)
+        self.lobby.remove(gid)
+        self.pubsub.publish(Topics.GAMES)
+
+    def remove_user(self, user):
+        """Forgets the given user, e.g., once they are idle for too long."""
+        self.users.remove_user(user)
+        self.journal.record("forget_user", user.uid)
+
+    def dump_state(self):
+        """Returns all of the state that is restored by load_state(...)."""
+        return {
+            "users": self.users.users,
+            "games": self.games,
+            "next_gid": self.next_gid,
+            "chat_log": self.chat_log,
+            "game_chat_logs": self.game_chat_logs,
+        }
+
+    def load_state(self, state):
+        """Replaces all users, games, and chat logs, e.g., from a snapshot."""
+        self.users.load(state["users"])
+        for gid, game in state["games"].items():
+            game.limits = self.limits
+            self.add_game(game, gid)
+        self.next_gid = state["next_gid"]
+        self.chat_log = state["chat_log"]
+        self.game_chat_logs = state["game_chat_logs"]
+
+    def on_game_changed(self, gid, game):
+        """Notifies everyone waiting on, or subscribed to, the changed game."""
+        self.games.move_to_end(gid)
+        self._wake_waiters(game)
+        self.pubsub.publish(Topics.game(gid))
+        self.update_lobby(gid, game)
+        self.bots.on_game_changed(gid, game)
+
+    def _wake_waiters(self, game):
+        condition = self.game_conditions.pop(game, None)
+        if condition is not None:
+            condition.notify_all()
+
+    def user_renamed(self, user):
+        """Updates the lobby for every game that lists the given user."""
+        for gid, game, _ in self.lobby.listing():
+            if gid in self.games and (user == game.host or user in game.players):
+                self.update_lobby(gid, game)
+
+    def update_lobby(self, gid, game):
+        """Updates the lobby entry of the given game and publishes the change."""
+        self.lobby.update(gid, game)
+        self.pubsub.publish(Topics.GAMES)
+
+    async def wait_for_change(self, game, since):
+        """Waits until the game's version differs from since, or a timeout."""
+        if game.version != since:
+            return
+        if game not in self.game_conditions:
+            self.game_conditions[game] = tornado.locks.Condition()
+        await self.game_conditions[game].wait(timeout=self.long_poll_timeout)
 
-settings = {
-    "static_path": os.path.join(os.path.dirname(__file__), "static"),
-    "template_path": os.path.join(os.path.dirname(__file__), "templates"),
-    "debug": False,
-}
 
 default_config_filename = os.path.join(os.path.dirname(__file__), "config.json")
-if len(sys.argv) == 2:
-    override_config_filename = sys.argv[1]
-    logger.info("Overriding configuration using the file: %s", override_config_filename)
-else:
-    override_config_filename = None
-settings.update(config.parse(default_config_filename, override_config_filename))
-
-application = Application(
-    [
-        (r"/", MainHandler),
-        (r"/admin", AdminHandler),
-        (r"/main.js", MainJSHandler),
-        (r"/main.css", MainCSSHandler),
-        (r"/setusername", SetUsernameHandler),
-        (r"/create", CreateHandler),
-        (r"/hide", HideHandler),
-        (r"/getgames", GetGamesHandler),
-        (r"/getusers", GetUsersHandler),
-        (r"/game/([0-9]+)/(.+)", GameHandler),
-        (r"/chat", ChatHandler),
-    ],
-    **settings
-)
 
 
-def start():
+def load_settings(override_config_filename=None):
+    """Returns the application's settings, from config.json and the override."""
+    settings = {
+        "static_path": os.path.join(os.path.dirname(__file__), "static"),
+        "template_path": os.path.join(os.path.dirname(__file__), "templates"),
+        "debug": False,
+    }
+    settings.update(config.parse(default_config_filename, override_config_filename))
+    return settings
+
+
+routes = [
+    (r"/", MainHandler),
+    (r"/admin", AdminHandler),
+    (r"/(main\.(?:[0-9a-f]+\.)?(?:js|css))", AssetHandler),
+    (r"/cards/(.+)", CardHandler),
+    (r"/setusername", SetUsernameHandler),
+    (r"/create", CreateHandler),
+    (r"/batch/create", BatchCreateHandler),
+    (r"/hide", HideHandler),
+    (r"/getgames", GetGamesHandler),
+    (r"/getusers", GetUsersHandler),
+    (r"/game/([0-9]+)/(.+)", GameHandler),
+    (r"/chat", ChatHandler),
+    (r"/push", PushHandler),
+]
+
+
+def make_application(settings=None, **overrides):
+    """Returns a new Application, with the given settings and overrides of them.
+
+    The settings are loaded from config.json by default.
+    """
+    if settings is None:
+        settings = load_settings()
+    settings = dict(settings, **overrides)
+    app_routes = list(routes)
+    if settings["metrics_path"]:
+        app_routes.append((settings["metrics_path"], MetricsHandler))
+    return Application(app_routes, **settings)
+
+
+def start(argv=None):
+    """Runs the server, with the config file given on the command line (if any)."""
+    argv = sys.argv[1:] if argv is None else argv
+    override_config_filename = None
+    if len(argv) == 1:
+        override_config_filename = argv[0]
+        logger.info(
+            "Overriding configuration using the file: %s", override_config_filename
+        )
+    settings = load_settings(override_config_filename)
+    if settings["shards"]["workers"] > 1:
+        start_sharded(settings)
+        return
+    application = make_application(settings)
+    application.journal.restore()
     application.listen(settings["port"])
+    application.reaper.start()
+    application.bots.start()
+    application.journal.start()
     tornado.ioloop.IOLoop.instance().start()
 
 
+def start_sharded(settings):
+    """Forks a router on the port, and the workers on the ports that follow.
+
+    The workers poll rather than push, since the router only forwards HTTP.
+    """
+    shards = settings["shards"]
+    workers = shards["workers"]
+    ports = [settings["port"] + 1 + i for i in range(workers)]
+    store_path = shards["store"] or os.path.join(tempfile.mkdtemp(), "store.db")
+    SQLiteStore(store_path)  # creates the schema once, before forking
+
+    task_id = tornado.process.fork_processes(workers + 1)
+    if task_id == 0:
+        router = Router(
+            ports, RequestHandler.USER_COOKIE_NAME, settings["long_poll_timeout"] + 30
+        )
+        router.listen(settings["port"])
+    else:
+        worker = task_id - 1
+        journal_config = dict(settings["journal"])
+        if journal_config["directory"]:
+            journal_config["directory"] = os.path.join(
+                journal_config["directory"], "worker%d" % worker
+            )
+        worker_settings = dict(
+            settings,
+            journal=journal_config,
+            push_enable=False,
+            worker=worker,
+            store=SQLiteStore(store_path),
+        )
+        worker_application = make_application(worker_settings)
+        worker_application.journal.restore()
+        # The router passes on the client's address, as X-Real-Ip
+        worker_application.listen(ports[worker], address="127.0.0.1", xheaders=True)
+        worker_application.reaper.start()
+        worker_application.bots.start()
+        worker_application.journal.start()
+        worker_application.shard.start()
+    tornado.ioloop.IOLoop.current().start()
+
+
 if __name__ == "__main__":
     start()
@@ -0,0 +1,269 @@
+"""Sharding of games across worker processes by gid, behind a router."""
+
+import concurrent.futures
+import random
+import re
+import time
+import zlib
+
+import tornado.httpclient
+import tornado.ioloop
+import tornado.web
+
+from dixit.pubsub import Topics
+from dixit.utils import activity_interval
+
+RE_GAME_PATH = re.compile(r"^/game/([0-9]+)/")
+
+
+def get_worker(path, gid, uid, workers):
+    """Returns the index of the worker that should handle the given request.
+
+    Requests about a game (its board, actions, chat room, or hiding it) go
+    to the worker that owns its gid. The lobby's chat room is owned by the
+    first worker. Everything else goes to the same worker for the same user,
+    such that their ETags stay valid, or to any worker for a new user.
+    """
+    match = RE_GAME_PATH.match(path)
+    if match is not None:
+        gid = match.group(1)
+    if gid is not None:
+        try:
+            return int(gid) % workers
+        except ValueError:
+            pass
+    elif path == "/chat":
+        return 0
+    if uid is None:
+        return random.randrange(workers)
+    return zlib.crc32(uid.encode("utf-8")) % workers
+
+
+class ProxyHandler(tornado.web.RequestHandler):
+    """Forwards each request to the worker that should handle it."""
+
+    SKIPPED_HEADERS = ("Content-Length", "Transfer-Encoding", "Connection")
+
+    def initialize(self, ports, cookie_name, request_timeout):
+        self.ports = ports
+        self.cookie_name = cookie_name
+        self.request_timeout = request_timeout
+
+    async def get(self):
+        path = self.request.path
+        gid = self.get_argument("room", None)
+        if path == "/hide":
+            gid = self.get_argument("gid", None)
+        worker = get_worker(
+            path, gid, self.get_cookie(self.cookie_name), len(self.ports)
+        )
+        request = tornado.httpclient.HTTPRequest(
+            "http://127.0.0.1:%d%s" % (self.ports[worker], self.request.uri),
+            method=self.request.method,
+            headers=dict(
+                [
+                    (name, value)
+                    for name, value in self.request.headers.get_all()
+                    if name not in self.SKIPPED_HEADERS
+                ]
+                + [("X-Real-Ip", self.request.remote_ip)]  # for the rate limits
+            ),
+            body=self.request.body if self.request.method == "POST" else None,
+            follow_redirects=False,
+            decompress_response=False,  # forwarded as the worker encoded it
+            request_timeout=self.request_timeout,
+        )
+        response = await tornado.httpclient.AsyncHTTPClient().fetch(
+            request, raise_error=False
+        )
+        if response.code == 599:  # could not reach the worker
+            raise tornado.web.HTTPError(502)
+        self.set_status(response.code, response.reason)
+        for name, value in response.headers.get_all():
+            if name == "Set-Cookie":
+                self.add_header(name, value)
+            elif name not in self.SKIPPED_HEADERS:
+                self.set_header(name, value)
+        if response.body and response.code != 304:
+            self.write(response.body)
+
+    post = get
+
+
+class Router(tornado.web.Application):
+    """Application that routes every request to the worker that owns it."""
+
+    MAX_CLIENTS = 10000  # concurrent requests to the workers, e.g., long-polls
+
+    def __init__(self, ports, cookie_name, request_timeout):
+        """Initializes the router for the workers listening on the given ports."""
+        tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=self.MAX_CLIENTS)
+        super(Router, self).__init__(
+            [
+                (
+                    r".*",
+                    ProxyHandler,
+                    dict(
+                        ports=ports,
+                        cookie_name=cookie_name,
+                        request_timeout=request_timeout,
+                    ),
+                )
+            ]
+        )
+
+
+class RemoteGame:
+    """Stands in for a game of another worker, as it is listed in the lobby."""
+
+    hidden = False
+
+    def __init__(self, host, players, last_active):
+        """Initializes the listing with its host and players (as User objects)."""
+        self.host = host
+        self.players = players
+        self.last_active = last_active
+
+
+class Shard:
+    """Shares the users and lobby of one worker with all others via a Store.
+
+    The worker owns every game whose gid is congruent to its index, modulo the
+    number of workers. New users are written through to the store, such that
+    any worker can adopt them by their cookie. Otherwise, each worker pushes
+    what changed in its own users and games, and pulls what changed in everyone
+    else's, once per sync interval. The store is only ever called by one thread
+    of the shard's own, off of the IOLoop, such that a busy store never holds
+    up the worker's other requests.
+    """
+
+    def __init__(self, application, shards_config, worker, store):
+        """Initializes the shard for the worker with the given index."""
+        self.application = application
+        self.workers = int(shards_config["workers"])
+        self.sync_interval = float(shards_config["sync_interval"])
+        self.worker = worker
+        self.store = store
+
+        self.pulled = 0  # store version that this worker is up to date with
+        self.pushed_lobby = 0  # lobby version that the store is up to date with
+        self.pushed_games = set()  # gids of this worker's games in the store
+        self.pushed_users = {}  # uid -> (name, activity interval) in the store
+        self.synced = 0  # time of the last push
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)  # of the store
+
+    def owns(self, gid):
+        """Returns true iff this worker owns the game with the given gid."""
+        return gid % self.workers == self.worker
+
+    def start(self):
+        """Starts syncing periodically on the current IOLoop."""
+        tornado.ioloop.PeriodicCallback(self.sync, self.sync_interval * 1000).start()
+
+    def _call_store(self, method, *args):
+        """Returns a future of the result of the store's method, in its thread."""
+        return tornado.ioloop.IOLoop.current().run_in_executor(
+            self.executor, method, *args
+        )
+
+    async def adopt_user(self, uid):
+        """Returns the user with the given uid from the store, or None."""
+        row = await self._call_store(self.store.get_user, uid)
+        return None if row is None else self._put_user(*row)
+
+    def add_user(self, user):
+        """Writes a new user through to the store, returning a future of it."""
+        return self._call_store(self.store.put_users, [self._user_row(user)])
+
+    async def sync(self):
+        """Pushes this worker's changes to the store, and pulls everyone else's."""
+        await self.push()
+        await self.pull()
+
+    def _user_row(self, user):
+        self.pushed_users[user.uid] = (user.name, activity_interval(user.last_active))
+        return (user.uid, user.puid, user.name, user.last_active)
+
+    async def push(self):
+        """Writes every user and game that changed since the last push."""
+        now = time.time()
+        rows = []
+        for user in reversed(self.application.users.users.values()):
+            if user.last_active < self.synced:
+                break  # the rest were not pinged by this worker since
+            key = (user.name, activity_interval(user.last_active))
+            if self.pushed_users.get(user.uid) != key:
+                rows.append(self._user_row(user))
+        self.synced = now
+        if rows:
+            await self._call_store(self.store.put_users, rows)
+
+        lobby = self.application.lobby
+        lobby_version = lobby.version  # as the lobby may change while writing
+        updated, removed = lobby.changes_since(self.pushed_lobby)
+        updated = [entry for entry in updated if self.owns(entry[0])]
+        if removed is None:  # updated is the entire listing
+            removed = self.pushed_games.difference(gid for gid, _, _ in updated)
+        rows = [(gid, None) for gid in removed if self.owns(gid)]
+        rows.extend(
+            (
+                gid,
+                {
+                    "summary": summary,
+                    "host": game.host.puid,
+                    "players": [user.puid for user in game.players],
+                    "lastActive": game.last_active,
+                },
+            )
+            for gid, game, summary in updated
+        )
+        if rows:
+            await self._call_store(self.store.put_games, rows)
+            for gid, entry in rows:
+                if entry is None:
+                    self.pushed_games.discard(gid)
+                else:
+                    self.pushed_games.add(gid)
+        self.pushed_lobby = lobby_version
+
+    async def pull(self):
+        """Reads every user and game that changed since the last pull."""
+        self.pulled, users, games = await self._call_store(
+            self.store.changes_since, self.pulled
+        )
+        for row in users:
+            self._put_user(*row)
+
+        application = self.application
+        by_puid = application.users.users_by_puid
+        for gid, entry in games:
+            if self.owns(gid):
+                continue
+            if entry is None:
+                application.lobby.remove(gid)
+            else:
+                game = RemoteGame(
+                    by_puid.get(entry["host"]),
+                    [by_puid[puid] for puid in entry["players"] if puid in by_puid],
+                    entry["lastActive"],
+                )
+                application.lobby.put(gid, game, entry["summary"])
+        if games:
+            application.pubsub.publish(Topics.GAMES)
+
+    def _put_user(self, uid, puid, name, last_active):
+        """Adds or updates the local copy of a user from the store."""
+        application = self.application
+        users = application.users
+        if users.has_user(uid):
+            user = users.get_user(uid)
+            users.set_last_active(user, last_active)
+        else:
+            user = users.add_user(uid, puid, last_active)
+            # The worker's journal must know every user that its games refer to.
+            application.journal.record("user", uid, puid)
+        old_name = user.name
+        if users.set_name(user, name) != old_name:
+            application.user_renamed(user)
+        self.pushed_users[uid] = (user.name, activity_interval(user.last_active))
+        return user
@@ -0,0 +1,278 @@
+"""Index of the features of every card image, to compare cards with clues.
+
+Usage: python -m dixit.similarity [--force] [config.json]
+
+This requires NumPy (pip install dixit[sim]). Each card image is described by
+its histogram over a few named colours (see COLOURS), as a unit vector, such
+that a clue that names some of them, e.g., "a dark forest", is compared with
+the cards by a vector of the same kind. The vectors of the cards of every
+configured set are written to the card cache as one matrix, which the server
+memory-maps, and only the images that are new or have changed (by their
+content hash) are described again. Running this module builds the index ahead
+of time.
+
+The images are described with Pillow (pip install dixit[images]). Without it,
+or for an image that it cannot read, a vector is instead drawn at random from
+the image's content hash, such that the bots still play, but blindly.
+"""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from dixit import config
+from dixit.cards import build_manifest, get_cache_path
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_NAME = "features"
+SAMPLE_SIZE = (32, 32)  # pixels of an image that are described
+
+# Each colour is a dimension of the vectors. The first are the hues (in degrees)
+# of the pixels that are saturated enough, and the rest are by brightness.
+COLOURS = (
+    "red",
+    "orange",
+    "yellow",
+    "green",
+    "cyan",
+    "blue",
+    "purple",
+    "pink",
+    "dark",
+    "grey",
+    "light",
+)
+HUES = np.array((0, 30, 60, 120, 180, 240, 280, 320))
+MIN_SATURATION = 0.25
+MIN_VALUE = 0.2
+BRIGHTNESS = (0.35, 0.7)  # bounds between dark, grey, and light
+
+# Words in clues, by the colour that they evoke (besides its own name)
+WORDS = {
+    "red": ("fire", "blood", "anger", "heat", "rose", "war", "danger"),
+    "orange": ("autumn", "sunset", "fox", "warm", "dusk", "copper"),
+    "yellow": ("sun", "gold", "sand", "desert", "joy", "honey", "lemon"),
+    "green": ("forest", "tree", "grass", "leaf", "nature", "garden", "spring"),
+    "cyan": ("ice", "frost", "cold", "glass", "winter", "crystal"),
+    "blue": ("sea", "ocean", "water", "sky", "rain", "sad", "river", "deep"),
+    "purple": ("magic", "dream", "mystery", "royal", "spell", "wizard"),
+    "pink": ("love", "heart", "flower", "sweet", "candy", "kiss"),
+    "dark": ("night", "shadow", "black", "fear", "alone", "secret", "cave"),
+    "grey": ("fog", "mist", "stone", "old", "storm", "smoke", "silence"),
+    "light": ("white", "snow", "cloud", "moon", "hope", "angel", "peace"),
+}
+WORD_COLOURS = dict(
+    (word, COLOURS.index(colour))
+    for colour, words in WORDS.items()
+    for word in (colour,) + words
+)
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def normalize(vector):
+    """Returns the vector scaled to unit length, or itself if it is zero."""
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+@functools.lru_cache(maxsize=1024)  # e.g., of each bot that plays for a clue
+def clue_features(clue):
+    """Returns the unit vector of the colours named by the clue, or zeros.
+
+    The vector is shared by every call with the same clue, so is read-only.
+    """
+    vector = np.zeros(len(COLOURS), dtype=np.float32)
+    for word in WORD_PATTERN.findall(clue.lower()):
+        colour = WORD_COLOURS.get(word)
+        if colour is not None:
+            vector[colour] += 1
+    vector = normalize(vector)
+    vector.flags.writeable = False
+    return vector
+
+
+def image_features(path):
+    """Returns the unit vector of the colours of the image at path."""
+    with Image.open(path) as image:
+        image = image.convert("RGB").resize(SAMPLE_SIZE)
+        hsv = np.asarray(image.convert("HSV"), dtype=np.float32).reshape(-1, 3)
+    hue, saturation, value = (hsv / 255).T
+    distance = np.abs((hue[:, None] * 360 - HUES + 180) % 360 - 180)
+    bins = np.argmin(distance, axis=1)
+    neutral = (saturation < MIN_SATURATION) | (value < MIN_VALUE)
+    bins = np.where(neutral, len(HUES) + np.digitize(value, BRIGHTNESS), bins)
+    return normalize(np.bincount(bins, minlength=len(COLOURS)).astype(np.float32))
+
+
+def hash_features(content_hash):
+    """Returns a random unit vector of colours, determined by the content hash."""
+    rng = np.random.default_rng(int(content_hash, 16))
+    return normalize(rng.dirichlet(np.full(len(COLOURS), 0.3)).astype(np.float32))
+
+
+def describe(path, content_hash):
+    """Returns the features of an image, or of its hash if it cannot be read."""
+    if Image is not None:
+        try:
+            return image_features(path)
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot describe the card %s: %s", path, e)
+    return hash_features(content_hash)
+
+
+def _index_filenames(cache_path):
+    base = os.path.join(cache_path, INDEX_NAME)
+    return base + ".npy", base + ".json"
+
+
+def load_index(cache_path):
+    """Returns the content hashes and memory-mapped features in the card cache.
+
+    Returns None if there is no index, or it is of another version.
+    """
+    matrix_filename, hashes_filename = _index_filenames(cache_path)
+    try:
+        with open(hashes_filename, "r") as hashes_file:
+            data = json.load(hashes_file)
+        if data.get("version") != INDEX_VERSION:
+            return None
+        features = np.load(matrix_filename, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if features.shape != (len(data["hashes"]), len(COLOURS)):
+        return None
+    return data["hashes"], features
+
+
+def save_index(cache_path, hashes, features):
+    """Writes the hashes and features of the cards to the card cache, atomically."""
+    matrix_filename, hashes_filename = _index_filenames(cache_path)
+    with open(matrix_filename + ".tmp", "wb") as matrix_file:
+        np.save(matrix_file, features)
+    with open(hashes_filename + ".tmp", "w") as hashes_file:
+        json.dump({"version": INDEX_VERSION, "hashes": hashes}, hashes_file)
+    os.replace(matrix_filename + ".tmp", matrix_filename)
+    os.replace(hashes_filename + ".tmp", hashes_filename)
+
+
+def build_index(card_sets_config, cache_path, force=False):
+    """Returns the features of every configured card, describing them if needed.
+
+    The rows are in the order of the cards of each set, as in load_card_sets.
+    The features are memory-mapped from the card cache, unless it is not
+    writable, in which case every card is described every time.
+    """
+    images = []  # (content hash, path) of each card
+    for folder, _ in card_sets_config.values():
+        manifest = build_manifest(folder, cache_path)
+        images.extend(
+            (image["hash"], os.path.join(manifest.path, image["name"]))
+            for image in manifest.images
+        )
+    hashes = [content_hash for content_hash, _ in images]
+    index = None if force else load_index(cache_path)
+    if index is not None and index[0] == hashes:
+        return index[1]
+
+    previous = {}
+    if index is not None:
+        previous = dict(zip(index[0], index[1]))
+    features = np.zeros((len(images), len(COLOURS)), dtype=np.float32)
+    for row, (content_hash, path) in enumerate(images):
+        vector = previous.get(content_hash)
+        features[row] = describe(path, content_hash) if vector is None else vector
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        save_index(cache_path, hashes, features)
+    except OSError as e:
+        logger.warning("Cannot write the card cache %s: %s", cache_path, e)
+        return features
+    return load_index(cache_path)[1]
+
+
+class SimilarityIndex:
+    """Lookups of the similarity between cards, and between clues and cards.
+
+    Similarities are the cosines between the features of each, from -1 to 1,
+    where 0 is for a card or a clue that is unknown to the index.
+    """
+
+    def __init__(self, features, card_sets):
+        """Initializes the index of the features of the cards of each CardSet.
+
+        The rows of features are in the order of the cards of each set.
+        """
+        self.features = features
+        self.rows = {}  # catalogue index -> row of features
+        for card_set in card_sets:
+            for card in card_set:
+                self.rows[card.index] = len(self.rows)
+        if len(self.rows) != len(features):
+            raise ValueError(
+                "There are %d cards, but %d rows of features"
+                % (len(self.rows), len(features))
+            )
+        self.unknown = np.zeros(len(COLOURS), dtype=np.float32)
+
+    def vectors(self, cards):
+        """Returns the (cards, colours) matrix of the features of the Cards."""
+        rows = [self.rows.get(card.index) for card in cards]
+        if None not in rows:
+            return self.features[rows]
+        return np.array(
+            [self.unknown if row is None else self.features[row] for row in rows]
+        )
+
+    def match(self, clue, cards):
+        """Returns the similarity of each of the Cards to the clue."""
+        return self.vectors(cards) @ clue_features(str(clue))
+
+    def similarity(self, cards, others):
+        """Returns the (cards, others) matrix of similarities between Cards."""
+        return self.vectors(cards) @ self.vectors(others).T
+
+    def make_clue(self, card, rng, words=2, min_length=0, max_length=None):
+        """Returns a clue of words that evoke the strongest colours of the Card.
+
+        Words for the same colours are added until the clue is at least
+        min_length long, and it is cut to at most max_length.
+        """
+        vector = self.vectors([card])[0]
+        colours = np.argsort(-vector, kind="stable")[:words]
+        clue = []
+        while len(clue) < words or len(" ".join(clue)) < min_length:
+            colour = colours[len(clue) % len(colours)]
+            clue.append(rng.choice(WORDS[COLOURS[colour]]))
+        return " ".join(clue)[:max_length]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("config", nargs="?", help="overriding config.json")
+    parser.add_argument("--force", action="store_true", help="redescribe every card")
+    args = parser.parse_args(argv)
+
+    default_config_filename = os.path.join(os.path.dirname(__file__), "config.json")
+    settings = config.parse(default_config_filename, args.config)
+    cache_path = get_cache_path(settings["card_cache"])
+    features = build_index(settings["card_sets"], cache_path, force=args.force)
+    print(
+        "%d cards by %d colours%s"
+        % (features.shape + (" (at random)" * (Image is None),))
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Batch simulator of many games at once, for scoring and balance analysis.
+
+Usage: python -m dixit.simulator [--games N] [--players N] [--policy NAME] ...
+
+This requires NumPy (pip install dixit[sim]). Each game is played by the same
+rules as dixit.core, but the hands, played cards, votes, and scores of every
+game are held in arrays, and each round is applied to all games at once. The
+players' decisions are made by a pluggable Policy.
+
+Seats are numbered in the order of turns, such that seat k makes the clue in
+every round r with r % players == k, and each card played in a round is known
+by the seat that played it.
+"""
+
+import argparse
+import collections
+
+import numpy as np
+
+from dixit.core import Game
+from dixit.utils import INFINITY
+
+EMPTY = -1  # a slot in a hand without a card
+
+
+def random_other_seats(rng, players, excluded):
+    """Returns a uniformly random seat for each entry, other than the excluded.
+
+    The excluded seats are given as a list of arrays, which must differ from
+    each other in every entry.
+    """
+    shape = excluded[0].shape
+    seats = rng.integers(0, players - len(excluded), size=shape)
+    for excluded_seats in np.sort(np.stack(excluded), axis=0):
+        seats += seats >= excluded_seats
+    return seats
+
+
+class Policy:
+    """Decides what the players of every game do in each round.
+
+    The base policy plays the first card in every hand, and votes uniformly
+    at random for a card other than their own.
+    """
+
+    def choose_slots(self, games, rng):
+        """Returns the (games, players) slot in each hand of the card to play."""
+        return np.zeros(games.hands.shape[:2], dtype=np.intp)
+
+    def choose_votes(self, games, rng, cards, clue_makers):
+        """Returns the (games, players) seat whose card each player votes for.
+
+        The votes of the clue makers are ignored.
+        """
+        seats = np.broadcast_to(np.arange(games.players), cards.shape)
+        return random_other_seats(rng, games.players, [seats])
+
+
+class AccuracyPolicy(Policy):
+    """Finds the clue maker's card with some probability, or else votes randomly."""
+
+    def __init__(self, accuracy):
+        """Initializes the policy with the probability of finding the card."""
+        self.accuracy = accuracy
+
+    def choose_votes(self, games, rng, cards, clue_makers):
+        seats = np.broadcast_to(np.arange(games.players), cards.shape)
+        clue_seats = np.broadcast_to(clue_makers[:, None], cards.shape)
+        # The clue makers' own votes are ignored, so they exclude a dummy seat.
+        excluded = np.where(seats == clue_seats, -1, clue_seats)
+        others = random_other_seats(rng, games.players, [seats, excluded])
+        found = rng.random(cards.shape) < self.accuracy
+        return np.where(found, clue_seats, others)
+
+
+RoundResult = collections.namedtuple(
+    "RoundResult", ("clue_makers", "cards", "votes", "scores", "active")
+)
+
+
+class BatchGames:
+    """Many games with the same number of players and deck size, as arrays.
+
+    Every game deals the same number of cards each round, so they all share
+    the number of cards dealt, while each game has its own shuffled deck.
+    """
+
+    def __init__(
+        self,
+        games,
+        players,
+        deck_size,
+        max_score=INFINITY,
+        rng=None,
+        score_for_trick=Game.SCORE_FOR_TRICK,
+        score_for_loss=Game.SCORE_FOR_LOSS,
+        score_for_correct=Game.SCORE_FOR_CORRECT,
+    ):
+        """Starts the given number of games, dealing every hand (as start_game)."""
+        if deck_size < players * Game.CARDS_PER_PERSON:
+            raise ValueError("The deck is too small for %d players" % players)
+        self.players = players
+        self.max_score = max_score
+        self.rng = np.random.default_rng(rng)
+        self.score_for_trick = score_for_trick
+        self.score_for_loss = score_for_loss
+        self.score_for_correct = score_for_correct
+
+        self.decks = self.rng.random((games, deck_size)).argsort(axis=1)
+        hand_size = players * Game.CARDS_PER_PERSON
+        self.hands = self.decks[:, :hand_size].reshape(games, players, -1).copy()
+        self.dealt = hand_size
+        self.scores = np.zeros((games, players), dtype=np.int64)
+        self.active = np.ones(games, dtype=bool)  # false once a game has ended
+        self.rounds = 0  # played by every game that is still active
+        self.game_rounds = np.zeros(games, dtype=np.int64)
+
+    def left(self):
+        """Returns the number of cards left to be dealt (in every game)."""
+        return self.decks.shape[1] - self.dealt
+
+    def play_round(self, policy):
+        """Plays one round of every active game with the given policy.
+
+        The clue maker draws first, and then the others in the order of their
+        seats. Returns a RoundResult with the scores of this round.
+        """
+        games, players = self.scores.shape
+        game_index = np.arange(games)
+        seats = np.arange(players)
+        clue_makers = np.full(games, self.rounds % players)
+        active = self.active.copy()
+
+        slots = policy.choose_slots(self, self.rng)
+        cards = np.take_along_axis(self.hands, slots[:, :, None], axis=2)[:, :, 0]
+        if np.any(cards[active] == EMPTY):
+            raise ValueError("A card must be played from a non-empty slot")
+        dealing_order = (seats - clue_makers[:, None]) % players  # clue maker first
+        drawn = min(players, self.left())
+        new_cards = np.full((games, players), EMPTY)
+        new_cards[:, :drawn] = self.decks[:, self.dealt : self.dealt + drawn]
+        self.dealt += drawn
+        np.put_along_axis(
+            self.hands,
+            slots[:, :, None],
+            np.take_along_axis(new_cards, dealing_order, axis=1)[:, :, None],
+            axis=2,
+        )
+
+        votes = policy.choose_votes(self, self.rng, cards, clue_makers).copy()
+        votes[game_index, clue_makers] = clue_makers
+        if np.any((votes == seats) & (seats != clue_makers[:, None])):
+            raise ValueError("Players must not vote for their own cards")
+        scores = self.score(votes, clue_makers)
+        scores[~active] = 0
+
+        self.scores += scores
+        self.rounds += 1
+        self.game_rounds += active
+        ended = (self.left() == 0) | np.any(self.scores >= self.max_score, axis=1)
+        self.active &= ~ended
+        return RoundResult(clue_makers, cards, votes, scores, active)
+
+    def score(self, votes, clue_makers):
+        """Returns the (games, players) scores of a round, as Game._do_scoring."""
+        games, players = votes.shape
+        seats = np.arange(players)
+        voted = votes[:, :, None] == seats  # (game, voter, seat voted for)
+        voted[:, seats, seats] = False  # ignore self-votes
+        voters = voted.sum(axis=1)  # (game, seat) -> number voting for its card
+
+        is_clue_maker = seats == clue_makers[:, None]
+        found = voted[np.arange(games), :, clue_makers]  # voted for the clue
+        found_by = voters[np.arange(games), clue_makers]
+        lost = ((found_by == 0) | (found_by == players - 1))[:, None]
+
+        scores = np.where(lost & ~is_clue_maker, self.score_for_loss, 0)
+        scores += np.where(~lost & (is_clue_maker | found), self.score_for_correct, 0)
+        scores += np.where(is_clue_maker, 0, self.score_for_trick * voters)
+        return scores
+
+    def run(self, policy):
+        """Plays rounds until every game has ended, and returns self."""
+        while self.active.any():
+            self.play_round(policy)
+        return self
+
+
+def summarize(games):
+    """Returns a dict of statistics about a batch of finished games."""
+    scores = games.scores
+    best = scores.max(axis=1, keepdims=True)
+    winners = scores == best  # with ties, each of them wins
+    ranked = np.sort(scores, axis=1)
+    return {
+        "games": len(scores),
+        "meanRounds": float(games.game_rounds.mean()),
+        "meanScore": float(scores.mean()),
+        "meanMargin": float((ranked[:, -1] - ranked[:, -2]).mean()),
+        "tieRate": float((winners.sum(axis=1) > 1).mean()),
+        "winRateBySeat": [float(rate) for rate in winners.mean(axis=0)],
+    }
+
+
+POLICIES = {
+    "random": lambda args: Policy(),
+    "accuracy": lambda args: AccuracyPolicy(args.accuracy),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--players", type=int, default=5)
+    parser.add_argument("--deck-size", type=int, default=84)
+    parser.add_argument("--max-score", type=int, default=30)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="accuracy")
+    parser.add_argument("--accuracy", type=float, default=0.5, help="of voters")
+    parser.add_argument("--trick", type=int, default=Game.SCORE_FOR_TRICK)
+    parser.add_argument("--loss", type=int, default=Game.SCORE_FOR_LOSS)
+    parser.add_argument("--correct", type=int, default=Game.SCORE_FOR_CORRECT)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    games = BatchGames(
+        args.games,
+        args.players,
+        args.deck_size,
+        args.max_score,
+        args.seed,
+        score_for_trick=args.trick,
+        score_for_loss=args.loss,
+        score_for_correct=args.correct,
+    ).run(POLICIES[args.policy](args))
+    for key, value in summarize(games).items():
+        print("%s: %s" % (key, value))
+
+
+if __name__ == "__main__":
+    main()
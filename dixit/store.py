@@ -0,0 +1,160 @@
+"""Users and lobby entries shared between the worker processes of a server."""
+
+import abc
+import json
+import sqlite3
+
+
+class Store(abc.ABC):
+    """Interface for the users and lobby entries shared by all workers.
+
+    Every write bumps the version of the store and stamps each row that it
+    writes with that version, such that changes_since(version) only returns
+    the rows written since. A user row is a tuple (uid, puid, name,
+    last_active), while a game row is a tuple (gid, entry), where the entry is
+    a JSON-serializable dictionary, or None once the game is removed.
+    """
+
+    @abc.abstractmethod
+    def get_user(self, uid):
+        """Returns the row of the user with the given uid, or None."""
+
+    @abc.abstractmethod
+    def put_users(self, rows):
+        """Adds or replaces the given user rows."""
+
+    @abc.abstractmethod
+    def put_games(self, rows):
+        """Adds or replaces the given game rows."""
+
+    @abc.abstractmethod
+    def changes_since(self, version):
+        """Returns the current version, and all user and game rows since."""
+
+
+class MemoryStore(Store):
+    """Store within a single process, e.g., for testing."""
+
+    def __init__(self):
+        """Initializes an empty store."""
+        self.version = 0
+        self.users = {}  # uid -> (version, row)
+        self.games = {}  # gid -> (version, row)
+
+    def get_user(self, uid):
+        entry = self.users.get(uid)
+        return None if entry is None else entry[1]
+
+    def put_users(self, rows):
+        self.version += 1
+        for row in rows:
+            self.users[row[0]] = (self.version, tuple(row))
+
+    def put_games(self, rows):
+        self.version += 1
+        for gid, entry in rows:
+            # Round-trip through JSON, as any other store would.
+            self.games[gid] = (self.version, (gid, json.loads(json.dumps(entry))))
+
+    def changes_since(self, version):
+        return (
+            self.version,
+            [row for v, row in self.users.values() if v > version],
+            [row for v, row in self.games.values() if v > version],
+        )
+
+
+class SQLiteStore(Store):
+    """Store in an SQLite database, shared by the processes on one machine."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (version INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS users (
+            uid TEXT PRIMARY KEY, puid TEXT, name TEXT, last_active REAL,
+            version INTEGER);
+        CREATE INDEX IF NOT EXISTS users_version ON users (version);
+        CREATE TABLE IF NOT EXISTS games (
+            gid INTEGER PRIMARY KEY, entry TEXT, version INTEGER);
+        CREATE INDEX IF NOT EXISTS games_version ON games (version);
+    """
+
+    def __init__(self, path):
+        """Opens (and if need be creates) the database at the given path."""
+        # The connection is made by one thread but used by another, one at a
+        # time (see Shard).
+        self.connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        with self._transaction():
+            if self.connection.execute("SELECT version FROM meta").fetchone() is None:
+                self.connection.execute("INSERT INTO meta VALUES (0)")
+
+    def _transaction(self, begin="BEGIN IMMEDIATE"):
+        # IMMEDIATE takes the write lock up front, so that versions are
+        # assigned in the same order as the transactions commit.
+        return _Transaction(self.connection, begin)
+
+    def _bump(self):
+        self.connection.execute("UPDATE meta SET version = version + 1")
+        return self.connection.execute("SELECT version FROM meta").fetchone()[0]
+
+    def get_user(self, uid):
+        row = self.connection.execute(
+            "SELECT uid, puid, name, last_active FROM users WHERE uid = ?", (uid,)
+        ).fetchone()
+        return None if row is None else tuple(row)
+
+    def put_users(self, rows):
+        with self._transaction():
+            version = self._bump()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)",
+                [tuple(row) + (version,) for row in rows],
+            )
+
+    def put_games(self, rows):
+        with self._transaction():
+            version = self._bump()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO games VALUES (?, ?, ?)",
+                [
+                    (gid, None if entry is None else json.dumps(entry), version)
+                    for gid, entry in rows
+                ],
+            )
+
+    def changes_since(self, version):
+        with self._transaction("BEGIN"):  # reads one consistent snapshot
+            current = self.connection.execute("SELECT version FROM meta").fetchone()
+            users = self.connection.execute(
+                "SELECT uid, puid, name, last_active FROM users WHERE version > ?",
+                (version,),
+            ).fetchall()
+            games = self.connection.execute(
+                "SELECT gid, entry FROM games WHERE version > ?", (version,)
+            ).fetchall()
+        return (
+            current[0],
+            [tuple(row) for row in users],
+            [
+                (gid, None if entry is None else json.loads(entry))
+                for gid, entry in games
+            ],
+        )
+
+
+class _Transaction:
+    """Context manager that commits, or rolls back upon any exception."""
+
+    def __init__(self, connection, begin):
+        self.connection = connection
+        self.begin = begin
+
+    def __enter__(self):
+        self.connection.execute(self.begin)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
@@ -1,13 +1,16 @@
 // Static constants
 var TITLE = '{{ display.Labels.TITLE }}';
 var ALERT_TITLE = TITLE + ' (!)';
+var PUSH_ENABLE = {{ 'true' if push_enable else 'false' }};
+var BOTS_ENABLE = {{ 'true' if bots_enable else 'false' }};
 
 
 // Refresh each element every X millesconds
 var GAMELIST_INTERVAL = 10000;
 var USERLIST_INTERVAL = 20000;
 var CHATROOM_INTERVAL = 3000;
-var GAMEBOARD_INTERVAL = 4000;
+var GAMEBOARD_INTERVAL = 4000;  // only used to back off after a failed long-poll
+var ACTIVITY_INTERVAL = 60000;  // ages the activity of pushed lists
 
 
 // Summary of game state for an observer
@@ -69,94 +72,157 @@ function smilify(text) {
 };
 
 
+// GETs JSON as with $.getJSON, but only calls back if it has been modified
+function getJSONIfModified(url, callback) {
+    // ifModified sends the ETag of the last response from the same url
+    return $.ajax({url: url, dataType: 'json', ifModified: true}).done(function(data, status) {
+        if (status != 'notmodified') {
+            callback(data);
+        }
+    });
+};
+
+
 // All of the jQuery stuff
 $(document).ready(function() {
     // Global state
     var activeGame = $.url().fparam('gid');  // id of currently selected game
-    var handHash = undefined;  // hash of most recently rendered hand, or undefined
-    var cardsHash = undefined;  // hash of most recently rendered current cards, or undefined
-    var votesHash = undefined;  // hash of most recently revealed votes, or undefined
-    var lastChatUpdate = 0;  // timestamp of most recently retrieved message
-
-
-    // Periodic Game List Polling
-    var gameListWorker = function worker() {
-        $.getJSON('getgames', function(data) {
-            var rows = [];
-            if (data.length > 0) {
-                rows.push($('<tr><th>&nbsp;</th><th>Host</th><th>Name</th><th>State</th><th>Players</th><th>Score</th><th>Cards</th><th>Actions</th></tr>'));
+    var handVersion = undefined;  // version of most recently rendered hand, or undefined
+    var cardsVersion = undefined;  // version of most recently rendered current cards, or undefined
+    var votesVersion = undefined;  // version of most recently revealed votes, or undefined
+    var boardVersion = undefined;  // version of most recently rendered board, or undefined
+    var board = undefined;  // most recently rendered board, which patches apply to
+    var boardRequest = undefined;  // outstanding long-poll for the game board, or undefined
+    var lobbyChatSeq = 0;  // sequence id of most recently retrieved message in the lobby
+    var gameChatSeq = 0;  // sequence id of most recently retrieved message in the active game
+    var showGameChat = false;  // whether the active game's chat room is shown, or the lobby's
+    var games = {};  // gid -> summary of each visible game, with a local lastActive
+    var gamesVersion = 0;  // lobby version that games is up to date with
+    var userList = [];  // most recently retrieved list of users
+    var userListReceived = 0;  // Date.now() when userList was retrieved
+    var pushing = PUSH_ENABLE && window.WebSocket !== undefined;  // or else polling
+    var pushSocket = undefined;  // push channel, once it is open
+    var boardTopic = undefined;  // game board topic subscribed to, or undefined
+    var gameChatTopic = undefined;  // chat topic of the active game, if boardTopic is defined
+
+
+    // Game List (pushed, or else polled periodically)
+    function mergeGames(data) {
+        // Applies the changes to the game list since gamesVersion
+        if (data.full) {
+            games = {};
+        }
+        $.each(data.removed, function(i, gid) {
+            delete games[gid];
+        });
+        var now = Date.now();
+        $.each(data.games, function(i, game) {
+            game.lastActive = now - game.relLastActive * 1000;
+            games[game.gid] = game;
+        });
+        gamesVersion = data.version;
+        renderGameList();
+    };
+    function renderGameList() {
+        var now = Date.now();
+        var gameList = $.map(games, function(game) {
+            return game;
+        }).sort(function(a, b) {
+            return (b.lastActive - a.lastActive) || (b.gid - a.gid);
+        });
+        var rows = [];
+        if (gameList.length > 0) {
+            rows.push($('<tr><th>&nbsp;</th><th>Host</th><th>Name</th><th>State</th><th>Players</th><th>Score</th><th>Cards</th><th>Actions</th></tr>'));
+        }
+        $.each(gameList, function(i, game) {
+            var row = $('<tr>')
+                .addClass((game.gid == activeGame ? 'activeGame' : 'visibleGame'))
+                .data('gid', game.gid)
+                .data('name', game.name);
+            row.append($('<td>').addClass('firstCell').html(activityIcon((now - game.lastActive) / 1000)));
+            row.append($('<td>').html(smilify(game.host)));
+            row.append($('<td>').html(smilify(game.name)));
+            row.append($('<td>').text(observerMessages[game.state]));
+            row.append($('<td>').attr('title', game.players.join(', ')).text(game.players.length
+                    + (game.state == {{ states.BEGIN }} ? ' / ' + game.maxPlayers : '')))
+            row.append($('<td>').text(game.topScore + (game.maxScore ? ' / ' + game.maxScore : '')));
+
+            row.append($('<td>').attr('title', game.deckName).text(game.left + ' / ' + game.size));
+            var actionCell = $('<td>').addClass('lastCell');
+            if (game.isHost) {
+                actionCell.append($('<button>').addClass('hide').attr('title', hideGameTitle).text('X'));
+            } else {
+                actionCell.append('&mdash;')
             }
-            $.each(data, function(i, game) {
-                var row = $('<tr>')
-                    .addClass((game.gid == activeGame ? 'activeGame' : 'visibleGame'))
-                    .data('gid', game.gid)
-                    .data('name', game.name);
-                row.append($('<td>').addClass('firstCell').html(activityIcon(game.relLastActive)));
-                row.append($('<td>').html(smilify(game.host)));
-                row.append($('<td>').html(smilify(game.name)));
-                row.append($('<td>').text(observerMessages[game.state]));
-                row.append($('<td>').attr('title', game.players.join(', ')).text(game.players.length
-                        + (game.state == {{ states.BEGIN }} ? ' / ' + game.maxPlayers : '')))
-                row.append($('<td>').text(game.topScore + (game.maxScore ? ' / ' + game.maxScore : '')));
-
-                row.append($('<td>').attr('title', game.deckName).text(game.left + ' / ' + game.size));
-                var actionCell = $('<td>').addClass('lastCell');
-                if (game.isHost) {
-                    actionCell.append($('<button>').addClass('hide').attr('title', hideGameTitle).text('X'));
-                } else {
-                    actionCell.append('&mdash;')
-                }
-                row.append(actionCell);
-                rows.push(row);
-            });
-            $('#gameTable').empty().append(rows);
+            row.append(actionCell);
+            rows.push(row);
+        });
+        $('#gameTable').empty().append(rows);
 
-            // Register handlers for elements that have been added dynamically
-            $('#gameTable button').button();
+        // Register handlers for elements that have been added dynamically
+        $('#gameTable button').button();
 
-            $('.hide').click(function(e) {
-                var gid = $(this).parent().parent().data('gid');
-                var name = $(this).parent().parent().data('name');
-                openHide(gid, name);
-                e.preventDefault();
-            });
-            $('.visibleGame td:not(.lastCell)').click(function(e) {
-                gid = $(this).parent().data('gid');
-                switchGame(gid);
-                e.preventDefault();
-            });
-        }).always(function() {
+        $('.hide').click(function(e) {
+            var gid = $(this).parent().parent().data('gid');
+            var name = $(this).parent().parent().data('name');
+            openHide(gid, name);
+            e.preventDefault();
+        });
+        $('.visibleGame td:not(.lastCell)').click(function(e) {
+            gid = $(this).parent().data('gid');
+            switchGame(gid);
+            e.preventDefault();
+        });
+    };
+    var gameListWorker = function worker() {
+        if (pushing) {
+            return;
+        }
+        getJSONIfModified('getgames?since=' + gamesVersion, mergeGames).always(function() {
             setTimeout(gameListWorker, GAMELIST_INTERVAL);
         });
     };
-    gameListWorker();
     function refreshGameList() {
-        setTimeout(gameListWorker, 0);
+        if (pushing) {
+            renderGameList();
+        } else {
+            setTimeout(gameListWorker, 0);
+        }
     };
 
 
-    // Periodic User List Polling
+    // User List (pushed, or else polled periodically)
+    function renderUserList() {
+        var age = (Date.now() - userListReceived) / 1000;
+        var html = [];
+        $.each(userList, function(i, user) {
+            html.push('<tr>');
+            html.push('<td class="bunnyIcon">' + activityIcon(user.relLastActive + age) + '</td>');
+            html.push('<td>' + smilify(user.name) + '</td>');
+            html.push('</tr>');
+        });
+        $('#userTable').html(html.join(''));
+    };
     var userListWorker = function worker() {
-        $.getJSON('getusers', function(data) {
-            var html = [];
-            $.each(data, function(i, user) {
-                html.push('<tr>');
-                html.push('<td class="bunnyIcon">' + activityIcon(user.relLastActive) + '</td>');
-                html.push('<td>' + smilify(user.name) + '</td>');
-                html.push('</tr>');
-            });
-            $('#userTable').html(html.join(''));
+        if (pushing) {
+            return;
+        }
+        getJSONIfModified('getusers', function(data) {
+            userList = data;
+            userListReceived = Date.now();
+            renderUserList();
         }).always(function() {
             setTimeout(userListWorker, USERLIST_INTERVAL);
         });
     };
-    userListWorker();
     function refreshUserList() {
-        setTimeout(userListWorker, 0);
+        if (!pushing) {
+            setTimeout(userListWorker, 0);
+        }
     };
 
 
-    // Periodic Chat Room Polling
+    // Chat Room (pushed, or else polled periodically)
     function formatHours(i) {
         return (i + 11) % 12 + 1;
     }
@@ -166,41 +232,96 @@ $(document).ready(function() {
     function formatAmPm(i) {
         return i >= 12 ? 'pm' : 'am';
     }
-    function addMessage(obj) {
+    // A room is the gid of a game, or undefined for the lobby
+    function addMessage(chatLog, room, obj) {
         var date = new Date(obj.t * 1000);
-        $('#chatLog').append('<p><span class="chatTime">('
-                           + formatHours(date.getHours()) + ':' + formatMinutes(date.getMinutes()) + formatAmPm(date.getHours())
-                           + ')</span> <span class="chatUser">' + smilify(obj.user) + '</span>: '
-                           + '<span class="chatText" id="' + obj.mid + '"></span></p>');
-        $('#' + obj.mid).html(smilify(obj.msg));
+        var id = 'msg-' + (room === undefined ? 'lobby' : room) + '-' + obj.mid;
+        chatLog.append('<p><span class="chatTime">('
+                     + formatHours(date.getHours()) + ':' + formatMinutes(date.getMinutes()) + formatAmPm(date.getHours())
+                     + ')</span> <span class="chatUser">' + smilify(obj.user) + '</span>: '
+                     + '<span class="chatText" id="' + id + '"></span></p>');
+        $('#' + id).html(smilify(obj.msg));
     };
-    var chatRoomWorker = function worker() {
-        $.getJSON('chat?t=' + lastChatUpdate, function(data) {
-            chatLog = $('#chatLog');
-            wasFullyScrolled = (chatLog.prop('scrollHeight') <= chatLog.prop('scrollTop') + chatLog.height() + 20);  // 20 padding
-
-            $.each(data.log, function(i, obj) {
-                if (obj.t > lastChatUpdate) {
-                    addMessage(obj);
-                }
-            });
-            lastChatUpdate = data.t;
+    function renderChat(room, data) {
+        if (room !== undefined && room != activeGame) {
+            return;  // from a game that is no longer active
+        }
+        var chatLog = (room === undefined ? $('#chatLog') : $('#gameChatLog'));
+        var seq = (room === undefined ? lobbyChatSeq : gameChatSeq);
+        var wasFullyScrolled = (chatLog.prop('scrollHeight') <= chatLog.prop('scrollTop') + chatLog.height() + 20);  // 20 padding
+
+        var added = 0;
+        $.each(data.log, function(i, obj) {
+            if (obj.mid > seq) {
+                addMessage(chatLog, room, obj);
+                added++;
+            }
+        });
+        if (room === undefined) {
+            lobbyChatSeq = data.seq;
+        } else {
+            gameChatSeq = data.seq;
+        }
 
-            if (data.log.length > 0 && wasFullyScrolled) {
-                $('#chatLog').animate({ scrollTop: chatLog.prop('scrollHeight') }, "slow");
-                if (!document.hasFocus()) {
-                    document.title = ALERT_TITLE;
-                }
+        if (added > 0) {
+            if ((room !== undefined) != showGameChat) {
+                $(room === undefined ? '#lobbyChatTab' : '#gameChatTab').addClass('unread');
             }
-        }).always(function() {
+            if (wasFullyScrolled) {
+                chatLog.animate({ scrollTop: chatLog.prop('scrollHeight') }, "slow");
+            }
+            if (!document.hasFocus()) {
+                document.title = ALERT_TITLE;
+            }
+        }
+    };
+    function chatUrl(room, params) {
+        return 'chat?' + (room !== undefined ? 'room=' + room + '&' : '') + params;
+    };
+    var chatRoomWorker = function worker() {
+        if (pushing) {
+            return;
+        }
+        var room = activeGame;
+        var requests = [getJSONIfModified(chatUrl(undefined, 'since=' + lobbyChatSeq), function(data) {
+            renderChat(undefined, data);
+        })];
+        if (room !== undefined) {
+            requests.push(getJSONIfModified(chatUrl(room, 'since=' + gameChatSeq), function(data) {
+                renderChat(room, data);
+            }));
+        }
+        $.when.apply($, requests).always(function() {
             setTimeout(chatRoomWorker, CHATROOM_INTERVAL);
         });
     };
-    chatRoomWorker();
+    function refreshChatRoom() {
+        if (!pushing) {
+            setTimeout(chatRoomWorker, 0);
+        }
+    };
+    function selectChatTab(isGame) {
+        showGameChat = isGame;
+        $('#lobbyChatTab').toggleClass('selected', !isGame);
+        $('#gameChatTab').toggleClass('selected', isGame);
+        $(isGame ? '#gameChatTab' : '#lobbyChatTab').removeClass('unread');
+        $('#chatLog').toggle(!isGame);
+        $('#gameChatLog').toggle(isGame);
+    };
+    $('#lobbyChatTab').click(function() {
+        selectChatTab(false);
+    });
+    $('#gameChatTab').click(function() {
+        selectChatTab(true);
+    });
+    if (activeGame !== undefined) {
+        $('#gameChatTab').show();
+    }
     $('#sendMsg').submit(function (e) {
         if ($('#chatInput').val().length > 0) {
-            $.post('chat', $(this).serialize(), function(data) {
-                setTimeout(chatRoomWorker, 0);
+            var room = (showGameChat ? activeGame : undefined);
+            $.post(chatUrl(room, ''), $(this).serialize(), function(data) {
+                refreshChatRoom();
             });
         }
         $('#chatInput').val('');
@@ -213,199 +334,326 @@ $(document).ready(function() {
     });
 
 
-    // Periodic Game Board Polling
-    var gameBoardWorker = function worker() {
-        if (document.hasFocus()) {
-            document.title = TITLE;
-        }
-        if (activeGame === undefined) {
-            return;
-        }
-        sendCommand({{ commands.GET_BOARD }}, null, function(data) {
-            var numPlayers = data.order.length;
-            var clueMaker = data.order[data.turn];
-
-            // Colour picker / game joiner
-            if (data.state == {{ states.BEGIN }} && numPlayers < data.maxPlayers) {
-                $('#bunnyPalette').show();
-                $('.joinGame').addClass('clickable').removeClass('bunnyTaken');
-                $.each(data.colours, function(uid, colour) {
-                    $('#' + colour).removeClass('clickable').addClass('bunnyTaken');
-                });
+    // Game Board (pushed, or else long-polled until the board version moves)
+    function mergePatch(target, patch) {
+        // Applies a JSON merge patch (RFC 7386) to target, in place
+        $.each(patch, function(key, value) {
+            if (value === null) {
+                delete target[key];
+            } else if ($.isPlainObject(value) && $.isPlainObject(target[key])) {
+                mergePatch(target[key], value);
             } else {
-                $('#bunnyPalette').hide();
+                target[key] = value;
             }
-
-            // Determine highest rank
-            var maxRank = 0;
-            $.each(data.ranked, function(puid, rank) {
-                if (rank > maxRank) {
-                    maxRank = rank;
-                }
+        });
+    };
+    function receiveGameBoard(data) {
+        // Renders the board, or a patch of the board with revision data.patchOf
+        if (data.patchOf !== undefined) {
+            if (board === undefined || board.rev != data.patchOf) {
+                board = undefined;  // out of sync, so the next board is in full
+                boardVersion = undefined;
+                return false;
+            }
+            delete data.patchOf;
+            mergePatch(board, data);
+        } else {
+            board = data;
+        }
+        renderGameBoard(board);
+        return true;
+    };
+    function renderGameBoard(data) {
+        boardVersion = data.version;
+        var numPlayers = data.order.length;
+        var clueMaker = data.order[data.turn];
+
+        // Colour picker / game joiner
+        if (data.state == {{ states.BEGIN }} && numPlayers < data.maxPlayers) {
+            $('#bunnyPalette').show();
+            $('.joinGame').addClass('clickable').removeClass('bunnyTaken');
+            $.each(data.colours, function(uid, colour) {
+                $('#' + colour).removeClass('clickable').addClass('bunnyTaken');
             });
+        } else {
+            $('#bunnyPalette').hide();
+        }
 
-            // Scoreboard
-            var scoreBoard = [];
-            $.each(data.order, function(i, puid) {
-                // Determine if a winner
-                var isWinner = (data.state == {{ states.END }} && data.ranked[puid] == maxRank);
-
-                // Indicate who's clue it is
-                scoreBoard.push('<tr>');
-                scoreBoard.push('<td>' + (i == data.turn && data.state != {{ states.BEGIN }}
-                                       ? '<img src="{{ display.Images.YOUR_TURN }}" width="{{ display.Sizes.YOUR_TURN }}" title="Story Teller" />'
-                                       : '&nbsp;') + '</td>');
-
-                // Name of player and option to kick them if host
-                var canKick = data.isHost
-                           && (data.state == {{ states.BEGIN }} || numPlayers > {{ limits.min_players }})
-                           && data.state != {{ states.PLAY }}
-                           && data.state != {{ states.VOTE }};
-                scoreBoard.push('<td class="player">'
-                              + (canKick ? '[<a class="kickPlayer" href="#" title="Kick Player" id="' + puid + '">x</a>] ' : '')
-                              + '<span style="' + (puid == data.user ? 'font-weight:bold' : '') + '">'
-                              + smilify(data.players[puid]) + '</span></td>');
-
-                // Action that player has taken pertaining to the current game state
-                extra = '&nbsp;';
-                if (data.requiresAction[puid]) {
-                    extra = '<img class="thinking" src="{{ display.Images.THINKING }}" title="Thinking" />';
-                } else if (data.state == {{ states.PLAY }}) {
-                    extra = '<img src="{{ display.Images.CARD_BACK }}" title="Selected card" />';
-                } else if (data.state == {{ states.VOTE }}) {
-                    extra = '<img src="{{ display.Images.VOTE_TOKEN }}" title="Voted" />';
-                }
-                scoreBoard.push('<td><div class="userAction">' + extra + '</div></td>');
-
-                // Spacers to order player by rank
-                scoreBoard.push('<td><div style="width:40px">&nbsp;</div></td>');
-                scoreBoard.push(Array(data.ranked[puid] + 1).join('<td>&nbsp;</td>'));
-
-                // Player's bunny piece and score
-                scoreBoard.push('<td class="bunnyPiece"><div style="background-color: #' + data.colours[puid]
-                              + '" title="' + textToHtml(data.players[puid]) + '"><img src="'
-                              + ((data.state == {{ states.BEGIN }} || data.state == {{ states.END }})
-                               ? '{{ display.Images.BUNNY_READY }}' : '{{ display.Images.BUNNY_RUN }}')
-                              + '" /></div></td>');
-                scoreBoard.push('<td class="score">' + data.scores[puid] + '</td>');
-
-                // Spacers to make every row have the same number of cells
-                scoreBoard.push(Array(maxRank - data.ranked[puid] + 1).join('<td>&nbsp;</td>'));
-
-                // Number of points accumulated this round
-                scoreBoard.push('<td class="lastScore">'
-                              + (data.round.scores[puid] ? '(+' + data.round.scores[puid] + ')' : '&nbsp;')
-                              + '</td>');
-
-                // Add trophy if winner
-                scoreBoard.push('<td>' + (isWinner ? smilify('(winner)') : '&nbsp;') + '</td>');
-
-                // Space the rest
-                scoreBoard.push('<td style="width:100%">&nbsp;</td>');
-                scoreBoard.push('</tr>');
-            });
-            $('#scoreBoard').html(scoreBoard.join('')).toggle(numPlayers > 0);
-            $('.kickPlayer').click(kickPlayer);  // since element was dynamically generated
-
-            // State-dependent display / options
-            if (!data.isPlayer) {
-                $('#gameState').html(observerMessages[data.state]);
-            } else if (data.requiresAction[data.user]) {
-                $('#gameState').html(actionMessages[data.state]);
-                if (!document.hasFocus()) {
-                    document.title = ALERT_TITLE;
-                }
-            } else {
-                $('#gameState').html(waitingMessages[data.state]);
+        // Determine highest rank
+        var maxRank = 0;
+        $.each(data.ranked, function(puid, rank) {
+            if (rank > maxRank) {
+                maxRank = rank;
             }
-            $('#joinGame').toggle();
-            $('#startGame').toggle(data.state == {{ states.BEGIN }} && data.isHost
-                                && numPlayers >= {{ limits.min_players }});
-
-            // Game configuration dependent stuff
-            $('#clueTextarea').attr('maxlength', data.maxClueLength);
+        });
 
-            // Current Clue
-            if (data.round.clue !== undefined) {
-                $('#clue').html('Clue: "' + smilify(data.round.clue) + '"').fadeIn();
-            } else {
-                $('#clue').hide();
+        // Scoreboard
+        var scoreBoard = [];
+        $.each(data.order, function(i, puid) {
+            // Determine if a winner
+            var isWinner = (data.state == {{ states.END }} && data.ranked[puid] == maxRank);
+
+            // Indicate who's clue it is
+            scoreBoard.push('<tr>');
+            scoreBoard.push('<td>' + (i == data.turn && data.state != {{ states.BEGIN }}
+                                   ? '<img src="{{ display.Images.YOUR_TURN }}" width="{{ display.Sizes.YOUR_TURN }}" title="Story Teller" />'
+                                   : '&nbsp;') + '</td>');
+
+            // Name of player and option to kick them if host
+            var canKick = data.isHost
+                       && (data.state == {{ states.BEGIN }} || numPlayers > {{ limits.min_players }})
+                       && data.state != {{ states.PLAY }}
+                       && data.state != {{ states.VOTE }};
+            scoreBoard.push('<td class="player">'
+                          + (canKick ? '[<a class="kickPlayer" href="#" title="Kick Player" id="' + puid + '">x</a>] ' : '')
+                          + '<span style="' + (puid == data.user ? 'font-weight:bold' : '') + '">'
+                          + smilify(data.players[puid]) + '</span></td>');
+
+            // Action that player has taken pertaining to the current game state
+            extra = '&nbsp;';
+            if (data.requiresAction[puid]) {
+                extra = '<img class="thinking" src="{{ display.Images.THINKING }}" title="Thinking" />';
+            } else if (data.state == {{ states.PLAY }}) {
+                extra = '<img src="{{ display.Images.CARD_BACK }}" title="Selected card" />';
+            } else if (data.state == {{ states.VOTE }}) {
+                extra = '<img src="{{ display.Images.VOTE_TOKEN }}" title="Voted" />';
             }
-
-            // Render hand if changed
-            if (data.player.handHash != handHash) {
-                handHash = data.player.handHash;
-                updateCards(data.player.hand, '#hand');
-                $('#handContainer').toggle(data.player.hand !== undefined);
+            scoreBoard.push('<td><div class="userAction">' + extra + '</div></td>');
+
+            // Spacers to order player by rank
+            scoreBoard.push('<td><div style="width:40px">&nbsp;</div></td>');
+            scoreBoard.push(Array(data.ranked[puid] + 1).join('<td>&nbsp;</td>'));
+
+            // Player's bunny piece and score
+            scoreBoard.push('<td class="bunnyPiece"><div style="background-color: #' + data.colours[puid]
+                          + '" title="' + textToHtml(data.players[puid]) + '"><img src="'
+                          + ((data.state == {{ states.BEGIN }} || data.state == {{ states.END }})
+                           ? '{{ display.Images.BUNNY_READY }}' : '{{ display.Images.BUNNY_RUN }}')
+                          + '" /></div></td>');
+            scoreBoard.push('<td class="score">' + data.scores[puid] + '</td>');
+
+            // Spacers to make every row have the same number of cells
+            scoreBoard.push(Array(maxRank - data.ranked[puid] + 1).join('<td>&nbsp;</td>'));
+
+            // Number of points accumulated this round
+            scoreBoard.push('<td class="lastScore">'
+                          + (data.round.scores[puid] ? '(+' + data.round.scores[puid] + ')' : '&nbsp;')
+                          + '</td>');
+
+            // Add trophy if winner
+            scoreBoard.push('<td>' + (isWinner ? smilify('(winner)') : '&nbsp;') + '</td>');
+
+            // Space the rest
+            scoreBoard.push('<td style="width:100%">&nbsp;</td>');
+            scoreBoard.push('</tr>');
+        });
+        $('#scoreBoard').html(scoreBoard.join('')).toggle(numPlayers > 0);
+        $('.kickPlayer').click(kickPlayer);  // since element was dynamically generated
+
+        // State-dependent display / options
+        if (!data.isPlayer) {
+            $('#gameState').html(observerMessages[data.state]);
+        } else if (data.requiresAction[data.user]) {
+            $('#gameState').html(actionMessages[data.state]);
+            if (!document.hasFocus()) {
+                document.title = ALERT_TITLE;
             }
+        } else {
+            $('#gameState').html(waitingMessages[data.state]);
+        }
+        $('#joinGame').toggle();
+        $('#startGame').toggle(data.state == {{ states.BEGIN }} && data.isHost
+                            && numPlayers >= {{ limits.min_players }});
+        $('#addBot').toggle(BOTS_ENABLE && data.state == {{ states.BEGIN }}
+                            && data.isHost && numPlayers < data.maxPlayers);
+
+        // Game configuration dependent stuff
+        $('#clueTextarea').attr('maxlength', data.maxClueLength);
+
+        // Current Clue
+        if (data.round.clue !== undefined) {
+            $('#clue').html('Clue: "' + smilify(data.round.clue) + '"').fadeIn();
+        } else {
+            $('#clue').hide();
+        }
 
-            // Render current cards if changed
-            if (data.round.cardsHash != cardsHash) {
-                cardsHash = data.round.cardsHash;
-                updateCards(data.round.cards, '#cards');
-
-                // Toggle hand for convenience
-                if (data.round.cards !== undefined && data.state != {{ states.CLUE }}) {
-                    setHandHidden();
-                } else if (data.round.cards === undefined && data.state == {{ states.PLAY }}
-                         && data.user != clueMaker) {
-                    setHandShown();
-                }
+        // Render hand if changed
+        if (data.player.handVersion !== handVersion) {
+            handVersion = data.player.handVersion;
+            updateCards(data.player.hand, '#hand');
+            $('#handContainer').toggle(data.player.hand !== undefined);
+        }
+
+        // Render current cards if changed
+        if (data.round.cardsVersion !== cardsVersion) {
+            cardsVersion = data.round.cardsVersion;
+            updateCards(data.round.cards, '#cards');
+
+            // Toggle hand for convenience
+            if (data.round.cards !== undefined && data.state != {{ states.CLUE }}) {
+                setHandHidden();
+            } else if (data.round.cards === undefined && data.state == {{ states.PLAY }}
+                     && data.user != clueMaker) {
+                setHandShown();
             }
+        }
 
-            // Render most recent votes if changed
-            if (data.round.votesHash != votesHash) {
-                votesHash = data.round.votesHash;
-                if (data.round.cards !== undefined) {
-                    $.each(data.round.votes, function(puid, cid) {
-                        var card = $('#' + cid);
-                        var randomLeft = Math.ceil(card.position().left + Math.random() * {{ display.Sizes.CARD_WIDTH - display.Sizes.TOKEN }});
-                        var randomTop = Math.ceil(card.offset().top + Math.random() * {{ display.Sizes.CARD_HEIGHT - display.Sizes.TOKEN }});
-                        card.append('<div class="token" title="' + textToHtml(data.players[puid])
-                                  + '" style="left:' + randomLeft + 'px;top:' + randomTop
-                                  + 'px;background-color:#' + data.colours[puid] + '">&nbsp;</div>');
-                    });
-                    $('.token').fadeIn();
-                    $.each(data.round.owners, function(puid, cid) {
-                        var card = $('#' + cid);
-                        card.css({'background-color' : '#' + data.colours[puid],
-                                  'border-color' : '#' + data.colours[puid]});
-                        if (puid != data.round.clueMaker) {
-                            card.find('.small').fadeTo(400, 0.1);
-                        }
-                        card.attr('title', data.players[puid]);
-                    });
-                }
+        // Render most recent votes if changed
+        if (data.round.votesVersion !== votesVersion) {
+            votesVersion = data.round.votesVersion;
+            if (data.round.cards !== undefined) {
+                $.each(data.round.votes, function(puid, cid) {
+                    var card = $('#' + cid);
+                    var randomLeft = Math.ceil(card.position().left + Math.random() * {{ display.Sizes.CARD_WIDTH - display.Sizes.TOKEN }});
+                    var randomTop = Math.ceil(card.offset().top + Math.random() * {{ display.Sizes.CARD_HEIGHT - display.Sizes.TOKEN }});
+                    card.append('<div class="token" title="' + textToHtml(data.players[puid])
+                              + '" style="left:' + randomLeft + 'px;top:' + randomTop
+                              + 'px;background-color:#' + data.colours[puid] + '">&nbsp;</div>');
+                });
+                $('.token').fadeIn();
+                $.each(data.round.owners, function(puid, cid) {
+                    var card = $('#' + cid);
+                    card.css({'background-color' : '#' + data.colours[puid],
+                              'border-color' : '#' + data.colours[puid]});
+                    if (puid != data.round.clueMaker) {
+                        card.find('.small').fadeTo(400, 0.1);
+                    }
+                    card.attr('title', data.players[puid]);
+                });
             }
+        }
 
-            // Bind/unbind state-dependent click handlers to all cards
-            if (data.state == {{ states.CLUE }} && clueMaker == data.user) {
-                $('#cards .card').unbind('click').removeClass('clickable');
-                $('#hand .card').click(setupActionFormHandler({{ commands.CREATE_CLUE }})).addClass('clickable');
-            } else if (data.state == {{ states.PLAY }} && data.requiresAction[data.user]) {
-                $('#cards .card').unbind('click').removeClass('clickable');
-                $('#hand .card').click(setupActionFormHandler({{ commands.PLAY_CARD }})).addClass('clickable');
-            } else if (data.state == {{ states.VOTE }} && data.requiresAction[data.user]) {
-                $('#hand .card').unbind('click').removeClass('clickable');
-                $('#cards .card').click(setupActionFormHandler({{ commands.CAST_VOTE }})).addClass('clickable');
-            } else {
-                $('.card').unbind('click').removeClass('clickable');
+        // Bind/unbind state-dependent click handlers to all cards
+        if (data.state == {{ states.CLUE }} && clueMaker == data.user) {
+            $('#cards .card').unbind('click').removeClass('clickable');
+            $('#hand .card').click(setupActionFormHandler({{ commands.CREATE_CLUE }})).addClass('clickable');
+        } else if (data.state == {{ states.PLAY }} && data.requiresAction[data.user]) {
+            $('#cards .card').unbind('click').removeClass('clickable');
+            $('#hand .card').click(setupActionFormHandler({{ commands.PLAY_CARD }})).addClass('clickable');
+        } else if (data.state == {{ states.VOTE }} && data.requiresAction[data.user]) {
+            $('#hand .card').unbind('click').removeClass('clickable');
+            $('#cards .card').click(setupActionFormHandler({{ commands.CAST_VOTE }})).addClass('clickable');
+        } else {
+            $('.card').unbind('click').removeClass('clickable');
+        }
+    };
+    var gameBoardWorker = function worker() {
+        if (document.hasFocus()) {
+            document.title = TITLE;
+        }
+        if (pushing || activeGame === undefined) {
+            return;
+        }
+        var stale = boardRequest;
+        boardRequest = undefined;
+        if (stale !== undefined) {
+            stale.abort();  // superseded, e.g., by switching games
+        }
+        var params = (board !== undefined ? 'base=' + board.rev + '&since=' + boardVersion : null);
+        var request = getJSONIfModified(commandUrl({{ commands.GET_BOARD }}, params), receiveGameBoard);
+        boardRequest = request;
+        request.done(function() {
+            if (boardRequest === request) {
+                boardRequest = undefined;
+                setTimeout(gameBoardWorker, 0);
+            }
+        }).fail(function() {
+            if (boardRequest === request) {
+                boardRequest = undefined;
+                setTimeout(gameBoardWorker, GAMEBOARD_INTERVAL);
             }
-        }).always(function() {
-            setTimeout(gameBoardWorker, GAMEBOARD_INTERVAL);
         });
     };
-    gameBoardWorker();
     function refreshGameBoard() {
-        setTimeout(gameBoardWorker, 0);
+        // Any outstanding long-poll (or push) happens once the board changes.
+        if (!pushing && boardRequest === undefined) {
+            setTimeout(gameBoardWorker, 0);
+        }
+    };
+    $(window).focus(function() {
+        document.title = TITLE;
+    });
+
+
+    // Push channel for all of the above, falling back to polling if it closes
+    function sendPush(request) {
+        if (pushSocket !== undefined) {
+            pushSocket.send(JSON.stringify(request));
+        }
+    };
+    function subscribeGameBoard() {
+        if (boardTopic !== undefined) {
+            sendPush({unsubscribe: boardTopic});
+            sendPush({unsubscribe: gameChatTopic});
+        }
+        boardTopic = (activeGame !== undefined ? '{{ topics.GAME_PREFIX }}' + activeGame : undefined);
+        gameChatTopic = (activeGame !== undefined ? '{{ topics.GAME_CHAT_PREFIX }}' + activeGame : undefined);
+        if (boardTopic !== undefined) {
+            sendPush({subscribe: boardTopic});
+            sendPush({subscribe: gameChatTopic, since: gameChatSeq});
+        }
+    };
+    function startPolling() {
+        pushing = false;
+        gameListWorker();
+        userListWorker();
+        chatRoomWorker();
+        gameBoardWorker();
     };
+    function startPushing() {
+        var url = (document.location.protocol == 'https:' ? 'wss://' : 'ws://') + document.location.host
+                + document.location.pathname.replace(/[^\/]*$/, '') + 'push';
+        var socket = new WebSocket(url);
+        socket.onopen = function() {
+            pushSocket = socket;
+            sendPush({subscribe: '{{ topics.GAMES }}', since: gamesVersion});
+            sendPush({subscribe: '{{ topics.USERS }}'});
+            sendPush({subscribe: '{{ topics.CHAT }}', since: lobbyChatSeq});
+            boardTopic = undefined;
+            subscribeGameBoard();
+        };
+        socket.onmessage = function(e) {
+            var message = JSON.parse(e.data);
+            if (message.topic == '{{ topics.GAMES }}') {
+                mergeGames(message.data);
+            } else if (message.topic == '{{ topics.USERS }}') {
+                userList = message.data;
+                userListReceived = Date.now();
+                renderUserList();
+            } else if (message.topic == '{{ topics.CHAT }}') {
+                renderChat(undefined, message.data);
+            } else if (message.topic == boardTopic) {
+                if (!receiveGameBoard(message.data)) {
+                    subscribeGameBoard();  // for the board in full
+                }
+            } else if (message.topic == gameChatTopic) {
+                renderChat(activeGame, message.data);
+            }
+        };
+        socket.onclose = function() {
+            pushSocket = undefined;
+            boardTopic = undefined;
+            startPolling();
+        };
+        setInterval(function() {
+            if (pushing) {
+                renderGameList();
+                renderUserList();
+            }
+        }, ACTIVITY_INTERVAL);
+    };
+    if (pushing) {
+        startPushing();
+    } else {
+        startPolling();
+    }
 
 
     // Change either the current cards or the user's hand
     function cardCell(card, hack) {
         return '<div class="card magnifier" id="' + card.cid + '" hack="' + hack + '">'
               + '<img class="small" src="' + card.url + '" />'
-              + '<div class="large" style="background-image:url(\'' + card.url + '\')"></div>'
+              + '<div class="large" style="background-image:url(\'' + (card.full || card.url) + '\')"></div>'
               + '</div>';
     }
     function updateCards(cards, containerId) {
@@ -423,12 +671,14 @@ $(document).ready(function() {
 
 
     // Game board communication
+    function commandUrl(cmd, params) {
+        return 'game/' + activeGame + '/' + cmd + (params ? '?' + params : '');
+    }
     function sendCommand(cmd, params, callback) {
         if (activeGame === undefined) {
             return;  // error
         }
-        return $.getJSON('game/' + activeGame + '/' + cmd + (params ? '?' + params : ''),
-                          callback);
+        return $.getJSON(commandUrl(cmd, params), callback);
     }
 
 
@@ -457,6 +707,14 @@ $(document).ready(function() {
         e.preventDefault();
     });
 
+    $('#addBot').submit(function(e) {
+        sendCommand({{ commands.ADD_BOT }}, null, function(data) {
+            refreshGameBoard();
+            refreshGameList();
+        });
+        e.preventDefault();
+    });
+
     function setupActionFormHandler(cmd) {
         return function(e) {
             // Handler for when a card is clicked; sets up the actionForm appropriately
@@ -560,8 +818,20 @@ $(document).ready(function() {
     function switchGame(gid) {
         activeGame = gid;
         document.location.hash = 'gid=' + gid;
+        boardVersion = undefined;
+        board = undefined;
+        handVersion = null;  // forces a redraw, as versions differ between games
+        cardsVersion = null;
+        votesVersion = null;
+        gameChatSeq = 0;
+        $('#gameChatLog').html('');
+        $('#gameChatTab').removeClass('unread').show();
         refreshGameList();
-        refreshGameBoard();
+        if (pushing) {
+            subscribeGameBoard();
+        } else {
+            setTimeout(gameBoardWorker, 0);  // abandons the long-poll of the old game
+        }
     };
 
 
@@ -0,0 +1,67 @@
+import pytest
+import tornado.ioloop
+
+from dixit.benchmarks.core import BENCHMARKS, measure
+import dixit.benchmarks.encoding as encoding
+import dixit.benchmarks.fanout as fanout
+import dixit.benchmarks.restore as restore
+from dixit.benchmarks.memory import bytes_per_game, bytes_per_user
+from dixit.benchmarks.startup import run
+
+
+@pytest.mark.parametrize("benchmark", BENCHMARKS, ids=lambda b: b.name)
+def test_core_benchmarks(benchmark):
+    """Tests that every core benchmark runs at the smallest and largest tables."""
+    for players in (3, 6):
+        result = measure(benchmark, players, 84, repeat=1, min_time=0)
+        assert result["number"] == 1 and result["best"] > 0
+
+
+def test_memory_benchmark():
+    """Tests that the memory benchmark measures users and games."""
+    assert 0 < bytes_per_user(100) < bytes_per_game(10, 6, 84)
+
+
+def test_startup_benchmark():
+    """Tests that the startup benchmark times every phase of a new process."""
+    report = run(repeat=2, cards=10)
+    assert 0 < report["import"] < report["process"]
+    assert report["application"] > 0 and report["firstRequest"] > 0
+
+
+def test_restore_benchmark():
+    """Tests that the restore benchmark restores every game it journaled."""
+    report = restore.run(20, 10, repeat=1)
+    assert report["restoredGames"] == 20 and report["journaledGames"] == 10
+    assert report["journalEntries"] == 10 * restore.ENTRIES_PER_GAME
+    assert report["snapshotBytes"] > 0 and report["seconds"] > 0
+
+
+def test_encoding_benchmark():
+    """Tests that the encoding benchmark measures every payload and encoding."""
+    report = encoding.run(3, games=2, users=3, messages=2, repeat=1, min_time=0)
+    results = dict(
+        ((r["payload"], r["encoding"]), r["bytes"]) for r in report["results"]
+    )
+    assert results["board.vote", "json"] < results["board.vote", "tornado"]
+    assert results["game_list", "json+gzip"] < results["game_list", "json"]
+
+
+def test_bots_benchmark():
+    """Tests that the bots benchmark times a player while the bots play."""
+    pytest.importorskip("numpy")
+    import dixit.benchmarks.bots as bots
+
+    report = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: bots.run(40, 0.3, min_delay=0, max_delay=0)
+    )
+    assert report["bots"] == 40 and report["actionsPerSecond"] > 0
+    assert 0 < report["maxActionsPerTick"] <= 50
+    assert report["playing"]["p50"] > 0 and report["tick"]["max"] > 0
+
+
+def test_fanout_benchmark():
+    """Tests that the fan-out benchmark encodes one board per update."""
+    report = tornado.ioloop.IOLoop.current().run_sync(lambda: fanout.run(5, 3))
+    assert report["encodedPerUpdate"] == 1
+    assert 0 < report["serverSecondsPerUpdate"] < report["secondsPerUpdate"]
@@ -0,0 +1,143 @@
+import json
+import os
+import random
+import tempfile
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from dixit.benchmarks.core import make_card_sets
+from dixit.bots import Policy, is_bot
+from dixit.codes import Codes
+from dixit.core import States
+from dixit.server import Commands, load_settings, make_application
+from dixit.similarity import COLOURS, SimilarityIndex, build_index, load_index
+
+from tornado.testing import AsyncHTTPTestCase
+
+
+def _make_folder(path, cards):
+    os.mkdir(path)
+    for i in range(cards):
+        with open(os.path.join(path, "%d.jpg" % i), "w") as card_file:
+            card_file.write(str(i))  # such that each has its own content hash
+
+
+def _one_hot(*colours):
+    vector = np.zeros(len(COLOURS), dtype=np.float32)
+    for colour in colours:
+        vector[COLOURS.index(colour)] = 1
+    return vector / np.linalg.norm(vector)
+
+
+def test_build_index():
+    """Tests that the index is memory-mapped, and only describes new cards."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folder = os.path.join(tmpdir, "cards")
+        _make_folder(folder, 10)
+        cache = os.path.join(tmpdir, "cache")
+        card_sets_config = {"Test": [folder, True]}
+        features = build_index(card_sets_config, cache)
+        assert isinstance(features, np.memmap)
+        assert features.shape == (10, len(COLOURS))
+        assert np.allclose(np.linalg.norm(features, axis=1), 1)
+
+        hashes, _ = load_index(cache)
+        with open(os.path.join(folder, "new.jpg"), "w") as card_file:
+            card_file.write("new")
+        os.utime(folder, ns=(0, 0))  # such that the manifest is rescanned
+        rebuilt = build_index(card_sets_config, cache)
+        assert load_index(cache)[0][:10] == hashes
+        assert np.array_equal(rebuilt[:10], features)
+        assert len(rebuilt) == 11
+
+
+def test_similarity():
+    """Tests that clues and cards are compared by the colours they evoke."""
+    card_sets = make_card_sets(3)
+    cards = list(card_sets[0])
+    features = np.stack(
+        [_one_hot("dark", "green"), _one_hot("blue"), _one_hot("blue", "light")]
+    )
+    index = SimilarityIndex(features, card_sets)
+    assert np.argmax(index.match("A dark forest", cards)) == 0
+    assert np.argmax(index.match("Under the sea", cards)) == 1
+    assert not index.match("nothing to see here", cards).any()
+    assert index.similarity(cards, cards)[1, 2] > index.similarity(cards, cards)[0, 1]
+
+    clue = index.make_clue(cards[0], random.Random(0))
+    assert np.argmax(index.match(clue, cards)) == 0
+    clue = index.make_clue(cards[0], random.Random(0), min_length=30, max_length=32)
+    assert 30 <= len(clue) <= 32
+    policy = Policy(index, random.Random(0))
+    clue, card = policy.choose_clue(cards)
+    assert card is cards[0]  # the least like the others
+    assert policy.choose_card(cards[1:], "snow") is cards[2]
+
+
+class TestBots(AsyncHTTPTestCase):
+    """Tests for seating server-side bots, who then play by themselves."""
+
+    def get_app(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        folder = os.path.join(self.tmpdir.name, "cards")
+        _make_folder(folder, 40)
+        settings = load_settings()
+        bots_config = dict(settings["bots"], min_delay=0, max_delay=0)
+        return make_application(
+            settings,
+            card_sets={"Test": [folder, True]},
+            card_cache=os.path.join(self.tmpdir.name, "cache"),
+            bots=bots_config,
+        )
+
+    def tearDown(self):
+        super(TestBots, self).tearDown()
+        self.tmpdir.cleanup()
+
+    def test_bots(self):
+        """Tests that a table of bots plays a whole game."""
+        response = self.fetch("/")
+        headers = {"Cookie": response.headers["Set-Cookie"].split(";")[0]}
+        body = "card_sets=0&name=Bots&max_score=&max_players=3&max_clue_length=99"
+        self._app.limits.min_clue_length = 40  # longer than the clues of two words
+        gid = int(self.fetch("/create", method="POST", body=body, headers=headers).body)
+        url = "/game/%d/%d" % (gid, Commands.ADD_BOT)
+        for _ in range(3):
+            assert self.fetch(url, headers=headers).code == 200
+        response = self.fetch(url, headers=headers)
+        assert json.loads(response.body) == {"code": Codes.JOIN_FULL_ROOM}
+
+        game = self._app.get_game(gid)
+        assert all(map(is_bot, game.players))
+        bots = self._app.bots
+        bots.tick()
+        assert not bots.due and not bots.actions  # until the game starts
+
+        self.fetch("/game/%d/%d" % (gid, Commands.START_GAME), headers=headers)
+        users = len(self._app.users)
+        response = self.fetch(url, headers=headers)
+        assert json.loads(response.body) == {"code": Codes.BEGIN_BAD_STATE}
+        assert len(self._app.users) == users  # without a bot left behind
+        for _ in range(1000):
+            if game.state == States.END:
+                break
+            bots.tick()
+        assert game.state == States.END and not bots.due
+        assert bots.actions == len(game.events.clues) * 5  # a clue, 2 plays, 2 votes
+        assert all(40 <= len(clue) <= 99 for clue in game.events.clues)
+        assert game.round.number > 1 and any(p.score for p in game.players.values())
+
+        response = self.fetch("/metrics")
+        assert b"dixit_bot_actions_total %d" % bots.actions in response.body
+
+    def test_only_host(self):
+        """Tests that only the host of a game may seat bots in it."""
+        headers = {"Cookie": self.fetch("/").headers["Set-Cookie"].split(";")[0]}
+        other = {"Cookie": self.fetch("/").headers["Set-Cookie"].split(";")[0]}
+        body = "card_sets=0&name=Bots&max_score=&max_players=3&max_clue_length=99"
+        gid = int(self.fetch("/create", method="POST", body=body, headers=headers).body)
+        response = self.fetch("/game/%d/%d" % (gid, Commands.ADD_BOT), headers=other)
+        assert json.loads(response.body) == {"code": Codes.ILLEGAL_RANGE}
+        assert not self._app.get_game(gid).players
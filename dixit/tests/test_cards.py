@@ -0,0 +1,90 @@
+import os
+import tempfile
+
+import pytest
+from tornado.testing import AsyncHTTPTestCase
+
+import dixit.cards as cards
+from dixit.cards import build_manifest
+from dixit.server import load_settings, make_application
+
+
+def _write(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_manifest(tmp_path, monkeypatch):
+    """Tests that manifests are reused until the folder changes."""
+    monkeypatch.setattr(cards, "Image", None)
+    folder = tmp_path / "cards"
+    folder.mkdir()
+    _write(folder / "b.jpg", b"bee")
+    _write(folder / "a.png", b"ant")
+    _write(folder / "notes.txt", b"not a card")
+    cache = str(tmp_path / "cache")
+
+    manifest = build_manifest(str(folder), cache)
+    assert [image["name"] for image in manifest.images] == ["a.png", "b.jpg"]
+    urls, full_urls = manifest.urls()
+    assert urls == full_urls
+    assert urls[0] == "cards/%s.png" % cards.hash_file(str(folder / "a.png"))
+    files = manifest.files()
+    assert sorted(files.values()) == [str(folder / "a.png"), str(folder / "b.jpg")]
+
+    def fail(*args):
+        raise AssertionError("scanned an unchanged folder")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "listdir", fail)
+        assert build_manifest(str(folder), cache).images == manifest.images
+
+    # Only the new image is hashed, when the folder changes
+    _write(folder / "c.jpg", b"cat")
+    hashed = []
+    monkeypatch.setattr(cards, "hash_file", lambda path: hashed.append(path) or "0")
+    os.utime(str(folder), ns=(0, 0))  # in case the clock is coarse
+    manifest = build_manifest(str(folder), cache)
+    assert len(manifest.images) == 3 and hashed == [str(folder / "c.jpg")]
+
+
+def test_thumbnails(tmp_path):
+    """Tests that thumbnails are written at the display size, if Pillow is."""
+    Image = pytest.importorskip("PIL.Image")
+    folder = tmp_path / "cards"
+    folder.mkdir()
+    Image.new("RGB", (500, 760), "red").save(str(folder / "red.png"))
+
+    manifest = build_manifest(str(folder), str(tmp_path / "cache"))
+    urls, full_urls = manifest.urls()
+    assert urls[0].endswith(".250x380.jpg") and full_urls[0].endswith(".png")
+    thumbnail = manifest.files()[urls[0].split("/")[-1]]
+    with Image.open(thumbnail) as image:
+        assert image.size == cards.THUMBNAIL_SIZE
+
+
+class TestCardHandler(AsyncHTTPTestCase):
+    """Tests for serving content-addressed card images."""
+
+    def get_app(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        folder = os.path.join(self.tmpdir.name, "cards")
+        os.mkdir(folder)
+        _write(os.path.join(folder, "owl.jpg"), b"hoot")
+        return make_application(
+            card_sets={"Owls": [folder, True]},
+            card_cache=os.path.join(self.tmpdir.name, "cache"),
+        )
+
+    def tearDown(self):
+        super(TestCardHandler, self).tearDown()
+        self.tmpdir.cleanup()
+
+    def test_card(self):
+        """Tests that the cards' full images are cached forever."""
+        card = self._app.card_sets[0].cards[0]
+        response = self.fetch("/" + card.full_url)
+        assert response.body == b"hoot"
+        assert "immutable" in response.headers["Cache-Control"]
+        assert self.fetch("/cards/owl.jpg").code == 404
+        assert self.fetch("/cards/..%2Fconfig.json").code == 404
@@ -0,0 +1,21 @@
+from dixit.chat import ChatLog
+
+
+def test_dump_since():
+    """Tests catching up on a chat log that has wrapped around."""
+    chat_log = ChatLog(max_history=4)
+    assert chat_log.dump_since(0) == []
+    for i in range(6):
+        chat_log.add("user", str(i))
+    assert [m["mid"] for m in chat_log.dump_since(0)] == [3, 4, 5, 6]
+    assert [m["msg"] for m in chat_log.dump_since(4)] == ["4", "5"]
+    assert chat_log.dump_since(6) == []
+    assert len(chat_log.dump_since(7)) == 4  # e.g., from before a restart
+
+
+def test_dump_since_negative():
+    """Tests that a negative seq is treated as if nothing had been seen."""
+    chat_log = ChatLog(max_history=4)
+    chat_log.add("user", "hello")
+    assert chat_log.dump_since(-1) == chat_log.dump_since(0)
+    assert [m["msg"] for m in chat_log.dump_since(-5)] == ["hello"]
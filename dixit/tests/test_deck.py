@@ -0,0 +1,35 @@
+import pickle
+import random
+
+import pytest
+
+from dixit.deck import CATALOGUE, CardSet, Deck
+
+
+def test_catalogue():
+    """Tests that decks share the cards of the catalogue, even when unpickled."""
+    animals = CardSet("Test Animals", ["cat.jpg", "dog.jpg", "owl.jpg"])
+    plants = CardSet("Test Plants", ["fern.jpg"])
+    assert CardSet("Test Animals", ["cat.jpg", "dog.jpg", "owl.jpg"]).cards == (
+        animals.cards
+    )
+
+    deck = Deck([animals], rng=random.Random(0))
+    assert deck.cards.itemsize == 2 and sorted(deck.cards) == list(animals.indices)
+    card = deck.deal()
+    assert deck.get_card(card.cid) is CATALOGUE[card.index] is card
+    with pytest.raises(KeyError):
+        deck.get_card(plants.cards[0].cid)
+
+    deck, hand = pickle.loads(pickle.dumps((deck, [card])))
+    assert hand[0] is card and deck.left() == 2
+
+
+def test_catalogue_urls():
+    """Tests that a card set loaded again with other urls keeps its cards."""
+    cards = CardSet("Test Moved", ["a/cat.jpg", "a/dog.jpg"]).cards
+    size = len(CATALOGUE.cards)
+    moved = CardSet("Test Moved", ["b/cat.jpg", "b/dog.jpg"], full_paths=["c", "d"])
+    assert moved.cards == cards and len(CATALOGUE.cards) == size
+    assert CATALOGUE.get_card(cards[0].cid) is cards[0]
+    assert cards[0].to_json() == {"cid": cards[0].cid, "url": "b/cat.jpg", "full": "c"}
@@ -0,0 +1,159 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from dixit.core import States
+from dixit.display import BunnyPalette
+from dixit.server import load_settings, make_application
+import dixit.views as views
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+
+class TestJournal(AsyncHTTPTestCase):
+    """Tests for restoring the server state from a snapshot and journal."""
+
+    def get_app(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        card_dir = os.path.join(self.tmpdir.name, "cards")
+        os.mkdir(card_dir)
+        for i in range(40):
+            open(os.path.join(card_dir, "%d.jpg" % i), "w").close()
+        settings = load_settings()
+        self.settings = dict(
+            settings,
+            card_sets={"Test": [card_dir, True]},
+            journal=dict(settings["journal"], directory=self.tmpdir.name),
+        )
+        app = make_application(self.settings)
+        app.journal.restore()
+        return app
+
+    def tearDown(self):
+        super(TestJournal, self).tearDown()
+        self.tmpdir.cleanup()
+
+    async def _fetch(self, uid, url, body=None):
+        response = await self.http_client.fetch(
+            self.get_url(url),
+            method="GET" if body is None else "POST",
+            body=body,
+            headers={"Cookie": "dixit_user=%s" % uid} if uid else {},
+        )
+        return response.body
+
+    async def _new_uid(self):
+        response = await self.http_client.fetch(self.get_url("/"))
+        return response.headers["Set-Cookie"].split(";")[0].split("=")[1]
+
+    @gen_test
+    async def test_restore(self):
+        """Tests that a restart restores a game in progress, and its chat."""
+        app = self._app
+        uids = [await self._new_uid() for _ in range(3)]
+        await self._fetch(uids[0], "/setusername", "username=Host")
+        body = "card_sets=0&name=Journal&max_score=&max_players=6&max_clue_length=99"
+        gid = int(await self._fetch(uids[0], "/create", body))
+        colours = (BunnyPalette.RED, BunnyPalette.BLUE, BunnyPalette.GREEN)
+        for uid, colour in zip(uids, colours):
+            await self._fetch(uid, "/game/%d/1?colour=%s" % (gid, colour))
+        await self._fetch(uids[0], "/game/%d/2" % gid)
+
+        await app.journal.snapshot()  # the rest is replayed from the journal
+
+        game = app.get_game(gid)
+        clue_maker = game.clue_maker()
+        cid = game.players[clue_maker].hand[0].cid
+        await self._fetch(clue_maker.uid, "/game/%d/3?clue=hello&cid=%s" % (gid, cid))
+        for uid in uids:
+            user = app.users.get_user(uid)
+            if user != clue_maker:
+                cid = game.players[user].hand[-1].cid
+                await self._fetch(uid, "/game/%d/4?cid=%s" % (gid, cid))
+        await self._fetch(uids[1], "/chat?room=%d" % gid, "msg=good+luck")
+        await app.journal.flush()
+
+        restored = make_application(self.settings)
+        restored.journal.restore()
+        restored_game = restored.get_game(gid)
+        assert restored_game.state == game.state == States.VOTE
+        assert views.public_board(restored, restored_game) == views.public_board(
+            app, game
+        )
+        for uid in uids:
+            assert views.private_board(
+                restored.users.get_user(uid), restored_game
+            ) == views.private_board(app.users.get_user(uid), game)
+        assert restored.users.get_user(uids[0]).name == "Host"
+        assert restored.get_chat_log(gid).dump_since(0) == (
+            app.get_chat_log(gid).dump_since(0)
+        )
+
+    @gen_test
+    async def test_restore_seated(self):
+        """Tests that a game created with its seats taken is restored as such."""
+        app = self._app
+        users = [app.users.get_user(await self._new_uid()) for _ in range(3)]
+        colours = (BunnyPalette.RED, BunnyPalette.BLUE, BunnyPalette.RED)
+        gid, errors = app.create_game(
+            users[0], [0], "", "Seated", 6, 10, 99, list(zip(users, colours))
+        )
+        assert list(errors) == [users[2]]
+        await app.journal.flush()
+
+        restored = make_application(self.settings)
+        restored.journal.restore()
+        restored_game = restored.get_game(gid)
+        assert views.public_board(restored, restored_game) == views.public_board(
+            app, app.get_game(gid)
+        )
+        assert restored_game.version == app.get_game(gid).version
+
+    @gen_test
+    async def test_restore_process(self):
+        """Tests that a new process, with no cards loaded yet, restores a game."""
+        app = self._app
+        uids = [await self._new_uid() for _ in range(3)]
+        body = "card_sets=0&name=Restart&max_score=&max_players=6&max_clue_length=99"
+        gid = int(await self._fetch(uids[0], "/create", body))
+        colours = (BunnyPalette.RED, BunnyPalette.BLUE, BunnyPalette.GREEN)
+        for uid, colour in zip(uids, colours):
+            await self._fetch(uid, "/game/%d/1?colour=%s" % (gid, colour))
+        await self._fetch(uids[0], "/game/%d/2" % gid)
+        await app.journal.snapshot()  # of the hands, which pickle by card id
+        await self._fetch(uids[1], "/chat?room=%d" % gid, "msg=again")
+        await app.journal.flush()
+
+        script = (
+            "import json, sys; from dixit.server import make_application; "
+            "from dixit.views import public_board; "
+            "app = make_application(json.loads(sys.argv[1])); app.journal.restore(); "
+            "print(json.dumps(public_board(app, app.get_game(int(sys.argv[2])))))"
+        )
+        output = subprocess.check_output(
+            [sys.executable, "-c", script, json.dumps(self.settings), str(gid)],
+            text=True,
+        )
+        game = app.get_game(gid)
+        assert game.state == States.CLUE
+        assert json.loads(output) == json.loads(
+            json.dumps(views.public_board(app, game))
+        )
+
+    @gen_test
+    async def test_snapshot_entries(self):
+        """Tests that a snapshot is taken once snapshot_entries were recorded."""
+        app = self._app
+        app.journal.snapshot_entries = 3
+        for _ in range(4):
+            await self._new_uid()
+        await app.journal.flush()
+
+        assert os.path.exists(app.journal.snapshot_path)
+        assert app.journal.entries <= 1  # the last one, unless it was snapshotted
+        restored = make_application(self.settings)
+        restored.journal.restore()
+        assert len(restored.users) == len(app.users) == 4
+        assert restored.journal.entries == app.journal.entries
@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from dixit.benchmarks.loadgen import LoadGenerator
+from dixit.server import load_settings, make_application
+
+
+class TestLoadGenerator(AsyncHTTPTestCase):
+    """Smoke test for the load generator, against an in-process server."""
+
+    def get_app(self):
+        self.card_dir = tempfile.TemporaryDirectory()
+        for i in range(50):
+            open(os.path.join(self.card_dir.name, "%d.jpg" % i), "w").close()
+        card_sets = {"Load": [self.card_dir.name, True]}
+        card_cache = os.path.join(self.card_dir.name, "cache")
+        return make_application(
+            card_sets=card_sets,
+            card_cache=card_cache,
+            rate_limits=dict(load_settings()["rate_limits"], enable=False),
+        )
+
+    def tearDown(self):
+        super(TestLoadGenerator, self).tearDown()
+        self.card_dir.cleanup()
+
+    @gen_test(timeout=30)
+    async def test_games(self):
+        """Tests that bots play entire games without any errors."""
+        loadgen = LoadGenerator(self.get_url(""), 1, 3, 3, 0, 3)
+        report = await loadgen.run()
+        assert report["gamesFinished"] >= 1
+        assert report["errors"] == {}
+        for name in ("CREATE_CLUE", "PLAY_CARD", "CAST_VOTE", "KICK_PLAYER"):
+            assert report["endpoints"][name]["count"] >= 1
@@ -0,0 +1,69 @@
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+
+from dixit.codes import Codes
+from dixit.ratelimit import RateLimiter
+from dixit.server import load_settings, make_application
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _make_limiter(clock, max_buckets=100):
+    config = {
+        "enable": True,
+        "max_buckets": max_buckets,
+        "ip": {"read": [10, 4]},
+        "uid": {"read": [1, 2]},
+    }
+    return RateLimiter(config, clock=clock)
+
+
+def test_token_bucket():
+    """Tests that buckets allow a burst, and then refill at their rate."""
+    clock = Clock()
+    limiter = _make_limiter(clock)
+    assert [limiter.admit("read", "ip", "uid") for _ in range(3)] == [0, 0, 1]
+    assert limiter.admit("read", "ip") == 0  # unknown users only take from the IP
+    assert limiter.admit("read", "ip") == 0.1  # the IP's burst is spent
+    assert limiter.admit("write", "ip", "uid") == 0  # unlimited
+    assert limiter.limited == {("uid", "read"): 1, ("ip", "read"): 1}
+
+    clock.now += 1
+    assert limiter.admit("read", "ip", "uid") == 0
+    assert limiter.admit("read", "ip", "uid") > 0
+
+
+def test_eviction():
+    """Tests that the least recently used buckets are evicted, as if full."""
+    clock = Clock()
+    limiter = _make_limiter(clock, max_buckets=2)
+    for ip in ("a", "a", "a", "a", "b", "c"):
+        limiter.admit("read", ip)
+    assert list(limiter.buckets) == [("ip", "read", "b"), ("ip", "read", "c")]
+    assert limiter.admit("read", "a") == 0
+
+
+class TestRateLimits(AsyncHTTPTestCase):
+    """Tests for refusing requests over budget, before they make users."""
+
+    def get_app(self):
+        rate_limits = load_settings()["rate_limits"]
+        rate_limits["ip"]["new_user"] = [0.01, 2]
+        return make_application(rate_limits=rate_limits)
+
+    def test_new_users(self):
+        """Tests that an IP can only make so many users in a burst."""
+        for _ in range(2):
+            assert self.fetch("/getgames").code == 200
+        response = self.fetch("/getgames")
+        assert response.code == 429 and int(response.headers["Retry-After"]) > 0
+        assert json.loads(response.body) == {"code": Codes.RATE_LIMITED}
+        assert "Set-Cookie" not in response.headers
+        assert len(self._app.users.users) == 2
@@ -0,0 +1,55 @@
+import json
+import random
+
+import pytest
+
+from dixit.benchmarks.core import (
+    advance,
+    make_card_sets,
+    make_context,
+    make_game,
+    make_users,
+    play_game,
+)
+from dixit.core import States
+from dixit.events import Events
+from dixit.replay import ReplayError, describe, dump, replay, summarize
+
+
+def _played_game(players=4):
+    context = make_context()
+    users = make_users(context, players)
+    game = make_game(context, make_card_sets(84), users, seed=7)
+    play_game(game, random.Random(0))
+    return game
+
+
+def test_replay():
+    """Tests that a dumped game replays to the same state, at any event."""
+    game = _played_game()
+    log = json.loads(json.dumps(dump(game)))
+    assert summarize(replay(log)) == summarize(game)
+    assert len(describe(log)) == len(game.events)
+
+    data = log["events"]
+    events = [data[i] for i in range(0, len(data), 4)]
+    scored = events.index(Events.SCORE)  # after the last vote of round 1
+    replayed = replay(log, scored - 1)
+    assert replayed.state == States.VOTE and replayed.round.number == 1
+    replayed = replay(log, scored)
+    assert replayed.state == States.CLUE and any(replayed.round.scores)
+
+    clue = events.index(Events.CLUE)
+    replayed = replay(log, clue)
+    assert replayed.state == States.CLUE and replayed.deck.dealt == 4 * 6
+
+
+def test_replay_diverged():
+    """Tests that a replay fails if its outcomes differ from those recorded."""
+    context = make_context()
+    game = make_game(context, make_card_sets(84), make_users(context, 3))
+    log = dump(advance(game, States.PLAY))
+    log["events"][-2] = (log["events"][-2] + 1) % 84  # the card last dealt
+    with pytest.raises(ReplayError):
+        replay(log)
+    replay(log, check=False)
@@ -1,13 +1,29 @@
-from dixit.server import application
+import gzip
+import json
+import subprocess
+import sys
 
-from tornado.testing import AsyncHTTPTestCase
+from dixit.codes import Codes
+from dixit.core import Game
+from dixit.display import BunnyPalette
+from dixit.pubsub import Topics
+from dixit.reaper import Reaper
+from dixit.server import load_settings, make_application
+from dixit.utils import INFINITY, accepts_gzip, hash_obj
+from dixit.views import apply_merge_patch
+import dixit.serializers as serializers
+
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+from tornado.testing import AsyncHTTPTestCase, ExpectLog, gen_test
+from tornado.websocket import websocket_connect
 
 
 class TestDixitServer(AsyncHTTPTestCase):
     """Basic smoke tests for the Dixit server."""
 
     def get_app(self):
-        return application
+        return make_application()
 
     def test_homepage(self):
         """Tests that the server can start and deliver the home page."""
@@ -18,4 +34,514 @@ class TestDixitServer(AsyncHTTPTestCase):
         assert b"<title>Dixit</title>" in response.body
 
         # There should be exactly 1 active user afterwards
-        assert len(application.users.users) == 1
+        assert len(self._app.users.users) == 1
+
+
+class TestAssets(AsyncHTTPTestCase):
+    """Tests for serving the rendered scripts and styles."""
+
+    def get_app(self):
+        return make_application()
+
+    def test_assets(self):
+        """Tests that the page links the fingerprinted, precompressed assets."""
+        page = self.fetch("/").body.decode("utf-8")
+        for name, asset in self._app.assets.items():
+            assert '"%s"' % asset.url in page and '"%s"' % name not in page
+
+            response = self.fetch(
+                "/" + asset.url,
+                headers={"Accept-Encoding": "gzip"},
+                decompress_response=False,
+            )
+            assert response.headers["Content-Encoding"] == "gzip"
+            assert "immutable" in response.headers["Cache-Control"]
+            assert gzip.decompress(response.body) == asset.body
+
+            response = self.fetch("/" + name, headers={"Accept-Encoding": ""})
+            assert response.headers["Cache-Control"] == "no-cache"
+            assert response.body == asset.body
+            etag = response.headers["Etag"]
+            headers = {"Accept-Encoding": "", "If-None-Match": etag}
+            response = self.fetch("/" + name, headers=headers)
+            assert response.code == 304
+
+        assert self.fetch("/main.0123456789abcdef.js").code == 404
+
+
+class TestEncoding(AsyncHTTPTestCase):
+    """Tests for negotiating the encoding of API responses."""
+
+    def get_app(self):
+        return make_application(api_encoding={"gzip_min_bytes": 100, "gzip_level": 6})
+
+    def test_encoding(self):
+        """Tests that JSON is gzipped for clients that accept it, if large."""
+        for i in range(10):
+            self._app.users.add_user("uid%d" % i, "puid%d" % i)
+        response = self.fetch(
+            "/getusers", headers={"Accept-Encoding": ""}, decompress_response=False
+        )
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["Content-Type"].startswith("application/json")
+        assert "Accept-Encoding" in response.headers["Vary"]
+        users = json.loads(response.body)
+        assert len(users) == 11  # and the client's own
+
+        headers = {
+            "Accept-Encoding": "gzip",
+            "Accept": "text/html, */*",
+            "Cookie": response.headers["Set-Cookie"].split(";")[0],
+        }
+        response = self.fetch("/getusers", headers=headers, decompress_response=False)
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(response.body)) == users
+
+        # Each encoding has its own ETag, and a small response is not gzipped
+        etag = response.headers["Etag"]
+        response = self.fetch("/chat", headers=headers, decompress_response=False)
+        assert "Content-Encoding" not in response.headers
+        headers["If-None-Match"] = etag
+        response = self.fetch("/getusers", headers=headers)
+        assert response.code == 304
+        headers["Accept-Encoding"] = ""
+        response = self.fetch("/getusers", headers=headers, decompress_response=False)
+        assert response.code == 200 and json.loads(response.body) == users
+        headers["Accept-Encoding"] = "gzip;q=0, identity"
+        response = self.fetch("/getusers", headers=headers, decompress_response=False)
+        assert "Content-Encoding" not in response.headers
+
+    def test_accepts_gzip(self):
+        """Tests that gzip is only accepted with a quality value above zero."""
+        assert accepts_gzip("gzip, deflate, br") and accepts_gzip("br;q=1, gzip;q=0.5")
+        assert accepts_gzip("*") and accepts_gzip("x-gzip")
+        assert not accepts_gzip("") and not accepts_gzip("identity")
+        assert not accepts_gzip("gzip;q=0") and not accepts_gzip("gzip; q=0.0, *")
+        assert not accepts_gzip("*;q=0") and not accepts_gzip("gzip;q=x")
+
+    def test_negotiate(self):
+        """Tests that clients only get MessagePack if they ask for it."""
+        assert serializers.negotiate(None) is serializers.JSON
+        assert serializers.negotiate("text/html, */*; q=0.8") is serializers.JSON
+        msgpack = serializers.negotiate("application/x-msgpack, application/json")
+        if serializers.msgpack is None:
+            assert msgpack is serializers.JSON
+        else:
+            assert msgpack.content_type == "application/x-msgpack"
+        assert serializers.JSON.dumps(["</script>"]) == b'["<\\/script>"]'
+
+
+class TestGameBoard(AsyncHTTPTestCase):
+    """Tests for retrieving the game board."""
+
+    def get_app(self):
+        return make_application()
+
+    def _make_game(self):
+        host = self._app.users.add_user("host-uid", "host-puid")
+        game = Game(
+            host,
+            self._app.card_sets,
+            "",
+            "Test Game",
+            6,
+            INFINITY,
+            100,
+            self._app.limits,
+        )
+        return self._app.add_game(game), game
+
+    @gen_test
+    async def test_long_poll(self):
+        """Tests that a board request with ?since= waits for the next change."""
+        gid, game = self._make_game()
+        url = self.get_url("/game/%d/0?since=%d" % (gid, game.version))
+        future = self.http_client.fetch(url)
+        await gen.sleep(0.05)
+        assert not future.done()
+
+        game.add_player(game.host, BunnyPalette.RED)
+        response = await future
+        assert json.loads(response.body)["version"] == game.version
+
+        # An out-of-date version is answered immediately
+        url = self.get_url("/game/%d/0?since=%d" % (gid, game.version - 1))
+        response = await self.http_client.fetch(url)
+        assert json.loads(response.body)["players"] == {"host-puid": game.host.name}
+
+    def test_board_patches(self):
+        """Tests that patches of recent revisions bring a board up to date."""
+        gid, game = self._make_game()
+        url = "/game/%d/0" % gid
+        headers = {"Cookie": "dixit_user=host-uid"}
+        board = json.loads(self.fetch(url, headers=headers).body)
+        game.add_player(game.host, BunnyPalette.RED)
+        guest = self._app.users.add_user("guest-uid", "guest-puid")
+        game.add_player(guest, BunnyPalette.BLUE)
+
+        response = self.fetch(url + "?base=" + board["rev"], headers=headers)
+        patch = json.loads(response.body)
+        assert patch.pop("patchOf") == board["rev"]
+        apply_merge_patch(board, patch)
+        assert board == json.loads(self.fetch(url, headers=headers).body)
+
+        self._app.users.set_name(guest, "renamed")
+        response = self.fetch(url + "?base=" + board["rev"], headers=headers)
+        assert len(response.body) < 100
+        apply_merge_patch(board, json.loads(response.body))
+        assert board["players"]["guest-puid"] == "renamed"
+
+        # Spectators are sent no more than the changes either
+        self._app.users.add_user("viewer-uid", "viewer-puid")
+        headers = {"Cookie": "dixit_user=viewer-uid"}
+        board = json.loads(self.fetch(url, headers=headers).body)
+        game.kick_player(guest)
+        response = self.fetch(url + "?base=" + board["rev"], headers=headers)
+        patch = json.loads(response.body)
+        assert "user" not in patch and patch["players"] == {"guest-puid": None}
+
+        response = self.fetch(url + "?base=0.0", headers=headers)  # forgotten
+        assert "patchOf" not in json.loads(response.body)
+
+    def test_board_cache(self):
+        """Tests that viewers share the public board until the game changes."""
+        _, game = self._make_game()
+        viewer = self._app.users.add_user("viewer-uid", "viewer-puid")
+        public, private = self._app.board_cache.get(self._app, game.host, game)
+        assert self._app.board_cache.get(self._app, viewer, game)[0] is public
+        assert private["isHost"] and not private["isPlayer"]
+
+        game.add_player(game.host, BunnyPalette.RED)
+        public, private = self._app.board_cache.get(self._app, game.host, game)
+        assert public["players"] == {"host-puid": game.host.name}
+        assert private["isPlayer"]
+
+        # Only the game's own players change its board, not anyone else
+        self._app.users.set_name(viewer, "renamed")
+        assert self._app.board_cache.get(self._app, game.host, game)[0] is public
+        self._app.users.set_name(game.host, "renamed")
+        public = self._app.board_cache.get(self._app, game.host, game)[0]
+        assert public["players"] == {"host-puid": "renamed"}
+
+    def test_not_modified(self):
+        """Tests that unchanged boards are answered with 304 Not Modified."""
+        gid, game = self._make_game()
+        response = self.fetch("/game/%d/0" % gid)
+        etag = response.headers["Etag"]
+        cookie = response.headers["Set-Cookie"].split(";")[0]
+        headers = {"If-None-Match": etag, "Cookie": cookie}
+        response = self.fetch("/game/%d/0" % gid, headers=headers)
+        assert response.code == 304 and not response.body
+
+        self._app.users.add_user("other-uid", "other-puid")  # in no game
+        response = self.fetch("/game/%d/0" % gid, headers=headers)
+        assert response.code == 304
+
+        game.add_player(game.host, BunnyPalette.RED)
+        response = self.fetch("/game/%d/0" % gid, headers=headers)
+        assert response.code == 200
+
+    def test_api_errors(self):
+        """Tests that an APIError is answered 400 with its code, and no traceback."""
+        gid, _ = self._make_game()
+        with ExpectLog("dixit.server", "GET /game/%d/2: APIError 2" % gid):
+            with ExpectLog("tornado.application", "", required=False) as uncaught:
+                response = self.fetch("/game/%d/2" % gid)  # not enough players
+        assert response.code == 400 and not uncaught.logged_stack
+        assert json.loads(response.body) == {"code": Codes.NOT_ENOUGH_PLAYERS}
+
+    def test_metrics(self):
+        """Tests that commands and their errors show up in the metrics."""
+        gid, game = self._make_game()
+        self.fetch("/game/%d/0" % gid)
+        response = self.fetch("/game/%d/2" % gid)  # not enough players
+        assert json.loads(response.body) == {"code": Codes.NOT_ENOUGH_PLAYERS}
+
+        response = self.fetch("/metrics")
+        assert response.headers["Content-Type"].startswith("text/plain")
+        lines = response.body.decode("utf-8").splitlines()
+        assert "# TYPE dixit_command_duration_seconds histogram" in lines
+        assert 'dixit_command_duration_seconds_count{command="START_GAME"} 1' in lines
+        assert 'dixit_api_errors_total{code="2",name="NOT_ENOUGH_PLAYERS"} 1' in lines
+        assert 'dixit_responses_total{handler="GameHandler",status="400"} 1' in lines
+        assert 'dixit_games{state="BEGIN"} %d' % len(self._app.games) in lines
+
+    def test_game_changes(self):
+        """Tests that ?since=<version> only lists games that changed since."""
+        gid, game = self._make_game()
+        data = json.loads(self.fetch("/getgames?since=0").body)
+        assert gid in [entry["gid"] for entry in data["games"]]
+
+        since = data["version"]
+        data = json.loads(self.fetch("/getgames?since=%d" % since).body)
+        assert data["games"] == data["removed"] == [] and not data["full"]
+
+        game.hide()
+        data = json.loads(self.fetch("/getgames?since=%d" % since).body)
+        assert data["games"] == [] and data["removed"] == [gid]
+
+    def test_chat_rooms(self):
+        """Tests that each game has its own chat room, caught up by sequence id."""
+        gid, game = self._make_game()
+        response = self.fetch("/chat?room=%d" % gid)
+        cookie = response.headers["Set-Cookie"].split(";")[0]
+        lobby_seq = json.loads(self.fetch("/chat").body)["seq"]
+        for msg in ("hello", "world"):
+            self.fetch(
+                "/chat?room=%d" % gid,
+                method="POST",
+                body="msg=" + msg,
+                headers={"Cookie": cookie},
+            )
+        data = json.loads(self.fetch("/chat?room=%d&since=1" % gid).body)
+        assert [m["msg"] for m in data["log"]] == ["world"] and data["seq"] == 2
+        assert json.loads(self.fetch("/chat").body)["seq"] == lobby_seq
+
+        game.hide()
+        self._app.remove_game(gid)
+        assert self._app.get_chat_log(gid) is None
+        response = self.fetch("/chat?room=%d" % gid)
+        assert response.code == 400
+        assert json.loads(response.body) == {"code": Codes.ILLEGAL_RANGE}
+
+    def test_reaper(self):
+        """Tests that the reaper frees finished games and then their users."""
+        gid, game = self._make_game()
+        game.hide()
+        reaper_config = dict(load_settings()["reaper"], user_ttl=0, finished_game_ttl=0)
+        reaper = Reaper(self._app, reaper_config)
+        reaper.reap()
+        assert self._app.get_game(gid) is None
+        assert game.host not in self._app.users
+        assert reaper.freed["expired_games"] >= 1
+        assert reaper.freed["expired_users"] >= 1
+
+    def test_user_cap(self):
+        """Tests that users beyond the cap are evicted before anyone in a game."""
+        _, game = self._make_game()  # after the reaper last ran
+        idle = self._app.users.add_user("idle-uid", "idle-puid")
+        self._app.users.users.move_to_end(game.host.uid, last=False)
+        reaper_config = dict(load_settings()["reaper"], max_users=len(self._app.users))
+        reaper = Reaper(self._app, reaper_config)
+        self._app.users.add_user("new-uid", "new-puid")
+        reaper.enforce_caps()
+        assert game.host in self._app.users and idle not in self._app.users
+
+    def test_user_cap_seated(self):
+        """Tests that users in a game are only evicted along with the game."""
+        gid, game = self._make_game()
+        player = self._app.users.add_user("player-uid", "player-puid")
+        game.add_player(player, BunnyPalette.RED)
+        reaper_config = dict(load_settings()["reaper"], max_users=1)
+        reaper = Reaper(self._app, reaper_config)
+        reaper.enforce_caps()
+        assert len(self._app.users) == 1 and self._app.get_game(gid) is None
+        assert reaper.freed["evicted_games"] == 1
+
+
+class TestBatchCreate(AsyncHTTPTestCase):
+    """Tests for creating and seating many games in one request."""
+
+    def get_app(self):
+        return make_application(admin_enable=True, admin_password=hash_obj("secret"))
+
+    def _post(self, body):
+        return self.fetch("/batch/create", method="POST", body=json.dumps(body))
+
+    def test_batch_create(self):
+        """Tests that each game is created and seated, or fails on its own."""
+        users = self._app.users
+        for i in range(4):
+            users.add_user("uid%d" % i, "puid%d" % i)
+        spec = {"card_sets": [0], "max_players": 3, "max_clue_length": 100}
+        seats = {"puid0": BunnyPalette.RED, "puid1": BunnyPalette.BLUE}
+        games = [
+            dict(spec, name="Table 1", seats=seats, host="puid0"),
+            dict(spec, max_players=100),
+            dict(
+                spec,
+                seats={
+                    "puid1": BunnyPalette.RED,
+                    "puid2": BunnyPalette.RED,
+                    "puid3": "nope",
+                    "unknown": BunnyPalette.BLUE,
+                },
+            ),
+        ]
+        response = self._post({"password": "secret", "games": games})
+        first, second, third = json.loads(response.body)["games"]
+
+        game = self._app.get_game(first["gid"])
+        assert first["errors"] == {} and game.name == "Table 1"
+        assert game.host is users.get_user("uid0")
+        assert [user.puid for user in game.order] == ["puid0", "puid1"]
+        assert second == {"code": Codes.ILLEGAL_RANGE}
+        assert third["errors"] == {
+            "puid2": Codes.COLOUR_TAKEN,
+            "puid3": Codes.NOT_A_COLOUR,
+            "unknown": Codes.UNKNOWN_USER,
+        }
+        game = self._app.get_game(third["gid"])
+        assert game.name == "Game %d" % (third["gid"] + 1)
+        assert list(game.players) == [users.get_user("uid1")]
+
+        # The lobby lists each table once, already seated
+        lobby = self._app.lobby
+        assert lobby.version == 2
+        assert len(lobby.entries[first["gid"]][2]["players"]) == 2
+
+    def test_batch_limits(self):
+        """Tests that batches need the admin password, and are bounded."""
+        games = [{"card_sets": [0], "max_players": 3, "max_clue_length": 100}]
+        assert self._post({"password": "wrong", "games": games}).code == 403
+        games *= self._app.limits.max_batch + 1
+        response = self._post({"password": "secret", "games": games})
+        assert json.loads(response.body) == {"code": Codes.ILLEGAL_RANGE}
+        assert not self._app.games
+
+
+class TestPush(AsyncHTTPTestCase):
+    """Tests for the WebSocket push channel."""
+
+    def get_app(self):
+        return make_application()
+
+    @gen_test
+    async def test_chat(self):
+        """Tests that subscribers are pushed new chat messages."""
+        response = await self.http_client.fetch(self.get_url("/"))
+        cookie = response.headers["Set-Cookie"].split(";")[0]
+        request = HTTPRequest(
+            self.get_url("/push").replace("http", "ws"), headers={"Cookie": cookie}
+        )
+        connection = await websocket_connect(request)
+        connection.write_message(json.dumps({"subscribe": Topics.CHAT, "since": 0}))
+
+        await self.http_client.fetch(
+            self.get_url("/chat"),
+            method="POST",
+            body="msg=hello",
+            headers={"Cookie": cookie},
+        )
+        message = json.loads(await connection.read_message())
+        assert message["topic"] == Topics.CHAT
+        assert message["data"]["log"][-1]["msg"] == "hello"
+        connection.close()
+
+    @gen_test
+    async def test_malformed(self):
+        """Tests that malformed messages are ignored, and keep the connection."""
+        response = await self.http_client.fetch(self.get_url("/"))
+        cookie = response.headers["Set-Cookie"].split(";")[0]
+        request = HTTPRequest(
+            self.get_url("/push").replace("http", "ws"), headers={"Cookie": cookie}
+        )
+        connection = await websocket_connect(request)
+        for message in (1, [], "chat", {"subscribe": 5}, {"unsubscribe": []}):
+            connection.write_message(json.dumps(message))
+        connection.write_message(json.dumps({"subscribe": Topics.CHAT, "since": 0}))
+
+        await self.http_client.fetch(
+            self.get_url("/chat"),
+            method="POST",
+            body="msg=hello",
+            headers={"Cookie": cookie},
+        )
+        message = json.loads(await connection.read_message())
+        assert message["topic"] == Topics.CHAT
+        connection.close()
+
+    @gen_test
+    async def test_board_patches(self):
+        """Tests that boards are pushed in full, and then as patches."""
+        host = self._app.users.add_user("host-uid", "host-puid")
+        game = Game(
+            host, self._app.card_sets, "", "Pushed", 6, INFINITY, 100, self._app.limits
+        )
+        gid = self._app.add_game(game)
+        request = HTTPRequest(
+            self.get_url("/push").replace("http", "ws"),
+            headers={"Cookie": "dixit_user=host-uid"},
+        )
+        connection = await websocket_connect(request)
+        connection.write_message(json.dumps({"subscribe": Topics.game(gid)}))
+        board = json.loads(await connection.read_message())["data"]
+        assert "patchOf" not in board
+
+        game.add_player(host, BunnyPalette.RED)
+        patch = json.loads(await connection.read_message())["data"]
+        assert patch.pop("patchOf") == board["rev"]
+        apply_merge_patch(board, patch)
+        assert board["players"] == {"host-puid": host.name}
+        connection.close()
+
+    async def _connect(self, uid):
+        request = HTTPRequest(
+            self.get_url("/push").replace("http", "ws"),
+            headers={"Cookie": "dixit_user=%s" % uid},
+        )
+        return await websocket_connect(request)
+
+    @gen_test
+    async def test_spectators(self):
+        """Tests that spectators share one encoding of each board revision."""
+        host = self._app.users.add_user("host-uid", "host-puid")
+        game = Game(
+            host, self._app.card_sets, "", "Watched", 6, INFINITY, 100, self._app.limits
+        )
+        gid = self._app.add_game(game)
+        for i in range(5):
+            self._app.users.add_user("uid%d" % i, "puid%d" % i)
+        connections = []
+        for i in range(5):
+            connection = await self._connect("uid%d" % i)
+            connection.write_message(json.dumps({"subscribe": Topics.game(gid)}))
+            connections.append(connection)
+        boards = [json.loads(await c.read_message())["data"] for c in connections]
+        assert boards[0]["user"] is None and not boards[0]["isPlayer"]
+        assert self._app.spectator_boards.encoded == 1
+
+        game.add_player(host, BunnyPalette.RED)
+        messages = [await c.read_message() for c in connections]
+        assert len(set(messages)) == 1 and self._app.spectator_boards.encoded == 2
+        for board, message in zip(boards, messages):
+            apply_merge_patch(board, json.loads(message)["data"])
+            assert board["players"] == {"host-puid": host.name}
+
+        # A spectator who joins is pushed their own board, patched from theirs
+        game.add_player(self._app.users.get_user("uid0"), BunnyPalette.BLUE)
+        patch = json.loads(await connections[0].read_message())["data"]
+        apply_merge_patch(boards[0], patch)
+        assert boards[0]["user"] == "puid0" and boards[0]["isPlayer"]
+
+        # Polling spectators share the encodings too
+        url = "/game/%d/0?base=%s" % (gid, boards[1]["rev"])
+        for uid in ("uid1", "uid2"):
+            headers = {"Cookie": "dixit_user=%s" % uid, "Accept-Encoding": ""}
+            response = await self.http_client.fetch(
+                self.get_url(url), headers=headers, decompress_response=False
+            )
+            assert "patchOf" in json.loads(response.body)
+            self._app.users.add_user(uid + "-friend", uid + "-puid")  # in no game
+        assert self._app.spectator_boards.encoded == 4  # "push" and "json"
+        for connection in connections:
+            connection.close()
+
+    @gen_test
+    async def test_slow_consumer(self):
+        """Tests that a client with too many unsent messages is disconnected."""
+        self._app.push_max_queue = 0
+        self._app.users.add_user("uid", "puid")
+        connection = await self._connect("uid")
+        connection.write_message(json.dumps({"subscribe": Topics.USERS}))
+        assert await connection.read_message() is None
+        assert "dixit_push_dropped_total 1" in self._app.metrics.render()
+
+
+def test_import():
+    """Tests that importing the server neither reads argv nor makes an app."""
+    script = "import sys; import dixit.server as s; print(hasattr(s, 'application'))"
+    output = subprocess.check_output(
+        [sys.executable, "-c", script, "no-such-config.json"], text=True
+    )
+    assert output.strip() == "False"
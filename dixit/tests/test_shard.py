@@ -0,0 +1,131 @@
+import gzip
+import json
+import os
+import tempfile
+
+import pytest
+import tornado.httpserver
+import tornado.ioloop
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port, gen_test
+
+from dixit.core import Game
+from dixit.server import load_settings, make_application
+from dixit.shard import Router, get_worker
+from dixit.store import MemoryStore, SQLiteStore
+from dixit.utils import INFINITY
+import dixit.views as views
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request):
+    if request.param == "memory":
+        yield MemoryStore()
+    else:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            yield SQLiteStore(os.path.join(tmpdir, "store.db"))
+
+
+def test_get_worker():
+    """Tests that requests about a game are routed to the worker that owns it."""
+    assert get_worker("/game/7/0", None, "uid", 3) == 1
+    assert get_worker("/chat", "8", "uid", 3) == 2
+    assert get_worker("/chat", None, "uid", 3) == 0
+    assert get_worker("/getgames", None, "uid", 3) == get_worker("/", None, "uid", 3)
+
+
+async def _sync(workers, rounds=3):
+    for _ in range(rounds):  # e.g., a rename, and then the renamed game
+        for app in workers:
+            await app.shard.sync()
+
+
+def test_shards(store):
+    """Tests that workers share their users and lobby through the store."""
+    tornado.ioloop.IOLoop.current().run_sync(lambda: _test_shards(store))
+
+
+async def _test_shards(store):
+    settings = load_settings()
+    shards = dict(settings["shards"], workers=2)
+    workers = [
+        make_application(settings, shards=shards, worker=i, store=store)
+        for i in range(2)
+    ]
+
+    host = workers[0].users.add_user("host-uid", "host-puid")
+    await workers[0].shard.add_user(host)
+    host = await workers[1].shard.adopt_user("host-uid")
+    assert host.puid == "host-puid"
+
+    game = Game(
+        host, workers[1].card_sets, "", "Shared", 6, INFINITY, 100, workers[1].limits
+    )
+    gid = workers[1].add_game(game)
+    assert workers[1].shard.owns(gid) and gid % 2 == 1
+    await _sync(workers)
+    user = workers[0].users.get_user("host-uid")
+    (entry,) = views.game_list(workers[0], user)
+    assert entry["gid"] == gid and entry["name"] == "Shared" and entry["isHost"]
+
+    workers[0].users.set_name(user, "Renamed")
+    workers[0].users.ping(user)
+    await _sync(workers)
+    assert host.name == "Renamed"
+    assert views.game_list(workers[0], user)[0]["host"] == "Renamed"
+
+    game.hide()
+    await _sync(workers)
+    assert views.game_list(workers[0], user) == []
+
+
+class TestAdoption(AsyncHTTPTestCase):
+    """Tests for users who come to a worker after another worker added them."""
+
+    def get_app(self):
+        settings = load_settings()
+        shards = dict(settings["shards"], workers=2)
+        self.store = MemoryStore()
+        self.other = make_application(
+            settings, shards=shards, worker=0, store=self.store
+        )
+        return make_application(settings, shards=shards, worker=1, store=self.store)
+
+    @gen_test
+    async def test_adoption(self):
+        """Tests that a user of another worker is adopted, and a new one stored."""
+        user = self.other.users.add_user("other-uid", "other-puid")
+        await self.other.shard.add_user(user)
+        headers = {"Cookie": "dixit_user=other-uid"}
+        await self.http_client.fetch(self.get_url("/getusers"), headers=headers)
+        assert self._app.users.get_user("other-uid").puid == "other-puid"
+
+        response = await self.http_client.fetch(self.get_url("/getusers"))
+        uid = response.headers["Set-Cookie"].split(";")[0].split("=")[1]
+        assert self.store.get_user(uid)[1] == self._app.users.get_user(uid).puid
+
+
+class TestRouter(AsyncHTTPTestCase):
+    """Tests for forwarding requests to the workers."""
+
+    def get_app(self):
+        self.worker = make_application()
+        sock, port = bind_unused_port()
+        self.server = tornado.httpserver.HTTPServer(self.worker)
+        self.server.add_sockets([sock])
+        return Router([port], "dixit_user", 30)
+
+    def tearDown(self):
+        self.server.stop()
+        super(TestRouter, self).tearDown()
+
+    def test_gzip(self):
+        """Tests that a gzipped response is forwarded as it is."""
+        for i in range(100):
+            self.worker.users.add_user("uid%d" % i, "puid%d" % i)
+        response = self.fetch(
+            "/getusers",
+            headers={"Accept-Encoding": "gzip"},
+            decompress_response=False,
+        )
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert len(json.loads(gzip.decompress(response.body))) == 101
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from dixit.benchmarks.core import make_card_sets, make_context, make_game, make_users
+from dixit.core import States, StringClue
+from dixit.simulator import AccuracyPolicy, BatchGames, Policy
+from dixit.utils import INFINITY
+
+
+@pytest.mark.parametrize("players", [3, 4, 5, 6])
+@pytest.mark.parametrize("policy", [Policy(), AccuracyPolicy(0.5)], ids=type)
+@pytest.mark.parametrize("max_score", [12, INFINITY])
+def test_cross_check(players, policy, max_score):
+    """Tests that the simulator scores and ends games exactly like dixit.core."""
+    deck_size = players * 10 + 2  # the last round cannot deal to everyone
+    sim = BatchGames(8, players, deck_size, max_score, rng=players)
+
+    context = make_context()
+    users = make_users(context, players)
+    games = []
+    for seed in range(len(sim.scores)):
+        game = make_game(context, make_card_sets(deck_size), users, seed)
+        game.max_score = max_score
+        game.start_game()
+        games.append(game)
+
+    while sim.active.any():
+        result = sim.play_round(policy)
+        for g, game in enumerate(games):
+            if not result.active[g]:
+                assert game.state == States.END
+                continue
+            seated = game.order  # seat k is game.order[k]
+            clue_maker = seated[result.clue_makers[g]]
+            assert game.clue_maker() == clue_maker
+            game.create_clue(
+                clue_maker, StringClue("a clue"), game.players[clue_maker].hand[0]
+            )
+            for user in seated:
+                if user != clue_maker:
+                    game.play_card(user, game.players[user].hand[0])
+            for user, seat in zip(seated, result.votes[g]):
+                if user != clue_maker:
+                    card = game.round.get_played_card(seated[seat])
+                    game.cast_vote(user, card)
+
+            scores = dict(game.round.get_scores())
+            assert [scores[user] for user in seated] == list(result.scores[g])
+            totals = [game.players[user].score for user in seated]
+            assert totals == list(sim.scores[g])
+            assert game.deck.left() == sim.left()
+            assert (game.state == States.END) == (not sim.active[g])
@@ -1,45 +1,49 @@
 """Data for all User objects across all games."""
 
+from collections import OrderedDict
 import time
 
+from dixit.utils import ACTIVITY_RESOLUTION
+
 
 class User:
     """Data for one user across multiple games."""
 
-    def __init__(self, limits, uid, puid):
-        """Creates a new user with the given uid (private) and puid (public)."""
-        self.limits = limits
+    __slots__ = ("uid", "puid", "name", "name_version", "last_active")
 
+    def __init__(self, uid, puid, name):
+        """Creates a new user with the given uid (private) and puid (public)."""
         self.uid = uid  # this id should never be exposed to the user
         self.puid = puid  # this id is exposed to all users
-
+        self.name = name
+        self.name_version = 0  # bumped whenever the name changes
         self.ping()
-        self.set_name("player.%s" % puid[:4])
 
     def ping(self):
         """Updates the user to appear currently active."""
         self.last_active = time.time()
 
-    def set_name(self, name):
-        """Modifies the user's name."""
-        if len(name) >= self.limits.min_user_name:
-            self.name = name[: self.limits.max_user_name]
-        return self.name
-
 
 class Users:
     """Data for all users."""
 
     def __init__(self, limits):
         """Initializes an empty data structure."""
-        self.users = {}
+        self.users = OrderedDict()  # uid -> User, least recently active first
         self.users_by_puid = {}
         self.limits = limits
 
+        self.version = 0  # bumped whenever the list of users changes
+        self.listeners = []  # callables notified with this object after changed()
+
     def __iter__(self):
-        """Iterates over all User objects."""
+        """Iterates over all User objects, least recently active first."""
         return iter(self.users.values())
 
+    def __len__(self):
+        """Returns the number of users."""
+        return len(self.users)
+
     def has_user(self, uid):
         """Returns true iff there exists a User with the given private uid."""
         return uid in self.users
@@ -52,9 +56,68 @@ class Users:
         """Returns the User with the given public puid, or raises KeyError."""
         return self.users_by_puid[puid]
 
-    def add_user(self, uid, puid):
-        """Adds and returns a new user with a given private uid and puid."""
-        user = User(self.limits, uid, puid)
+    def add_user(self, uid, puid, last_active=None):
+        """Adds and returns a new user with a given private uid and puid.
+
+        A user who was last active at some given time, e.g., as seen by another
+        process, is added as the least recently active.
+        """
+        user = User(uid, puid, ("player.%s" % puid[:4])[: self.limits.max_user_name])
         self.users[uid] = user
+        if last_active is not None:
+            user.last_active = last_active
+            self.users.move_to_end(uid, last=False)
         self.users_by_puid[puid] = user
+        self.changed()
         return user
+
+    def load(self, users):
+        """Replaces all users with the given OrderedDict of uid -> User."""
+        self.users = users
+        self.users_by_puid = dict((user.puid, user) for user in users.values())
+        self.changed()
+
+    def remove_user(self, user):
+        """Forgets the given user."""
+        del self.users[user.uid]
+        del self.users_by_puid[user.puid]
+        self.changed()
+
+    def set_name(self, user, name):
+        """Modifies the user's name, and returns their (possibly old) name."""
+        if len(name) >= self.limits.min_user_name:
+            name = name[: self.limits.max_user_name]
+            if name != user.name:
+                user.name = name
+                user.name_version += 1
+                self.changed()
+        return user.name
+
+    def ping(self, user):
+        """Updates the user to appear currently active.
+
+        This is only considered a change if the user was idle for long enough
+        to have been displayed as anything other than currently active.
+        """
+        idle = time.time() - user.last_active
+        user.ping()
+        self.users.move_to_end(user.uid)
+        if idle >= ACTIVITY_RESOLUTION:
+            self.changed()
+
+    def set_last_active(self, user, last_active):
+        """Updates the user to a later last activity, e.g., from another process.
+
+        Unlike ping(), this leaves the order of the users as it is.
+        """
+        if last_active > user.last_active:
+            idle = last_active - user.last_active
+            user.last_active = last_active
+            if idle >= ACTIVITY_RESOLUTION:
+                self.changed()
+
+    def changed(self):
+        """Bumps the version and notifies all listeners of a change."""
+        self.version += 1
+        for listener in self.listeners:
+            listener(self)
@@ -1,12 +1,14 @@
 """Common utilities for this project."""
 
 import contextlib
+import functools
 import hashlib
 import random
 import sys
 import io
 
 INFINITY = 1e9
+ACTIVITY_RESOLUTION = 60  # seconds; activity is only ever displayed in minutes
 SALT = "1c(R$p{Gsjk/5"
 
 
@@ -16,6 +18,33 @@ def hash_obj(obj, salt=SALT, add_random=False, algo=hashlib.sha256):
     return algo(data.encode("utf-8")).hexdigest()
 
 
+@functools.lru_cache(maxsize=64)  # as clients send only a few distinct headers
+def accepts_gzip(accept_encoding):
+    """Returns true iff the Accept-Encoding header accepts gzip.
+
+    That is, iff it lists gzip, or else "*", with a quality value above zero.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    quality = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0)))
+    return quality > 0
+
+
+def activity_interval(t):
+    """Returns the index of the ACTIVITY_RESOLUTION interval containing time t."""
+    return int(t // ACTIVITY_RESOLUTION)
+
+
 def get_sorted_positions(lst, key):
     """Returns the index of each sorted element, allowing for ties."""
     std_lst = sorted((key(x), i) for i, x in enumerate(lst))
@@ -0,0 +1,342 @@
+"""JSON-serializable views of the server state, shared by polling and pushing."""
+
+from collections import deque
+import time
+import weakref
+
+from dixit.core import States
+from dixit.utils import ACTIVITY_RESOLUTION, INFINITY, get_sorted_positions
+
+
+def _rel_last_active(cur_time, last_active):
+    """Returns the seconds since last_active, rounded down to the resolution.
+
+    The current time is rounded down as well, so that lists of activity only
+    change when some object changes or the current time enters a new interval.
+    """
+    idle = max(0, cur_time - cur_time % ACTIVITY_RESOLUTION - last_active)
+    return idle - idle % ACTIVITY_RESOLUTION
+
+
+def _game_entry(cur_time, user, gid, game, summary):
+    """Returns the lobby summary of a game as seen by the given user."""
+    entry = dict(summary)
+    entry["gid"] = gid
+    entry["relLastActive"] = _rel_last_active(cur_time, game.last_active)
+    entry["isHost"] = user == game.host
+    entry["isPlayer"] = user in game.players
+    return entry
+
+
+def game_list(application, user):
+    """Returns a summary of every visible game, most recently active first."""
+    cur_time = time.time()
+    return [
+        _game_entry(cur_time, user, gid, game, summary)
+        for gid, game, summary in application.lobby.listing()
+    ]
+
+
+def game_changes(application, user, since):
+    """Returns the summaries of games that changed since the lobby version.
+
+    If "full" is true then "games" lists every visible game, and any others
+    should be forgotten. Otherwise "removed" lists the gids of games that
+    were hidden since that version.
+    """
+    cur_time = time.time()
+    updated, removed = application.lobby.changes_since(since)
+    return {
+        "version": application.lobby.version,
+        "games": [
+            _game_entry(cur_time, user, gid, game, summary)
+            for gid, game, summary in updated
+        ],
+        "removed": removed or [],
+        "full": removed is None,
+    }
+
+
+def user_list(application):
+    """Returns the name and activity of every user, most recently active first."""
+    cur_time = time.time()
+    entries = sorted(
+        (_rel_last_active(cur_time, user.last_active), user.puid, user.name)
+        for user in application.users
+    )
+    return [{"name": name, "relLastActive": rel} for rel, _, name in entries]
+
+
+def chat_since(chat_log, seq):
+    """Returns all messages posted after seq, and the seq of the latest."""
+    return {"log": chat_log.dump_since(seq), "seq": chat_log.seq}
+
+
+# The private part of the board for a spectator, who is neither a player nor the
+# host, and so sees nothing private. Spectators share their boards, and so their
+# revisions are distinguished by a suffix, to patch against (see get_revision).
+SPECTATOR = {"user": None, "isHost": False, "isPlayer": False, "player": {}}
+SPECTATOR_REV = "s"
+
+
+def is_spectator(user, game):
+    """Returns true iff the user sees the spectators' board of the game."""
+    return user not in game.players and user != game.host
+
+
+def board_version(game):
+    """Returns the version of the game's board, as a pair of integers.
+
+    The board changes with the game, and with the names of its players, but not
+    with any other user, who may come and go in another game.
+    """
+    return game.version, sum(user.name_version for user in game.players)
+
+
+class BoardCache:
+    """Memoizes each game board until either the game or its players change.
+
+    The public part of a board is shared by every viewer of the game, while
+    the private part is memoized separately for each of its players. The last
+    few revisions of each board are kept, to make patches against.
+    """
+
+    HISTORY = 4  # revisions kept per game
+
+    def __init__(self):
+        """Initializes an empty cache."""
+        # Game -> deque of (key, public, {user: private}), the latest last
+        self.entries = weakref.WeakKeyDictionary()
+
+    def get(self, application, user, game):
+        """Returns the public and private parts of the board for the user.
+
+        The user is None for the spectators' board.
+        """
+        key = board_version(game)
+        history = self.entries.get(game)
+        if history is None:
+            history = self.entries[game] = deque(maxlen=self.HISTORY)
+        if not history or history[-1][0] != key:
+            public = public_board(application, game)
+            public["rev"] = "%d.%d" % key
+            history.append((key, public, {}))
+        _, public, privates = history[-1]
+        if user is None:
+            return public, SPECTATOR
+        if user not in game.players:
+            return public, private_board(user, game)  # cheap for non-players
+        private = privates.get(user)
+        if private is None:
+            private = privates[user] = private_board(user, game)
+        return public, private
+
+    def get_revision(self, user, game, rev):
+        """Returns the board that the user was sent at the given revision.
+
+        Returns None if the revision is no longer kept.
+        """
+        spectator = is_spectator_rev(rev)
+        if user is None and not spectator:
+            return None  # as it was of some user's board
+        public_rev = rev[: -len(SPECTATOR_REV)] if spectator else rev
+        for _, public, privates in self.entries.get(game, ()):
+            if public["rev"] == public_rev:
+                blob = dict(public)
+                if spectator:
+                    private = SPECTATOR
+                else:
+                    private = privates.get(user)
+                    if private is None:  # as it is memoized for every player
+                        private = _private_board(user, game, None)
+                blob.update(private)
+                blob["rev"] = rev
+                return blob
+        return None
+
+    def has_spectator_revision(self, game, rev):
+        """Returns true iff the revision is of a spectators' board still kept."""
+        if not is_spectator_rev(rev):
+            return False
+        rev = rev[: -len(SPECTATOR_REV)]
+        return any(public["rev"] == rev for _, public, _ in self.entries.get(game, ()))
+
+
+class SpectatorBoards:
+    """Encodes the spectators' board of each game once per revision.
+
+    A board is kept in each encoding that is asked for (e.g., for pushing, or
+    for polling as gzipped JSON), and as a patch of each revision still kept
+    by the BoardCache, or in full. Such that however many spectators watch a
+    game, each change costs only about one board and one encoding.
+    """
+
+    def __init__(self):
+        """Initializes an empty cache."""
+        # Game -> (rev, {(base or None, encoding): (data, body)})
+        self.entries = weakref.WeakKeyDictionary()
+        self.encoded = 0  # bodies encoded, e.g., for the metrics
+
+    def get(self, application, game, base, encoding, encode):
+        """Returns the spectators' board as a patch of base, and its encoding.
+
+        The board is as in board_patch, and is shared, so must not be mutated.
+        The encoding names the encode function, which returns the board's body.
+        """
+        rev = "%d.%d%s" % (board_version(game) + (SPECTATOR_REV,))
+        entry = self.entries.get(game)
+        if entry is None or entry[0] != rev:
+            entry = self.entries[game] = (rev, {})
+        encoded = entry[1].get((base, encoding))
+        if encoded is None and base is not None:
+            board_cache = application.board_cache
+            if not board_cache.has_spectator_revision(game, base):
+                base = None  # keeps the bodies bounded, whatever bases are asked
+                encoded = entry[1].get((base, encoding))
+        if encoded is None:
+            if base is None:
+                data = board(application, None, game)
+            else:
+                data = board_patch(application, None, game, base)
+            encoded = entry[1][base, encoding] = (data, encode(data))
+            self.encoded += 1
+        return encoded
+
+
+def is_spectator_rev(rev):
+    """Returns true iff the board revision is of a spectators' board."""
+    return rev.endswith(SPECTATOR_REV)
+
+
+def board(application, user, game):
+    """Returns a JSON dictionary summarizing the entire game board.
+
+    Its "rev" identifies the revision of the board, to patch against. The user
+    is None for the board that every spectator sees.
+    """
+    public, private = application.board_cache.get(application, user, game)
+    blob = dict(public)
+    blob.update(private)
+    if private is SPECTATOR:
+        blob["rev"] += SPECTATOR_REV
+    return blob
+
+
+def merge_patch(old, new):
+    """Returns a JSON merge patch (RFC 7386) from the old to the new dict.
+
+    That is, the keys whose values differ, with dicts patched recursively, and
+    None for the keys that were removed.
+    """
+    patch = dict((key, None) for key in old if key not in new)
+    for key, value in new.items():
+        old_value = old.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            if value is not old_value:
+                nested = merge_patch(old_value, value)
+                if nested:
+                    patch[key] = nested
+        elif key not in old or value != old_value:
+            patch[key] = value
+    return patch
+
+
+def apply_merge_patch(target, patch):
+    """Applies a JSON merge patch to the target dict in place, as main.js does."""
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            apply_merge_patch(target[key], value)
+        else:
+            target[key] = value
+
+
+def board_patch(application, user, game, base):
+    """Returns the board as a patch of its revision base, if it is still kept.
+
+    The patch is a merge patch with "patchOf" set to base, or else the board.
+    """
+    blob = board(application, user, game)
+    old = application.board_cache.get_revision(user, game, base)
+    if old is None:
+        return blob
+    patch = merge_patch(old, blob)
+    patch["patchOf"] = base
+    return patch
+
+
+def public_board(application, game):
+    """Returns the part of the board that is the same for every viewer."""
+    players = dict((u.puid, u.name) for u in game.players)
+    scores = dict((u.puid, p.score) for u, p in list(game.players.items()))
+
+    requires_action = {}
+    for u in game.players:
+        requires_action[u.puid] = {
+            States.BEGIN: game.host == u
+            and len(players) >= application.limits.min_players,
+            States.CLUE: game.clue_maker() == u,
+            States.PLAY: not game.round.has_played(u),
+            States.VOTE: not game.round.has_voted(u),
+            States.END: False,  # game.host == u,
+        }[game.state]
+
+    puids = list(players.keys())
+    ranked = get_sorted_positions(puids, key=lambda puid: scores[puid])
+
+    rnd = {}
+    if game.round.has_everyone_played():
+        rnd["cards"] = [card.to_json() for card in game.round.get_cards()]
+        rnd["cardsVersion"] = game.round.number
+    if game.round.has_everyone_voted():
+        rnd["votes"] = dict((u.puid, card.cid) for u, card in game.round.get_votes())
+        rnd["owners"] = dict((u.puid, card.cid) for u, card in game.round.get_played())
+        rnd["votesVersion"] = game.round.number
+    if game.round.clue:
+        rnd["clue"] = str(game.round.clue)
+    if game.round.clue_maker:
+        rnd["clueMaker"] = game.round.clue_maker.puid
+    rnd["scores"] = dict(
+        (u.puid, score) for u, score in game.round.get_scores() if score > 0
+    )
+
+    return {
+        "name": game.name,
+        "host": game.host.puid,
+        "players": players,
+        "colours": dict((u.puid, col) for u, col in list(game.colours.items())),
+        "maxPlayers": game.max_players,
+        "maxScore": game.max_score if game.max_score != INFINITY else None,
+        "maxClueLength": game.max_clue_length,
+        "scores": scores,
+        "order": [u.puid for u in game.order],
+        "turn": game.turn,
+        "ranked": dict((uid, rank) for uid, rank in zip(puids, ranked)),
+        "left": game.deck.left(),
+        "size": game.deck.size(),
+        "state": game.state,
+        "requiresAction": requires_action,
+        "round": rnd,
+        "version": game.version,
+    }
+
+
+def private_board(user, game):
+    """Returns the part of the board that is specific to the given user."""
+    return _private_board(user, game, game.players.get(user))
+
+
+def _private_board(user, game, player):
+    """Returns the private part of the board for the given Player (or None)."""
+    plr = {}
+    if player is not None and player.hand:
+        plr["hand"] = [card.to_json() for card in player.hand]
+        plr["handVersion"] = player.hand_version
+
+    return {
+        "user": user.puid,
+        "isHost": user == game.host,
+        "isPlayer": player is not None,
+        "player": plr,
+    }
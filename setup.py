@@ -30,6 +30,18 @@ tests_req = [
     "pytest",
 ]
 
+sim_req = [
+    "numpy",
+]
+
+images_req = [
+    "Pillow",
+]
+
+msgpack_req = [
+    "msgpack",
+]
+
 setup(
     name="Dixit",
     version="0.1.3",
@@ -42,7 +54,12 @@ setup(
     description="Fan-created server for the board game Dixit",
     long_description=read("README.rst", "CHANGES.rst"),
     install_requires=install_req,
-    extras_require={"tests": tests_req},
+    extras_require={
+        "tests": tests_req,
+        "sim": sim_req,
+        "images": images_req,
+        "msgpack": msgpack_req,
+    },
     zip_safe=False,
     entry_points={"console_scripts": ["dixit = dixit:start"]},
     python_requires=">=3.5",